@@ -1,15 +1,56 @@
-from flask import Flask, render_template, request, jsonify, session
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
-import pandas as pd
-import numpy as np
+from flask import Flask, render_template, request, jsonify, session, g, Response
+from flask.json.provider import DefaultJSONProvider
+import argparse
+import atexit
+import base64
+import bisect
+import copy
+import csv
+import gc
+import gzip
 import hashlib
+import importlib
+import io
+import itertools
 import json
-import pyodbc
+import math
+import sqlite3
+import queue
+import random
+import re
+import shutil
+import signal
+import threading
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
 import os
 import time
+import uuid
+import zlib
+
+class LazyModule:
+    """Stand-in for a heavy module that is imported on first attribute access
+    
+    Keeps `import app` fast so the server can bind a port before pandas and
+    NumPy are loaded. The first access swaps the real module into this
+    module's globals, so later lookups cost nothing extra. sklearn, joblib
+    and pyodbc are imported inside the functions that use them.
+    """
+    
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+pd = LazyModule('pandas', 'pd')
+np = LazyModule('numpy', 'np')
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -24,6 +65,27 @@ SQL_SERVER_CONFIG = {
     'driver': '{ODBC Driver 18 for SQL Server}'
 }
 
+# Connection pool and bulk write settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '500'))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv('DB_WRITE_FLUSH_INTERVAL', '2'))
+
+# Write-behind queue for predictions
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', '10000'))
+PREDICTION_SPILL_FILE = os.getenv('PREDICTION_SPILL_FILE', 'prediction_spill.jsonl')
+SPILL_REPLAY_INTERVAL = float(os.getenv('SPILL_REPLAY_INTERVAL', '30'))
+
+# Storage backend: 'sqlserver' (default) or 'sqlite' for a local embedded file
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlserver').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'insurance.db')
+
+INSERT_PREDICTION_SQL = '''
+    INSERT INTO insurance_predictions (age, gender, bmi, bloodpressure, diabetic, children, smoker, region, actual_claim_final, predicted_claim)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)
+'''
+
 # Predefined users database
 USERS_DB = {
     "admin": hashlib.sha256("admin123".encode()).hexdigest(),
@@ -31,12 +93,274 @@ USERS_DB = {
     "user": hashlib.sha256("user123".encode()).hexdigest(),
 }
 
-# Global variables for data and model
-df = None
-model = None
-le_dict = {}
-db_connected = False
-last_model_train_time = None
+# Model feature layout (order matters for model.predict)
+FEATURE_COLUMNS = ['age', 'gender', 'bmi', 'bloodpressure', 'diabetic', 'children', 'smoker', 'region']
+CATEGORICAL_COLUMNS = ['gender', 'diabetic', 'smoker', 'region']
+
+# Training data loading (0 = no memory budget)
+LOAD_CHUNK_ROWS = int(os.getenv('LOAD_CHUNK_ROWS', '100000'))
+LOAD_MEMORY_BUDGET_MB = float(os.getenv('LOAD_MEMORY_BUDGET_MB', '0'))
+
+# Incremental retraining: new trees are fitted on the newest rows only
+INCREMENTAL_WINDOW_ROWS = int(os.getenv('INCREMENTAL_WINDOW_ROWS', '50000'))
+
+# Inference backend: 'sklearn' (default) or 'flat' for the array-based forest walker
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'sklearn').lower()
+FLAT_MAX_ROWS = int(os.getenv('FLAT_MAX_ROWS', '256'))
+PARITY_CHECK_ROWS = 256
+
+# Prediction result cache (size 0 disables; a redis:// URL shares it across workers)
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '10000'))
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '3600'))
+PREDICTION_CACHE_URL = os.getenv('PREDICTION_CACHE_URL', '')
+# Shared cache socket timeout, and how long to stop calling it after repeated errors
+PREDICTION_CACHE_TIMEOUT = float(os.getenv('PREDICTION_CACHE_TIMEOUT', '0.005'))
+PREDICTION_CACHE_COOLDOWN = float(os.getenv('PREDICTION_CACHE_COOLDOWN', '10'))
+PREDICTION_CACHE_MAX_ERRORS = 3
+
+# Prediction history paging
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+HISTORY_COLUMNS = "id, age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim, prediction_date"
+# Rows fetched per round trip when streaming a history export
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '5000'))
+
+# Batch scoring limits
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', '250000'))
+
+# Token-bucket rate limits per endpoint class: (per-user requests/second, per-user burst,
+# global requests/second, global burst); a rate of 0 disables that bucket.
+# RATE_LIMITS overrides classes with JSON, e.g. {"predict": [50, 100, 0, 0]}
+RATE_LIMITS_ENABLED = os.getenv('RATE_LIMITS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMITS = {
+    'predict': (20, 40, 0, 0),
+    'batch': (1, 5, 5, 10),
+    'dashboard': (5, 20, 0, 0),
+    'history': (5, 20, 0, 0),
+    'export': (0.1, 2, 0.5, 4),
+    'retrain': (1 / 60, 3, 0.1, 5)
+}
+RATE_LIMITS.update({name: tuple(limits) for name, limits in json.loads(os.getenv('RATE_LIMITS', '{}')).items()})
+# Admission control: concurrent requests doing inference or database work. Extra
+# requests wait up to ADMISSION_WAIT_SECONDS in a queue of ADMISSION_QUEUE; beyond that they get 503
+MAX_INFERENCE_CONCURRENCY = int(os.getenv('MAX_INFERENCE_CONCURRENCY', '0'))  # 0 = two per CPU in the budget
+MAX_DB_CONCURRENCY = int(os.getenv('MAX_DB_CONCURRENCY', str(DB_POOL_SIZE)))
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', '64'))
+ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '0.5'))
+
+# Model artifact storage
+MODEL_DIR = os.getenv('MODEL_DIR', 'models')
+# Named models and traffic routing, e.g. {"split": {"primary": 90, "challenger": 10}, "regions": {"southeast": "southeast"}}
+PRIMARY_MODEL = 'primary'
+MODEL_ROUTES = os.getenv('MODEL_ROUTES')
+MODEL_ROUTES_FILE = os.path.join(MODEL_DIR, 'routes.json')
+MODEL_NAME_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+MODEL_KEEP_VERSIONS = int(os.getenv('MODEL_KEEP_VERSIONS', '5'))
+MODEL_ARTIFACT_FORMAT = 1
+# Dashboard payloads are rebuilt for new predictions at most once per this many seconds
+PAYLOAD_REFRESH_SECONDS = float(os.getenv('PAYLOAD_REFRESH_SECONDS', '5'))
+# Columnar training-data snapshot: one .npy per column, memory-mapped on load
+TRAINING_SNAPSHOT_DIR = os.path.join(MODEL_DIR, 'snapshot')
+TRAINING_SNAPSHOT_FORMAT = 1
+
+# Drift monitoring: prediction traffic compared with the primary model's training data
+DRIFT_NUMERIC_COLUMNS = ['age', 'bmi', 'bloodpressure']
+DRIFT_BINS = int(os.getenv('DRIFT_BINS', '10'))
+DRIFT_MIN_ROWS = int(os.getenv('DRIFT_MIN_ROWS', '500'))
+DRIFT_HALF_LIFE_HOURS = float(os.getenv('DRIFT_HALF_LIFE_HOURS', '24'))  # 0 = no decay of older traffic
+DRIFT_PSI_WARN = 0.1
+DRIFT_PSI_THRESHOLD = float(os.getenv('DRIFT_PSI_THRESHOLD', '0.25'))
+DRIFT_CHECK_SECONDS = float(os.getenv('DRIFT_CHECK_SECONDS', '30'))
+DRIFT_PENDING_MAX = 200000
+DRIFT_AUTO_RETRAIN = os.getenv('DRIFT_AUTO_RETRAIN', 'false').lower() in ('1', 'true', 'yes')
+DRIFT_RETRAIN_MODE = os.getenv('DRIFT_RETRAIN_MODE', 'full')
+DRIFT_RETRAIN_COOLDOWN_HOURS = float(os.getenv('DRIFT_RETRAIN_COOLDOWN_HOURS', '6'))
+
+# Random forest hyperparameters shared by full and incremental training
+FOREST_PARAMS = {
+    'random_state': 42,
+    'n_jobs': -1,
+    'max_depth': 20,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2
+}
+
+# Hyperparameter search (retrain mode=search)
+# Seconds for the CV rounds and finalist fits; the final refit on every row comes on top
+SEARCH_TIME_BUDGET = float(os.getenv('SEARCH_TIME_BUDGET', '300'))
+SEARCH_CV_FOLDS = int(os.getenv('SEARCH_CV_FOLDS', '3'))
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', str(os.cpu_count() or 1)))
+SEARCH_HOLDOUT_FRACTION = float(os.getenv('SEARCH_HOLDOUT_FRACTION', '0.2'))
+SEARCH_ELIMINATION_FACTOR = 3
+SEARCH_MIN_ROWS = 500
+SEARCH_FINALISTS = 3
+# Finalists within this relative MAE of the best are ranked by latency instead
+SEARCH_ERROR_TOLERANCE = float(os.getenv('SEARCH_ERROR_TOLERANCE', '0.02'))
+
+# Server settings; `python app.py serve` runs gunicorn with preloaded workers
+APP_HOST = os.getenv('APP_HOST', 'localhost')
+APP_PORT = int(os.getenv('APP_PORT', '5000'))
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '0'))  # 0 = one per CPU in the budget
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', '4'))
+SERVE_TIMEOUT = int(os.getenv('SERVE_TIMEOUT', '120'))
+
+# Latency metrics exposed on /metrics
+METRICS_PREFIX = 'insurance'
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+# Background retrain jobs
+retrain_jobs = OrderedDict()
+retrain_jobs_lock = threading.Lock()
+RETRAIN_JOBS_KEEP = 20
+RETRAIN_JOBS_DIR = os.path.join(MODEL_DIR, 'jobs')
+
+# Set in serve-mode workers so a new model can trigger a rolling reload
+serve_master_pid = None
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with interpolated quantiles
+    
+    Memory stays constant however many observations arrive; quantiles are
+    estimated by linear interpolation inside the bucket that holds them,
+    the same way Prometheus' histogram_quantile does.
+    """
+    
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+    
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+class Metrics:
+    """Thread-safe registry of latency histograms and counters
+    
+    Series are keyed by metric name plus a sorted tuple of label pairs.
+    """
+    
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.started_at = time.time()
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+    
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the with-block into the named histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def summary(self):
+        """Quantiles, count and sum per series, for JSON consumers"""
+        with self._lock:
+            return [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                **{f'p{round(q * 100)}': histogram.quantile(q) for q in self.QUANTILES}
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+    
+    def render(self, gauges):
+        """Render all series plus the given (name, labels, value) gauges in Prometheus text format"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+        
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            
+            for name in sorted({name for (name, _), _ in histograms}):
+                metric = f'{METRICS_PREFIX}_{name}_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                for (series_name, labels), histogram in histograms:
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{metric}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{metric}_sum{label_text(labels)} {histogram.sum:.6f}')
+                    lines.append(f'{metric}_count{label_text(labels)} {histogram.count}')
+                
+                lines.append(f'# TYPE {metric}_quantile gauge')
+                for (series_name, labels), histogram in histograms:
+                    if series_name != name:
+                        continue
+                    for q in self.QUANTILES:
+                        value = histogram.quantile(q)
+                        if value is not None:
+                            lines.append(f'{metric}_quantile{label_text(labels, [("quantile", q)])} {value:.6f}')
+            
+            for name in sorted({name for (name, _), _ in counters}):
+                metric = f'{METRICS_PREFIX}_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                for (series_name, labels), value in counters:
+                    if series_name == name:
+                        lines.append(f'{metric}{label_text(labels)} {value}')
+        
+        typed = set()
+        for name, labels, value in gauges:
+            if value is None or isinstance(value, str):
+                continue
+            metric = f'{METRICS_PREFIX}_{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} gauge')
+                typed.add(metric)
+            lines.append(f'{metric}{label_text(sorted(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that records serialization time for responses"""
+    
+    def dumps(self, obj, **kwargs):
+        with metrics.timer('json_serialize'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
 
 def hash_password(password):
     """Hash a password for comparison"""
@@ -46,152 +370,1190 @@ def get_db_connection(use_master=False):
     """Get SQL Server connection"""
     try:
         db = 'master' if use_master else SQL_SERVER_CONFIG['database']
-        conn = pyodbc.connect(
-            f'Driver={SQL_SERVER_CONFIG["driver"]};'
-            f'Server={SQL_SERVER_CONFIG["server"]};'
-            f'Database={db};'
-            f'UID={SQL_SERVER_CONFIG["username"]};'
-            f'PWD={SQL_SERVER_CONFIG["password"]};'
-            'TrustServerCertificate=yes;'
-            'Connection Timeout=5;'
-        )
+        import pyodbc
+        with metrics.timer('db_connect', backend='sqlserver'):
+            conn = pyodbc.connect(
+                f'Driver={SQL_SERVER_CONFIG["driver"]};'
+                f'Server={SQL_SERVER_CONFIG["server"]};'
+                f'Database={db};'
+                f'UID={SQL_SERVER_CONFIG["username"]};'
+                f'PWD={SQL_SERVER_CONFIG["password"]};'
+                'TrustServerCertificate=yes;'
+                'Connection Timeout=5;'
+            )
         conn.autocommit = False
         return conn
     except Exception as e:
         print(f"⚠️ Database connection error: {str(e)}")
         return None
 
-def init_database():
-    """Initialize database tables"""
-    global db_connected
-    try:
-        # First, create database if it doesn't exist
-        conn_master = get_db_connection(use_master=True)
-        if not conn_master:
-            print("⚠️ SQL Server not accessible. Using local CSV storage.")
-            db_connected = False
+class ConnectionPool:
+    """Bounded, thread-safe pool of SQL Server connections
+    
+    Idle connections are reused instead of paying the connect handshake on
+    every request. A connection that has been idle longer than the health
+    check interval is pinged before it is handed out and replaced if dead.
+    """
+    
+    def __init__(self, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._created = 0
+        self._reconnects = 0
+    
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
             return False
+    
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def acquire(self):
+        """Get a connection from the pool, or None if unavailable"""
+        if not self._slots.acquire(timeout=self.timeout):
+            print("⚠️ Database pool exhausted")
+            return None
+        
+        conn = None
+        while conn is None:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._reconnects += 1
+                conn = None
+        
+        if conn is None:
+            conn = get_db_connection()
+            if conn is None:
+                self._slots.release()
+                return None
+            with self._lock:
+                self._created += 1
+        
+        with self._lock:
+            self._in_use += 1
+        return conn
+    
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it if discard is set"""
+        if conn is None:
+            return
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close_quietly(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection (or None)
+        
+        Connections whose block does not finish normally are discarded so the
+        next caller reconnects instead of inheriting a broken handle. That
+        includes GeneratorExit from a generator closed mid-read, so the pool
+        slot is always given back.
+        """
+        conn = self.acquire()
+        finished = False
+        try:
+            yield conn
+            finished = True
+        finally:
+            self.release(conn, discard=not finished)
+    
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(conn)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'created': self._created,
+                'reconnects': self._reconnects
+            }
+
+db_pool = ConnectionPool()
+
+class StorageBackend:
+    """Common storage operations shared by the SQL backends
+    
+    Subclasses provide connection(), streaming_connection(), init() and the few dialect differences
+    (row limits, parameter and row conversion); everything else is plain
+    SQL that both SQL Server and SQLite accept.
+    """
+    
+    name = None
+    connected = False
+    
+    def limit_query(self, select_sql, limit):
+        raise NotImplementedError
+    
+    def target(self):
+        """Where the data lives, so a snapshot of another database is never reused"""
+        raise NotImplementedError
+    
+    def adapt_params(self, params):
+        return list(params)
+    
+    def convert_history_row(self, row):
+        return tuple(row)
+    
+    def stats(self):
+        return {}
+    
+    def close(self):
+        """Close connections held by this process, e.g. before forking workers"""
+    
+    def insert_predictions(self, rows):
+        """Insert prediction rows in one transaction, returning the count"""
+        if not rows:
+            return 0
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection for bulk insert')
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_PREDICTION_SQL, rows)
+            conn.commit()
+            cursor.close()
+        return len(rows)
+    
+    def save_model_metrics(self, total_records, accuracy, notes, mode, delta_records, train_seconds, model_type='RandomForest'):
+        with self.connection() as conn:
+            if not conn:
+                return
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO model_metrics (total_records, model_type, accuracy, notes, train_mode, delta_records, train_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (total_records, model_type, accuracy, notes, mode, delta_records, train_seconds))
+            conn.commit()
+            cursor.close()
+    
+    def max_prediction_id(self):
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection')
+            with metrics.timer('db_query', backend=self.name, operation='max_id'):
+                cursor = conn.cursor()
+                cursor.execute("SELECT MAX(id) FROM insurance_predictions")
+                max_id = cursor.fetchone()[0]
+                cursor.close()
+        return max_id
+    
+    def count_predictions(self):
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection')
+            with metrics.timer('db_query', backend=self.name, operation='count'):
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM insurance_predictions")
+                count = cursor.fetchone()[0]
+                cursor.close()
+        return count
+    
+    def read_prediction_chunks(self, query, params=()):
+        """Yield raw DataFrame chunks of a SELECT over insurance_predictions"""
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection')
+            yield from pd.read_sql(query, conn, params=self.adapt_params(params), chunksize=LOAD_CHUNK_ROWS)
+    
+    def fetch_history(self, clauses, params, limit):
+        """Return up to limit history rows (HISTORY_COLUMNS order), newest first"""
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        query = self.limit_query(f"SELECT {HISTORY_COLUMNS} FROM insurance_predictions {where} ORDER BY prediction_date DESC, id DESC", limit)
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection')
+            with metrics.timer('db_query', backend=self.name, operation='history'):
+                cursor = conn.cursor()
+                cursor.execute(query, self.adapt_params(params))
+                rows = cursor.fetchall()
+                cursor.close()
+        return [self.convert_history_row(row) for row in rows]
+    
+    def iter_history(self, clauses, params, batch_rows=EXPORT_BATCH_ROWS):
+        """Yield every matching history row (HISTORY_COLUMNS order), newest first, in lists of batch_rows
         
-        cursor = conn_master.cursor()
-        # Set autocommit mode for CREATE DATABASE
-        conn_master.autocommit = True
+        Rows come off an open cursor with fetchmany, so one batch is in memory
+        at a time however large the result is.
+        """
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        query = f"SELECT {HISTORY_COLUMNS} FROM insurance_predictions {where} ORDER BY prediction_date DESC, id DESC"
+        with self.streaming_connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection')
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, self.adapt_params(params))
+                while True:
+                    with metrics.timer('db_query', backend=self.name, operation='export'):
+                        rows = cursor.fetchmany(batch_rows)
+                    if not rows:
+                        break
+                    yield [self.convert_history_row(row) for row in rows]
+            finally:
+                cursor.close()
+
+class SqlServerStorage(StorageBackend):
+    """SQL Server storage through the pooled pyodbc connections"""
+    
+    name = 'sqlserver'
+    
+    def connection(self):
+        return db_pool.connection()
+    
+    @contextmanager
+    def streaming_connection(self):
+        """Pooled connection held for a streamed read
+        
+        pyodbc's default forward-only cursor streams the result set from the
+        server as it is fetched. The connection is discarded if the reader
+        stops early (client disconnect), since the server may still be sending.
+        """
+        conn = db_pool.acquire()
+        finished = False
         try:
-            cursor.execute(f"IF NOT EXISTS (SELECT * FROM sys.databases WHERE name='{SQL_SERVER_CONFIG['database']}') CREATE DATABASE {SQL_SERVER_CONFIG['database']}")
+            yield conn
+            finished = True
+        finally:
+            db_pool.release(conn, discard=not finished)
+    
+    def limit_query(self, select_sql, limit):
+        return select_sql.replace('SELECT ', f'SELECT TOP ({int(limit)}) ', 1)
+    
+    def target(self):
+        return f"{SQL_SERVER_CONFIG['server']}/{SQL_SERVER_CONFIG['database']}"
+    
+    def stats(self):
+        return db_pool.stats()
+    
+    def close(self):
+        db_pool.close_all()
+    
+    def insert_predictions(self, rows):
+        """Insert many prediction rows in one round trip using fast_executemany"""
+        if not rows:
+            return 0
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('Could not establish database connection for bulk insert')
+            cursor = conn.cursor()
+            cursor.fast_executemany = True
+            cursor.executemany(INSERT_PREDICTION_SQL, rows)
+            conn.commit()
+            cursor.close()
+        return len(rows)
+    
+    def init(self):
+        """Create the database, tables and indexes; returns True if usable"""
+        try:
+            # First, create database if it doesn't exist
+            conn_master = get_db_connection(use_master=True)
+            if not conn_master:
+                print("⚠️ SQL Server not accessible. Using local CSV storage.")
+                return False
+            
+            cursor = conn_master.cursor()
+            # Set autocommit mode for CREATE DATABASE
+            conn_master.autocommit = True
+            try:
+                cursor.execute(f"IF NOT EXISTS (SELECT * FROM sys.databases WHERE name='{SQL_SERVER_CONFIG['database']}') CREATE DATABASE {SQL_SERVER_CONFIG['database']}")
+            except Exception as e:
+                print(f"⚠️ Could not create database: {str(e)}")
+            conn_master.autocommit = False
+            cursor.close()
+            conn_master.close()
+            
+            # Now connect to the created database
+            with db_pool.connection() as conn:
+                if not conn:
+                    print("⚠️ Could not connect to created database. Using CSV storage.")
+                    return False
+                
+                cursor = conn.cursor()
+                
+                # Create tables
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='insurance_predictions' AND xtype='U')
+                    CREATE TABLE insurance_predictions (
+                        id INT IDENTITY(1,1) PRIMARY KEY,
+                        age INT NOT NULL,
+                        gender VARCHAR(10) NOT NULL,
+                        bmi FLOAT NOT NULL,
+                        bloodpressure INT NOT NULL,
+                        diabetic VARCHAR(10) NOT NULL,
+                        children INT NOT NULL,
+                        smoker VARCHAR(10) NOT NULL,
+                        region VARCHAR(20) NOT NULL,
+                        predicted_claim FLOAT NOT NULL,
+                        created_at DATETIME DEFAULT GETDATE()
+                    )
+                ''')
+                
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='model_metrics' AND xtype='U')
+                    CREATE TABLE model_metrics (
+                        id INT IDENTITY(1,1) PRIMARY KEY,
+                        train_date DATETIME DEFAULT GETDATE(),
+                        total_records INT,
+                        model_type VARCHAR(50),
+                        accuracy FLOAT,
+                        notes VARCHAR(500)
+                    )
+                ''')
+                
+                # Columns added for incremental retraining
+                cursor.execute('''
+                    IF COL_LENGTH('model_metrics', 'train_mode') IS NULL
+                    ALTER TABLE model_metrics ADD train_mode VARCHAR(20) NULL, delta_records INT NULL, train_seconds FLOAT NULL
+                ''')
+                
+                conn.commit()
+                
+                # Keyset index for paging history newest-first
+                try:
+                    cursor.execute('''
+                        IF COL_LENGTH('insurance_predictions', 'prediction_date') IS NOT NULL
+                        AND NOT EXISTS (SELECT * FROM sys.indexes WHERE name='IX_insurance_predictions_date_id' AND object_id=OBJECT_ID('insurance_predictions'))
+                        EXEC('CREATE INDEX IX_insurance_predictions_date_id ON insurance_predictions (prediction_date DESC, id DESC)
+                              INCLUDE (age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim)')
+                    ''')
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"⚠️ Could not create history index: {str(e)}")
+                
+                cursor.close()
+            
+            print("✅ Database initialized successfully")
+            return True
         except Exception as e:
-            print(f"⚠️ Could not create database: {str(e)}")
-        conn_master.autocommit = False
-        cursor.close()
-        conn_master.close()
-        
-        # Now connect to the created database
-        conn = get_db_connection()
-        if not conn:
-            print("⚠️ Could not connect to created database. Using CSV storage.")
-            db_connected = False
+            print(f"⚠️ Error initializing database: {str(e)}")
+            print("💾 Will use local CSV storage for predictions")
             return False
+
+class SQLiteStorage(StorageBackend):
+    """Embedded SQLite storage for edge deployments and local testing
+    
+    Runs in WAL mode so the background writer can append while requests
+    read. Each thread keeps its own connection. Timestamps are stored as
+    local-time text with millisecond precision, which sorts like the
+    DATETIME column does on SQL Server.
+    """
+    
+    name = 'sqlite'
+    
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+    
+    def target(self):
+        return os.path.abspath(self.path)
+    
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with metrics.timer('db_connect', backend='sqlite'):
+                conn = sqlite3.connect(self.path, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+    
+    @contextmanager
+    def streaming_connection(self):
+        """Dedicated connection for a streamed read
         
-        cursor = conn.cursor()
-        
-        # Create tables
-        cursor.execute('''
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='insurance_predictions' AND xtype='U')
-            CREATE TABLE insurance_predictions (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                age INT NOT NULL,
-                gender VARCHAR(10) NOT NULL,
-                bmi FLOAT NOT NULL,
-                bloodpressure INT NOT NULL,
-                diabetic VARCHAR(10) NOT NULL,
-                children INT NOT NULL,
-                smoker VARCHAR(10) NOT NULL,
-                region VARCHAR(20) NOT NULL,
-                predicted_claim FLOAT NOT NULL,
-                created_at DATETIME DEFAULT GETDATE()
-            )
-        ''')
-        
-        cursor.execute('''
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='model_metrics' AND xtype='U')
-            CREATE TABLE model_metrics (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                train_date DATETIME DEFAULT GETDATE(),
-                total_records INT,
-                model_type VARCHAR(50),
-                accuracy FLOAT,
-                notes VARCHAR(500)
-            )
-        ''')
+        Streamed responses may be iterated on a different thread than the one
+        that started them, so they cannot use the per-thread connection. WAL
+        mode lets the read run alongside the background writer.
+        """
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def limit_query(self, select_sql, limit):
+        return f"{select_sql} LIMIT {int(limit)}"
+    
+    def adapt_params(self, params):
+        return [value.strftime('%Y-%m-%d %H:%M:%S.') + f'{value.microsecond // 1000:03d}' if isinstance(value, datetime) else value
+                for value in params]
+    
+    def convert_history_row(self, row):
+        return tuple(row[:-1]) + (datetime.fromisoformat(row[-1]),)
+    
+    def stats(self):
+        return {'path': self.path, 'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+    
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local = threading.local()
+    
+    def init(self):
+        """Create the tables and indexes; returns True if usable"""
+        try:
+            with self.connection() as conn:
+                conn.executescript('''
+                    CREATE TABLE IF NOT EXISTS insurance_predictions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        age INTEGER NOT NULL,
+                        gender TEXT NOT NULL,
+                        bmi REAL NOT NULL,
+                        bloodpressure INTEGER NOT NULL,
+                        diabetic TEXT NOT NULL,
+                        children INTEGER NOT NULL,
+                        smoker TEXT NOT NULL,
+                        region TEXT NOT NULL,
+                        actual_claim_final REAL,
+                        predicted_claim REAL NOT NULL,
+                        prediction_date TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+                    );
+                    CREATE INDEX IF NOT EXISTS IX_insurance_predictions_date_id
+                        ON insurance_predictions (prediction_date DESC, id DESC);
+                    CREATE TABLE IF NOT EXISTS model_metrics (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        train_date TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                        total_records INTEGER,
+                        model_type TEXT,
+                        accuracy REAL,
+                        notes TEXT,
+                        train_mode TEXT,
+                        delta_records INTEGER,
+                        train_seconds REAL
+                    );
+                ''')
+                conn.commit()
+            print(f"✅ SQLite storage initialized at {self.path}")
+            return True
+        except Exception as e:
+            print(f"⚠️ Error initializing SQLite storage: {str(e)}")
+            return False
+
+def create_storage():
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteStorage()
+    return SqlServerStorage()
+
+storage = create_storage()
+
+def init_database():
+    """Initialize the configured storage backend"""
+    storage.connected = storage.init()
+    return storage.connected
+
+class DataAggregates:
+    """Dashboard aggregates maintained incrementally
+    
+    Built once from the loaded frame and then updated per prediction, so the
+    stats and charts endpoints read precomputed numbers instead of rescanning
+    df. Claim count/sum/min/max, age-bin counts, per-smoker claim sums and
+    category counts are exact; the BMI/claim scatter uses a reservoir sample,
+    seeded so the same data always gives the same sample. For caches of the
+    rendered payloads, version changes on every rebuild and is unique across
+    instances (load_data and retrains swap in new instances), and updates
+    counts the records added since.
+    """
+    
+    AGE_BINS = [18, 25, 35, 45, 55, 65]
+    SAMPLE_SIZE = 100
+    _versions = itertools.count(1)
+    
+    def __init__(self, seed=42):
+        self._lock = threading.Lock()
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self.version = next(self._versions)
+        self.updates = 0
+        self._reset()
+    
+    def _reset(self):
+        self.total = 0
+        self.features = 0
+        self.claim_sum = 0.0
+        self.claim_min = None
+        self.claim_max = None
+        self.age_counts = [0] * (len(self.AGE_BINS) - 1)
+        self.smoker_count = {}
+        self.smoker_claim_sum = {}
+        self.category_counts = {'region': {}, 'gender': {}, 'diabetic': {}}
+        self.sample = []
+        self.seen = 0
+    
+    def rebuild(self, frame):
+        """Recompute every aggregate from a full frame"""
+        with self._lock:
+            self._reset()
+            self._rng = random.Random(self.seed)
+            self.version = next(self._versions)
+            self.updates = 0
+            if frame is None or len(frame) == 0:
+                return
+            
+            claims = frame['claim']
+            self.total = len(frame)
+            self.features = len(frame.columns)
+            self.claim_sum = float(claims.sum())
+            self.claim_min = float(claims.min())
+            self.claim_max = float(claims.max())
+            self.age_counts = pd.cut(frame['age'], bins=self.AGE_BINS).value_counts().sort_index().astype(int).tolist()
+            
+            smoker_stats = frame.groupby('smoker', observed=True)['claim'].agg(['sum', 'count'])
+            self.smoker_claim_sum = {k: float(v) for k, v in smoker_stats['sum'].items()}
+            self.smoker_count = {k: int(v) for k, v in smoker_stats['count'].items()}
+            for col in self.category_counts:
+                self.category_counts[col] = {k: int(v) for k, v in frame[col].value_counts().items() if v > 0}
+            
+            sample_size = min(self.SAMPLE_SIZE, len(frame))
+            self.sample = frame[['bmi', 'claim']].sample(sample_size, random_state=self.seed).values.tolist()
+            self.seen = len(frame)
+    
+    def add(self, age, gender, bmi, diabetic, smoker, region, claim):
+        """Fold one new record into the aggregates in O(1)"""
+        claim = float(claim)
+        with self._lock:
+            self.updates += 1
+            self.total += 1
+            self.claim_sum += claim
+            self.claim_min = claim if self.claim_min is None else min(self.claim_min, claim)
+            self.claim_max = claim if self.claim_max is None else max(self.claim_max, claim)
+            
+            # pd.cut bins are right-closed: (18, 25], (25, 35], ...
+            idx = bisect.bisect_left(self.AGE_BINS, age) - 1
+            if 0 <= idx < len(self.age_counts):
+                self.age_counts[idx] += 1
+            
+            self.smoker_count[smoker] = self.smoker_count.get(smoker, 0) + 1
+            self.smoker_claim_sum[smoker] = self.smoker_claim_sum.get(smoker, 0.0) + claim
+            for col, value in (('region', region), ('gender', gender), ('diabetic', diabetic)):
+                counts = self.category_counts[col]
+                counts[value] = counts.get(value, 0) + 1
+            
+            # Reservoir sampling (Algorithm R)
+            self.seen += 1
+            if len(self.sample) < self.SAMPLE_SIZE:
+                self.sample.append([float(bmi), claim])
+            else:
+                j = self._rng.randrange(self.seen)
+                if j < self.SAMPLE_SIZE:
+                    self.sample[j] = [float(bmi), claim]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'total_records': self.total,
+                'avg_claim': self.claim_sum / self.total if self.total else 0.0,
+                'max_claim': self.claim_max if self.claim_max is not None else 0.0,
+                'min_claim': self.claim_min if self.claim_min is not None else 0.0,
+                'features': self.features
+            }
+    
+    def charts(self):
+        with self._lock:
+            return {
+                'age_distribution': {
+                    'labels': [f"{self.AGE_BINS[i]}-{self.AGE_BINS[i+1]}" for i in range(len(self.AGE_BINS)-1)],
+                    'data': list(self.age_counts)
+                },
+                'smoker_impact': {
+                    'mean': {k: self.smoker_claim_sum[k] / n for k, n in self.smoker_count.items()},
+                    'count': dict(self.smoker_count)
+                },
+                'regional_analysis': dict(self.category_counts['region']),
+                'gender_analysis': dict(self.category_counts['gender']),
+                'diabetic_analysis': dict(self.category_counts['diabetic']),
+                'bmi_claim': [list(pair) for pair in self.sample],
+                'total_records': self.total
+            }
+
+data_aggregates = DataAggregates()
+
+class PayloadCache:
+    """Serialized, pre-compressed JSON payloads of the dashboard endpoints
+    
+    Each payload is stored under a key of the versions it is built from (data
+    aggregates, primary model, ...). While the key is unchanged the same bytes,
+    their gzip (and brotli, when installed) encodings and a content-hash ETag
+    are served without rebuilding anything. New predictions only bump the
+    updates count, which is coalesced: an entry is served for up to
+    PAYLOAD_REFRESH_SECONDS after it was built, so under steady traffic each
+    payload is rebuilt (and its ETag changes) at most that often.
+    """
+    
+    Entry = namedtuple('Entry', 'key updates built_at etag encodings')
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+    
+    def get(self, name, key, build, updates=0):
+        """The entry for name at key, building it from build() on a miss"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and entry.key == key and (
+                entry.updates == updates or time.monotonic() - entry.built_at < PAYLOAD_REFRESH_SECONDS):
+            metrics.increment('payload_cache', payload=name, result='hit')
+            return entry
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+        metrics.increment('payload_cache', payload=name, result='miss')
+        built_at = time.monotonic()
+        with metrics.timer('payload_build', payload=name):
+            # Same bytes as jsonify; mtime=0 keeps the gzip encoding deterministic too
+            body = (json.dumps(build(), separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+            encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            try:
+                import brotli
+                encodings['br'] = brotli.compress(body)
+            except ImportError:
+                pass
+        entry = self.Entry(key, updates, built_at, hashlib.sha256(body).hexdigest()[:32], encodings)
+        with self._lock:
+            self._entries[name] = entry
+        return entry
+
+payload_cache = PayloadCache()
+
+def feature_baseline(frame):
+    """Training-time feature distributions that prediction traffic is compared with
+    
+    Numeric features get DRIFT_BINS quantile bins (edges and the share of
+    rows in each) plus their range; categoricals get the share of each value.
+    Small enough to store in the artifact's JSON sidecar.
+    """
+    baseline = {'rows': len(frame), 'numeric': {}, 'categorical': {}}
+    for col in DRIFT_NUMERIC_COLUMNS:
+        values = frame[col].to_numpy(dtype=np.float64)
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, DRIFT_BINS + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        baseline['numeric'][col] = {
+            'edges': edges.tolist(),
+            'proportions': (counts / len(values)).tolist(),
+            'min': float(values.min()),
+            'max': float(values.max())
+        }
+    for col in CATEGORICAL_COLUMNS:
+        counts = frame[col].value_counts()
+        baseline['categorical'][col] = {str(value): int(count) / len(frame) for value, count in counts.items() if count > 0}
+    return baseline
+
+def population_stability_index(expected, actual):
+    """PSI between two proportion vectors over the same bins"""
+    expected = np.maximum(np.asarray(expected, dtype=np.float64), 1e-4)
+    actual = np.maximum(np.asarray(actual, dtype=np.float64), 1e-4)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def drift_status(psi):
+    if psi >= DRIFT_PSI_THRESHOLD:
+        return 'drift'
+    return 'moderate' if psi >= DRIFT_PSI_WARN else 'stable'
+
+class DriftMonitor:
+    """Streaming feature distributions of prediction traffic, scored against the training baseline
+    
+    observe() only appends to a deque, so the predict path does O(1) work
+    and takes no lock. A background thread (and every report) drains the
+    queue in vectorized batches into histograms on the primary model's
+    baseline bins and category counts. Older traffic decays with a half-life
+    of DRIFT_HALF_LIFE_HOURS, and the counts restart whenever a new primary
+    model is published. Every feature gets a PSI; numeric ones also get a
+    KS-style maximum gap between the binned CDFs.
+    """
+    
+    def __init__(self):
+        self._pending = deque(maxlen=DRIFT_PENDING_MAX)
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self.last_trigger = None
+        self._reset(None)
+        # Threads do not survive a fork; serve-mode workers start their own
+        os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+    
+    def _reset(self, baseline):
+        self._baseline = baseline
+        self.rows = 0.0
+        self._updated = time.monotonic()
+        numeric = baseline['numeric'] if baseline else {}
+        categorical = baseline['categorical'] if baseline else {}
+        self._edges = {col: np.asarray(spec['edges']) for col, spec in numeric.items()}
+        self.numeric_counts = {col: np.zeros(len(spec['proportions'])) for col, spec in numeric.items()}
+        self.out_of_range = dict.fromkeys(numeric, 0.0)
+        self.category_counts = {col: {} for col in categorical}
+        self.unseen = dict.fromkeys(categorical, 0.0)
+    
+    def observe(self, fields):
+        """Queue one prediction's normalized fields"""
+        self._pending.append(fields)
+        if self._thread is None:
+            self.start()
+    
+    def observe_batch(self, X, encoders):
+        """Queue a batch of encoded feature rows (FEATURE_COLUMNS order)"""
+        if len(X) > 0:
+            self._pending.append((X, encoders))
+            if self._thread is None:
+                self.start()
+    
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+                self._thread.start()
+    
+    def _fold(self, items):
+        """Add a slice of queued observations to the counts"""
+        baseline = self._baseline
+        singles = [item for item in items if isinstance(item, dict)]
+        batches = [item for item in items if not isinstance(item, dict)]
+        self.rows += len(singles) + sum(len(X) for X, _ in batches)
+        for col, spec in baseline['numeric'].items():
+            i = FEATURE_COLUMNS.index(col)
+            values = np.concatenate([np.fromiter((fields[col] for fields in singles), dtype=np.float64, count=len(singles))]
+                                    + [X[:, i] for X, _ in batches])
+            self.numeric_counts[col] += np.bincount(np.searchsorted(self._edges[col], values, side='right'),
+                                                    minlength=len(spec['proportions']))
+            self.out_of_range[col] += int(((values < spec['min']) | (values > spec['max'])).sum())
+        for col, expected in baseline['categorical'].items():
+            i = FEATURE_COLUMNS.index(col)
+            value_counts = Counter(fields[col] for fields in singles)
+            for X, encoders in batches:
+                codes, code_counts = np.unique(X[:, i].astype(int), return_counts=True)
+                value_counts.update(dict(zip(encoders[col].classes_[codes].tolist(), code_counts.tolist())))
+            counts = self.category_counts[col]
+            for value, count in value_counts.items():
+                counts[value] = counts.get(value, 0.0) + count
+                if value not in expected:
+                    self.unseen[col] += count
+    
+    def _drain(self):
+        """Fold queued observations into the counts; call with the lock held"""
+        primary = model_registry.primary
+        baseline = primary.baseline if primary is not None else None
+        if baseline is not self._baseline:
+            self._reset(baseline)
         
-        db_connected = True
-        print("✅ Database initialized successfully")
-        return True
+        now = time.monotonic()
+        if DRIFT_HALF_LIFE_HOURS > 0 and self.rows > 0:
+            factor = 0.5 ** ((now - self._updated) / (DRIFT_HALF_LIFE_HOURS * 3600))
+            self.rows *= factor
+            for col in self.numeric_counts:
+                self.numeric_counts[col] *= factor
+                self.out_of_range[col] *= factor
+            for col, counts in self.category_counts.items():
+                self.category_counts[col] = {value: count * factor for value, count in counts.items()}
+                self.unseen[col] *= factor
+        self._updated = now
+        
+        # Small slices, yielding the GIL in between, so a large backlog never stalls request threads
+        while self._pending:
+            items = []
+            try:
+                while len(items) < 2000:
+                    items.append(self._pending.popleft())
+            except IndexError:
+                pass
+            if baseline is not None:
+                self._fold(items)
+            time.sleep(0)
+    
+    def report(self):
+        """Drift scores and data-quality rates per feature, plus an overall status"""
+        with self._lock:
+            self._drain()
+            baseline, rows = self._baseline, self.rows
+            if baseline is None:
+                return {'status': 'no_baseline', 'live_rows': 0, 'features': {}}
+            
+            features = {}
+            for col, spec in baseline['numeric'].items():
+                actual = self.numeric_counts[col] / rows if rows else np.zeros(len(spec['proportions']))
+                expected = np.asarray(spec['proportions'])
+                features[col] = {
+                    'type': 'numeric',
+                    'psi': round(population_stability_index(expected, actual), 4),
+                    'ks': round(float(np.abs(np.cumsum(actual) - np.cumsum(expected)).max()), 4),
+                    'out_of_range_rate': round(self.out_of_range[col] / rows, 4) if rows else 0.0
+                }
+            for col, expected in baseline['categorical'].items():
+                counts = self.category_counts[col]
+                values = sorted(set(expected) | set(counts))
+                actual = [counts.get(value, 0.0) / rows if rows else 0.0 for value in values]
+                features[col] = {
+                    'type': 'categorical',
+                    'psi': round(population_stability_index([expected.get(value, 0.0) for value in values], actual), 4),
+                    'unseen_rate': round(self.unseen[col] / rows, 4) if rows else 0.0,
+                    'live_shares': {value: round(share, 4) for value, share in zip(values, actual)}
+                }
+        
+        enough = rows >= DRIFT_MIN_ROWS
+        for feature in features.values():
+            feature['status'] = drift_status(feature['psi']) if enough else 'insufficient_data'
+        if not enough:
+            status = 'insufficient_data'
+        else:
+            order = ('stable', 'moderate', 'drift')
+            status = max((feature['status'] for feature in features.values()), key=order.index)
+        return {
+            'status': status,
+            'live_rows': round(rows, 1),
+            'baseline_rows': baseline['rows'],
+            'features': features
+        }
+    
+    def _run(self):
+        while True:
+            time.sleep(DRIFT_CHECK_SECONDS)
+            try:
+                report = self.report()
+                if DRIFT_AUTO_RETRAIN and report['status'] == 'drift':
+                    self._maybe_retrain(report)
+            except Exception as e:
+                print(f"⚠️ Drift check failed: {str(e)}")
+    
+    def _maybe_retrain(self, report):
+        """Start a retrain for drifted traffic, at most once per cooldown across all workers"""
+        primary = model_registry.primary
+        cooldown = DRIFT_RETRAIN_COOLDOWN_HOURS * 3600
+        if primary is None or (datetime.now() - primary.trained_at).total_seconds() < cooldown:
+            return
+        # The marker is shared by serve-mode workers, which each monitor their own traffic
+        marker = os.path.join(MODEL_DIR, 'drift_retrain.json')
+        try:
+            if time.time() - os.path.getmtime(marker) < cooldown:
+                return
+        except OSError:
+            pass
+        
+        drifted = sorted(name for name, feature in report['features'].items() if feature['status'] == 'drift')
+        job, started = start_retrain_job('drift-monitor', DRIFT_RETRAIN_MODE)
+        if not started:
+            return
+        self.last_trigger = {'job_id': job.id, 'features': drifted, 'at': datetime.now().isoformat()}
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        with open(marker, 'w', encoding='utf-8') as f:
+            json.dump(self.last_trigger, f)
+        print(f"📉 Drift detected in {', '.join(drifted)} - started {DRIFT_RETRAIN_MODE} retrain job {job.id}")
+
+drift_monitor = DriftMonitor()
+
+def compact_chunk(chunk):
+    """Normalize and shrink one chunk of raw training rows
+    
+    Categorical fields are lowercased and stored as pandas categories, and
+    numeric fields are downcast to the smallest dtype that holds them (int8
+    for age and children, float32 for bmi, ...). The target stays float64.
+    """
+    chunk = chunk.dropna()
+    for col in CATEGORICAL_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = chunk[col].astype(str).str.lower().astype('category')
+    for col in ('age', 'bloodpressure', 'children'):
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], downcast='integer')
+    if 'bmi' in chunk.columns:
+        chunk['bmi'] = pd.to_numeric(chunk['bmi'], downcast='float')
+    return chunk
+
+def concat_chunks(chunks):
+    """Concatenate compacted chunks, unifying their category dictionaries"""
+    chunks = [chunk.copy(deep=False) for chunk in chunks]
+    for col in CATEGORICAL_COLUMNS:
+        categories = sorted(set().union(*(chunk[col].cat.categories for chunk in chunks)))
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+def csv_snapshot_source(path):
+    """Snapshot source key for a CSV file; changes whenever the file does"""
+    stat = os.stat(path)
+    return {'kind': 'csv', 'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def database_snapshot_source():
+    """Snapshot source key for the configured database"""
+    return {'kind': 'database', 'backend': storage.name, 'target': storage.target()}
+
+def save_training_snapshot(frame, source):
+    """Write frame as a columnar snapshot and return a memory-mapped view of it
+    
+    Each column is one .npy file in its compact dtype; categorical columns
+    are stored as integer codes with their categories in snapshot.json. A
+    snapshot is written to a new directory and published by atomically
+    replacing snapshot.json, so readers never see a partial one and a
+    process still mapping an older snapshot keeps a valid view of it.
+    The frame is returned re-read from the snapshot, so the in-memory copy
+    can be dropped and processes loading the same data share its pages.
+    If the snapshot cannot be written, frame is returned unchanged.
+    """
+    try:
+        generation = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(TRAINING_SNAPSHOT_DIR, generation)
+        os.makedirs(path)
+        columns = []
+        for i, col in enumerate(frame.columns):
+            series = frame[col]
+            if not isinstance(series.dtype, pd.CategoricalDtype) and series.dtype == object:
+                series = series.astype(str).astype('category')
+            entry = {'name': col}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values = series.array.codes
+                entry['categories'] = [str(c) for c in series.cat.categories]
+            else:
+                values = series.to_numpy()
+            entry['dtype'] = values.dtype.str
+            np.save(os.path.join(path, f'{i:03d}.npy'), values, allow_pickle=False)
+            columns.append(entry)
+        
+        meta = {
+            'format': TRAINING_SNAPSHOT_FORMAT,
+            'generation': generation,
+            'rows': len(frame),
+            'columns': columns,
+            'high_water_id': frame.attrs.get('high_water_id'),
+            'source': source,
+            'written_at': datetime.now().isoformat()
+        }
+        meta_path = os.path.join(TRAINING_SNAPSHOT_DIR, 'snapshot.json')
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
     except Exception as e:
-        print(f"⚠️ Error initializing database: {str(e)}")
-        print("💾 Will use local CSV storage for predictions")
-        db_connected = False
-        return False
+        print(f"⚠️ Could not save training snapshot: {str(e)}")
+        return frame
+    
+    # Older generations can go; open maps of them stay valid until unmapped
+    for name in os.listdir(TRAINING_SNAPSHOT_DIR):
+        old = os.path.join(TRAINING_SNAPSHOT_DIR, name)
+        if name != generation and os.path.isdir(old):
+            shutil.rmtree(old, ignore_errors=True)
+    
+    mapped = load_training_snapshot(source)
+    return mapped if mapped is not None else frame
+
+def load_training_snapshot(source):
+    """Memory-map the current snapshot as a read-only frame
+    
+    No column is copied: numeric columns are the mapped arrays and
+    categorical columns wrap the mapped codes. Returns None if there is no
+    readable snapshot or it was taken from a different source.
+    """
+    meta_path = os.path.join(TRAINING_SNAPSHOT_DIR, 'snapshot.json')
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != TRAINING_SNAPSHOT_FORMAT or meta.get('source') != source:
+            return None
+        path = os.path.join(TRAINING_SNAPSHOT_DIR, meta['generation'])
+        columns = {}
+        with metrics.timer('training_phase', phase='snapshot_load'):
+            for i, entry in enumerate(meta['columns']):
+                values = np.load(os.path.join(path, f'{i:03d}.npy'), mmap_mode='r', allow_pickle=False)
+                if len(values) != meta['rows']:
+                    raise ValueError(f"column {entry['name']} has {len(values)} rows, expected {meta['rows']}")
+                if 'categories' in entry:
+                    values = pd.Categorical.from_codes(values, categories=entry['categories'], validate=False)
+                columns[entry['name']] = values
+            frame = pd.DataFrame(columns, copy=False)
+    except Exception as e:
+        print(f"⚠️ Could not read training snapshot: {str(e)}")
+        return None
+    frame.attrs['high_water_id'] = meta.get('high_water_id')
+    return frame
+
+def read_prediction_delta(high_water_id):
+    """Read insurance_predictions rows with id above high_water_id
+    
+    Returns a compact frame whose attrs['high_water_id'] is the new mark, or
+    None when there are no new rows.
+    """
+    query = "SELECT id, age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim as claim FROM insurance_predictions WHERE id > ? ORDER BY id"
+    delta = load_chunked(storage.read_prediction_chunks(query, (int(high_water_id),)))
+    
+    if delta is None:
+        return None
+    new_mark = int(delta['id'].max())
+    delta = delta.drop(columns='id')
+    delta.attrs['high_water_id'] = new_mark
+    return delta
+
+def append_training_rows(frame, delta):
+    """Return frame with delta appended, carrying the delta's high-water mark"""
+    if delta is None:
+        return frame
+    combined = concat_chunks([frame, delta])
+    combined.attrs['high_water_id'] = delta.attrs['high_water_id']
+    return combined
+
+def load_chunked(chunk_iter):
+    """Stream raw chunks into one compact frame within LOAD_MEMORY_BUDGET_MB
+    
+    Only half the budget is held in chunks so the final concatenation stays
+    inside it. Once that is exceeded the oldest chunks are dropped, keeping
+    the most recent rows. Returns None if no rows were read.
+    """
+    budget = LOAD_MEMORY_BUDGET_MB * 1024 * 1024 / 2
+    chunks = []
+    held = 0
+    dropped = 0
+    
+    for raw in chunk_iter:
+        chunk = compact_chunk(raw)
+        del raw
+        if len(chunk) == 0:
+            continue
+        chunks.append(chunk)
+        held += chunk.memory_usage(deep=True).sum()
+        while budget and held > budget and len(chunks) > 1:
+            oldest = chunks.pop(0)
+            held -= oldest.memory_usage(deep=True).sum()
+            dropped += len(oldest)
+    
+    if dropped:
+        print(f"⚠️ Memory budget of {LOAD_MEMORY_BUDGET_MB:g} MB reached - dropped {dropped} oldest records")
+    if not chunks:
+        return None
+    return concat_chunks(chunks)
+
+def read_training_data(use_cache=True):
+    """Read insurance data from database or CSV into a new frame
+    
+    Rows are streamed in LOAD_CHUNK_ROWS batches and compacted as they
+    arrive, so the raw object-typed table is never held in memory at once.
+    Every load is saved as a columnar snapshot and the returned frame is
+    memory-mapped from it. Database loads record the highest id read in
+    attrs['high_water_id']; with use_cache the snapshot plus the rows added
+    since its mark are read instead of the whole table, unless the table's
+    max id is below the mark (a recreated table). An unchanged CSV is
+    read from its snapshot instead of being parsed again.
+    Does not touch the registry's data, so a retrain can build its data snapshot
+    off to the side while requests keep using the current one.
+    """
+    frame = None
+    
+    # Try to load from database first
+    if storage.connected:
+        source = database_snapshot_source()
+        try:
+            cached = load_training_snapshot(source) if use_cache else None
+            if cached is not None and cached.attrs.get('high_water_id') is None:
+                cached = None
+            if cached is not None:
+                # Ids only grow, so a table whose max id is below the mark was recreated since
+                max_id = storage.max_prediction_id()
+                if max_id is None or int(max_id) < cached.attrs['high_water_id']:
+                    print(f"⚠️ Training snapshot is ahead of {storage.name} (max id {max_id}) - reloading")
+                    cached = None
+            if cached is not None:
+                delta = read_prediction_delta(cached.attrs['high_water_id'])
+                frame = append_training_rows(cached, delta)
+                if delta is not None:
+                    frame = save_training_snapshot(frame, source)
+                print(f"✅ Loaded {len(cached)} snapshot + {len(delta) if delta is not None else 0} new records from {storage.name}")
+            else:
+                high_water_id = storage.max_prediction_id()
+                if high_water_id is not None:
+                    # Load from database, up to the mark so the next delta starts cleanly
+                    query = "SELECT age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim as claim FROM insurance_predictions WHERE id <= ? ORDER BY id"
+                    frame = load_chunked(storage.read_prediction_chunks(query, (int(high_water_id),)))
+                if frame is not None:
+                    frame.attrs['high_water_id'] = int(high_water_id)
+                    frame = save_training_snapshot(frame, source)
+                    print(f"✅ Loaded {len(frame)} records from {storage.name}")
+        except Exception as e:
+            frame = None
+            print(f"⚠️ Error loading from database: {str(e)}")
+    
+    # If no data from database, try CSV
+    if frame is None and os.path.exists('insurance_data.csv'):
+        source = csv_snapshot_source('insurance_data.csv')
+        frame = load_training_snapshot(source) if use_cache else None
+        if frame is not None:
+            print(f"✅ Loaded {len(frame)} records from CSV snapshot")
+        else:
+            frame = load_chunked(pd.read_csv('insurance_data.csv', chunksize=LOAD_CHUNK_ROWS))
+            if frame is not None:
+                frame = save_training_snapshot(frame, source)
+                print(f"✅ Loaded {len(frame)} records from CSV")
+    
+    # If still no data, create sample data
+    if frame is None:
+        print("📊 Creating sample dataset...")
+        np.random.seed(42)
+        n_samples = 1000
+        frame = pd.DataFrame({
+            'age': np.random.randint(18, 65, n_samples),
+            'gender': np.random.choice(['male', 'female'], n_samples),
+            'bmi': np.random.uniform(15, 50, n_samples),
+            'bloodpressure': np.random.randint(80, 180, n_samples),
+            'diabetic': np.random.choice(['no', 'yes'], n_samples),
+            'children': np.random.randint(0, 6, n_samples),
+            'smoker': np.random.choice(['no', 'yes'], n_samples),
+            'region': np.random.choice(['northeast', 'northwest', 'southeast', 'southwest'], n_samples),
+            'claim': np.random.uniform(1000, 60000, n_samples)
+        })
+        frame.to_csv('insurance_data.csv', index=False)
+        frame = save_training_snapshot(compact_chunk(frame), csv_snapshot_source('insurance_data.csv'))
+        print(f"✅ Created sample dataset with {len(frame)} records")
+    
+    return frame
 
 def load_data():
     """Load insurance data from database or CSV"""
-    global df, db_connected
+    global data_aggregates
     try:
-        df_loaded = False
-        
-        # Try to load from database first
-        if db_connected:
-            try:
-                conn = get_db_connection()
-                if conn:
-                    # Load from database
-                    query = "SELECT age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim as claim FROM insurance_predictions"
-                    result_df = pd.read_sql(query, conn)
-                    conn.close()
-                    
-                    if len(result_df) > 0:
-                        df = result_df
-                        print(f"✅ Loaded {len(df)} records from SQL Server")
-                        # Normalize categorical fields to lowercase
-                        for col in ['gender', 'diabetic', 'smoker', 'region']:
-                            if col in df.columns:
-                                df[col] = df[col].str.lower()
-                        df_loaded = True
-            except Exception as e:
-                print(f"⚠️ Error loading from database: {str(e)}")
-        
-        # If no data from database, try CSV
-        if not df_loaded and os.path.exists('insurance_data.csv'):
-            df = pd.read_csv('insurance_data.csv')
-            # Normalize categorical fields to lowercase
-            for col in ['gender', 'diabetic', 'smoker', 'region']:
-                if col in df.columns:
-                    df[col] = df[col].str.lower()
-            print(f"✅ Loaded {len(df)} records from CSV")
-            df_loaded = True
-        
-        # If still no data, create sample data
-        if not df_loaded:
-            print("📊 Creating sample dataset...")
-            np.random.seed(42)
-            n_samples = 1000
-            df = pd.DataFrame({
-                'age': np.random.randint(18, 65, n_samples),
-                'gender': np.random.choice(['male', 'female'], n_samples),
-                'bmi': np.random.uniform(15, 50, n_samples),
-                'bloodpressure': np.random.randint(80, 180, n_samples),
-                'diabetic': np.random.choice(['no', 'yes'], n_samples),
-                'children': np.random.randint(0, 6, n_samples),
-                'smoker': np.random.choice(['no', 'yes'], n_samples),
-                'region': np.random.choice(['northeast', 'northwest', 'southeast', 'southwest'], n_samples),
-                'claim': np.random.uniform(1000, 60000, n_samples)
-            })
-            df.to_csv('insurance_data.csv', index=False)
-            print(f"✅ Created sample dataset with {len(df)} records")
-        
-        df = df.dropna()
+        frame = read_training_data()
+        aggregates = DataAggregates()
+        aggregates.rebuild(frame)
+        model_registry.data, data_aggregates = frame, aggregates
         return True
     except Exception as e:
         print(f"Error loading data: {str(e)}")
@@ -199,102 +1561,1622 @@ def load_data():
         traceback.print_exc()
         return False
 
+class RetrainCancelled(Exception):
+    """Raised inside train_model when a retrain job is cancelled"""
+
+class IncrementalRetrainUnavailable(Exception):
+    """Raised when an incremental update is not possible and a full retrain is needed"""
+
+ModelBundle = namedtuple('ModelBundle', ['model', 'le_dict', 'version', 'trained_at', 'train_score', 'data', 'high_water_id',
+                                         'predictor', 'region', 'schema', 'baseline', 'holdout_r2'],
+                         defaults=(None, None, None, None, None))
+
+class FlatForest:
+    """Array-based random forest evaluator
+    
+    All trees are flattened into contiguous node arrays (feature, threshold,
+    children, value) and every tree is walked for a whole batch at once with
+    NumPy fancy indexing, avoiding sklearn's per-call validation and joblib
+    dispatch. Leaves point at themselves, so walking a fixed max_depth steps
+    lands every row on its leaf.
+    """
+    
+    def __init__(self, forest):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        self.max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            node_ids = np.arange(n) + offset
+            is_leaf = tree.children_left == -1
+            
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+            values.append(tree.value[:, 0, 0])
+            roots.append(offset)
+            
+            self.max_depth = max(self.max_depth, tree.max_depth)
+            offset += n
+        
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.n_features = forest.n_features_in_
+    
+    def predict(self, X):
+        # sklearn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f'Expected {self.n_features} features per row')
+        
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].mean(axis=1)
+
+def make_predictor(trained_model, X_check=None):
+    """Return the predict callable for the configured INFERENCE_BACKEND
+    
+    The flat backend is checked against sklearn on X_check before use and
+    falls back to sklearn if the outputs differ. It only handles batches of
+    up to FLAT_MAX_ROWS rows: beyond that sklearn's compiled tree traversal
+    is faster than NumPy gathers, so larger batches go to sklearn.
+    """
+    if INFERENCE_BACKEND != 'flat' or not hasattr(trained_model, 'estimators_'):
+        return trained_model.predict
+    
+    try:
+        flat = FlatForest(trained_model)
+        if X_check is not None and len(X_check) > 0:
+            expected = trained_model.predict(X_check)
+            if not np.allclose(flat.predict(X_check), expected, rtol=1e-9, atol=1e-6):
+                print("⚠️ Flat forest does not match sklearn output - using sklearn predict")
+                return trained_model.predict
+    except Exception as e:
+        print(f"⚠️ Could not build flat forest ({str(e)}) - using sklearn predict")
+        return trained_model.predict
+    
+    def predict(X):
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) > FLAT_MAX_ROWS:
+            return trained_model.predict(X)
+        return flat.predict(X)
+    return predict
+
+class ModelRegistry:
+    """Named, versioned model bundles with traffic-split routing
+    
+    Bundles are immutable, and the registry never changes its maps in place:
+    a publish builds a new dict and swaps the reference under the write
+    lock, so request handlers read a consistent snapshot without locking.
+    A request for a region with a dedicated model goes to that model;
+    everything else is split across the weighted models in 'split', sticky
+    per routing key so one user keeps seeing one variant.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._routes = {'split': ((PRIMARY_MODEL, 100),), 'regions': {}}
+        # Current training data snapshot (what the primary model learns from)
+        self.data = None
+    
+    @property
+    def primary(self):
+        return self._models.get(PRIMARY_MODEL)
+    
+    @property
+    def routes(self):
+        return self._routes
+    
+    def get(self, name=PRIMARY_MODEL):
+        return self._models.get(name)
+    
+    def names(self):
+        return sorted(self._models)
+    
+    def snapshot(self):
+        """The current name -> bundle map; never modified after publication"""
+        return self._models
+    
+    def publish(self, bundle, name=PRIMARY_MODEL):
+        with self._lock:
+            models = dict(self._models)
+            models[name] = bundle
+            self._models = models
+    
+    def set_routes(self, split, regions=None):
+        """Install routes from {name: weight} and {region: name}; raises ValueError if invalid
+        
+        A region-bound model (trained with region=) has encoders that only
+        know its own region, so it may only serve that region's route.
+        """
+        regions = dict(regions or {})
+        split = tuple((str(name), float(weight)) for name, weight in dict(split or {PRIMARY_MODEL: 100}).items())
+        if not split or any(weight < 0 for _, weight in split) or sum(weight for _, weight in split) <= 0:
+            raise ValueError('split weights must be non-negative and add up to more than 0')
+        with self._lock:
+            unknown = {name for name, _ in split} | set(regions.values())
+            unknown -= set(self._models)
+            if unknown:
+                raise ValueError(f"Unknown models: {', '.join(sorted(unknown))}")
+            bound = sorted(name for name, _ in split if self._models[name].region is not None)
+            if bound:
+                raise ValueError(f"Region-bound models cannot be in the split: {', '.join(bound)}")
+            misrouted = sorted(f'{region} -> {name}' for region, name in regions.items()
+                               if self._models[name].region not in (None, region))
+            if misrouted:
+                raise ValueError(f"Region-bound models can only serve their own region: {', '.join(misrouted)}")
+            self._routes = {'split': split, 'regions': regions}
+    
+    def route(self, region=None, key=None):
+        """Pick the model for a request; returns (name, bundle)"""
+        models, routes = self._models, self._routes
+        name = routes['regions'].get(region)
+        if name not in models or models[name].region not in (None, region):
+            # Skips models republished as region-bound since the routes were set
+            split = [(name, weight) for name, weight in routes['split']
+                     if name in models and weight > 0 and models[name].region is None]
+            name = split[0][0] if split else PRIMARY_MODEL
+            if len(split) > 1:
+                total = sum(weight for _, weight in split)
+                fraction = int(hashlib.md5(key.encode()).hexdigest()[:8], 16) / 0x100000000 if key else random.random()
+                point = fraction * total
+                for name, weight in split:
+                    point -= weight
+                    if point < 0:
+                        break
+        return name, models.get(name)
+    
+    def describe(self):
+        """JSON-friendly summary of every registered model"""
+        return [{
+            'name': name,
+            'version': bundle.version,
+            'region': bundle.region,
+            'model_type': type(bundle.model).__name__,
+            'trained_at': bundle.trained_at.isoformat() if bundle.trained_at else None,
+            'train_score': bundle.train_score,
+            'holdout_r2': bundle.holdout_r2,
+            'total_records': len(bundle.data) if bundle.data is not None else None,
+            'categories': bundle.schema['categories'] if bundle.schema else None
+        } for name, bundle in sorted(self._models.items())]
+
+model_registry = ModelRegistry()
+
+def region_frame(frame, region):
+    """Rows of frame for one region, keeping its high-water mark"""
+    subset = frame[frame['region'] == region]
+    subset.attrs = dict(frame.attrs)
+    return subset
+
+def publish_model(bundle, name=PRIMARY_MODEL):
+    """Make a model bundle live under name with a single reference swap
+    
+    Request handlers take one bundle from the registry and use its model
+    and encoders together, so they never see a new forest paired with old
+    encoders.
+    """
+    if bundle.schema is None:
+        bundle = bundle._replace(schema=model_schema(bundle.le_dict))
+    if bundle.baseline is not None and not {'numeric', 'categorical'} <= set(bundle.baseline):
+        print("⚠️ Ignoring malformed drift baseline on the published model")
+        bundle = bundle._replace(baseline=None)
+    if bundle.baseline is None and bundle.data is not None and len(bundle.data) > 0:
+        bundle = bundle._replace(baseline=feature_baseline(bundle.data))
+    if bundle.predictor is None:
+        X_check = None
+        if bundle.data is not None and len(bundle.data) > 0:
+            X_check, _ = encode_frame(bundle.data.head(PARITY_CHECK_ROWS), bundle.le_dict)
+        bundle = bundle._replace(predictor=make_predictor(bundle.model, X_check))
+    
+    # Saved forests carry the n_jobs they were trained with; serve with this process's budget
+    if 'n_jobs' in bundle.model.get_params() and bundle.model.n_jobs != FOREST_PARAMS['n_jobs']:
+        bundle.model.set_params(n_jobs=FOREST_PARAMS['n_jobs'])
+    
+    model_registry.publish(bundle, name)
+    if name == PRIMARY_MODEL:
+        model_registry.data = bundle.data
+
+def estimator_count(n_rows):
+    """Number of trees to use for a training set of n_rows"""
+    return min(200, max(50, n_rows // 5))
+
+def encode_frame(frame, encoders):
+    """Encode a compact frame with existing encoders
+    
+    Returns (X, valid) where valid flags rows whose categories were all
+    known to the encoders.
+    """
+    X = np.empty((len(frame), len(FEATURE_COLUMNS)), dtype=np.float32)
+    valid = np.ones(len(frame), dtype=bool)
+    for i, col in enumerate(FEATURE_COLUMNS):
+        if col in CATEGORICAL_COLUMNS:
+            codes = pd.Categorical(frame[col], categories=encoders[col].classes_).codes
+            valid &= codes >= 0
+            X[:, i] = codes
+        else:
+            X[:, i] = frame[col].to_numpy()
+    return X, valid
+
+def encode_categorical(series):
+    """Fit a LabelEncoder for a column and return (encoder, integer codes)"""
+    from sklearn.preprocessing import LabelEncoder
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.cat.remove_unused_categories()
+        categories = series.cat.categories.to_numpy(dtype=object)
+        le = LabelEncoder().fit(categories)
+        return le, le.transform(categories)[series.cat.codes.to_numpy()]
+    
+    le = LabelEncoder()
+    return le, le.fit_transform(series)
+
+def encode_training_frame(frame):
+    """Fit encoders on frame and return (encoders, X, y)"""
+    # Build the feature matrix column by column instead of copying the frame
+    encoders = {}
+    X = np.empty((len(frame), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, col in enumerate(FEATURE_COLUMNS):
+        if col in CATEGORICAL_COLUMNS:
+            encoders[col], X[:, i] = encode_categorical(frame[col])
+        else:
+            X[:, i] = frame[col].to_numpy()
+    return encoders, X, frame['claim'].to_numpy()
+
+def train_model(frame, progress=None, cancel_event=None):
+    """Fit encoders and a forest on frame without touching global state
+    
+    Trees are grown in warm-start steps so progress can be reported and a
+    cancel request honoured between steps; the fitted forest is identical
+    to a single fit with the same random_state.
+    Returns (model, encoders, train_score).
+    """
+    with metrics.timer('training_phase', phase='encode'):
+        encoders, X, y = encode_training_frame(frame)
+    
+    # Train model with more trees for better accuracy with more data
+    n_estimators = estimator_count(len(frame))
+    from sklearn.ensemble import RandomForestRegressor
+    forest = RandomForestRegressor(n_estimators=0, warm_start=True, **FOREST_PARAMS)
+    step = max(10, n_estimators // 10)
+    grown = 0
+    while grown < n_estimators:
+        if cancel_event is not None and cancel_event.is_set():
+            raise RetrainCancelled()
+        grown = min(grown + step, n_estimators)
+        forest.set_params(n_estimators=grown)
+        with metrics.timer('training_phase', phase='fit'):
+            forest.fit(X, y)
+        if progress:
+            progress(grown / n_estimators)
+    forest.set_params(warm_start=False)
+    
+    with metrics.timer('training_phase', phase='score'):
+        train_score = forest.score(X, y)
+    return forest, encoders, train_score
+
+def build_model_bundle(frame, progress=None, cancel_event=None, name=PRIMARY_MODEL, region=None):
+    """Train on frame and save the artifact, returning an unpublished ModelBundle"""
+    started = time.perf_counter()
+    trained_model, encoders, train_score = train_model(frame, progress, cancel_event)
+    train_seconds = time.perf_counter() - started
+    trained_at = datetime.now()
+    high_water_id = frame.attrs.get('high_water_id')
+    print(f"✅ Model trained successfully with {len(frame)} records (R² Score: {train_score:.4f})")
+    
+    baseline = feature_baseline(frame)
+    
+    # Persist the artifact so the next process start can skip training
+    with metrics.timer('training_phase', phase='save_artifact'):
+        version = save_model_artifact(trained_model, encoders, compute_data_fingerprint(frame), len(frame), train_score, trained_at, high_water_id,
+                                      name=name, region=region, baseline=baseline)
+    
+    # Store metrics in database if connected
+    if storage.connected:
+        save_model_metrics(len(frame), train_score, train_seconds=train_seconds)
+    
+    return ModelBundle(trained_model, encoders, version, trained_at, train_score, frame, high_water_id, region=region, baseline=baseline)
+
+def build_incremental_bundle(base, progress=None, cancel_event=None, name=PRIMARY_MODEL):
+    """Update the live model with rows added since its high-water mark
+    
+    The new rows are appended to the cached training set. A few new trees,
+    proportional to the share of new rows, are then fitted on the newest
+    INCREMENTAL_WINDOW_ROWS rows. They are added to a copy of the live
+    forest and the oldest trees are dropped, so the cost scales with the
+    window, not the whole history. The reported score is measured on the
+    window. Returns (bundle, delta_records); bundle is None when there are
+    no new rows.
+    """
+    if base is None or base.high_water_id is None or not hasattr(base.model, 'estimators_'):
+        raise IncrementalRetrainUnavailable('current model has no database high-water mark')
+    if base.region is not None:
+        raise IncrementalRetrainUnavailable('region models are only retrained in full')
+    
+    started = time.perf_counter()
+    delta = read_prediction_delta(base.high_water_id)
+    if delta is None:
+        return None, 0
+    if progress:
+        progress(0.3)
+    
+    frame = append_training_rows(base.data, delta)
+    window = frame.tail(INCREMENTAL_WINDOW_ROWS)
+    X, valid = encode_frame(window, base.le_dict)
+    if not valid.all():
+        raise IncrementalRetrainUnavailable('new rows contain category values the model has not seen')
+    y = window['claim'].to_numpy()
+    
+    if cancel_event is not None and cancel_event.is_set():
+        raise RetrainCancelled()
+    
+    target = estimator_count(len(frame))
+    n_new = min(target, max(10, round(target * len(delta) / len(frame))))
+    # Grow the new trees with the live forest's settings, which may come from a search
+    params = dict(base.model.get_params(), n_estimators=n_new, warm_start=False, random_state=delta.attrs['high_water_id'])
+    from sklearn.ensemble import RandomForestRegressor
+    extra = RandomForestRegressor(**params).fit(X, y)
+    if progress:
+        progress(0.9)
+    
+    forest = copy.copy(base.model)
+    forest.estimators_ = (list(base.model.estimators_) + list(extra.estimators_))[-target:]
+    forest.n_estimators = len(forest.estimators_)
+    train_score = forest.score(X, y)
+    train_seconds = time.perf_counter() - started
+    trained_at = datetime.now()
+    high_water_id = frame.attrs['high_water_id']
+    print(f"✅ Model updated incrementally with {len(delta)} new records ({n_new} new trees, R² Score on window: {train_score:.4f})")
+    
+    baseline = feature_baseline(frame)
+    version = save_model_artifact(forest, base.le_dict, compute_data_fingerprint(frame), len(frame), train_score, trained_at, high_water_id,
+                                  name=name, baseline=baseline)
+    if name == PRIMARY_MODEL:
+        frame = save_training_snapshot(frame, database_snapshot_source())
+    if storage.connected:
+        save_model_metrics(len(frame), train_score, delta_records=len(delta), train_seconds=train_seconds, mode='incremental')
+    
+    return ModelBundle(forest, base.le_dict, version, trained_at, train_score, frame, high_water_id, baseline=baseline), len(delta)
+
+def search_candidates(n_rows):
+    """Candidate (family, params) pairs for the hyperparameter search
+    
+    The first candidate is the default forest that full retrains use, so
+    every search reports how the alternatives compare against it.
+    """
+    baseline = {key: value for key, value in FOREST_PARAMS.items() if key not in ('random_state', 'n_jobs')}
+    candidates = [('RandomForest', dict(baseline, n_estimators=estimator_count(n_rows)))]
+    for max_depth in (10, 20, None):
+        for min_samples_leaf in (2, 5):
+            for max_features in (1.0, 0.5):
+                candidates.append(('RandomForest', {'n_estimators': 100, 'max_depth': max_depth,
+                                                    'min_samples_leaf': min_samples_leaf, 'max_features': max_features}))
+    for learning_rate in (0.05, 0.1):
+        for max_leaf_nodes in (15, 31):
+            for max_iter in (200, 400):
+                candidates.append(('HistGradientBoosting', {'learning_rate': learning_rate, 'max_leaf_nodes': max_leaf_nodes,
+                                                            'max_iter': max_iter, 'l2_regularization': 1.0}))
+    return candidates
+
+def build_estimator(family, params, n_jobs=None):
+    """Instantiate an unfitted regressor for a search candidate"""
+    from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+    if n_jobs is None:
+        n_jobs = FOREST_PARAMS['n_jobs']
+    if family == 'HistGradientBoosting':
+        categorical = [i for i, col in enumerate(FEATURE_COLUMNS) if col in CATEGORICAL_COLUMNS]
+        return HistGradientBoostingRegressor(categorical_features=categorical, random_state=FOREST_PARAMS['random_state'], **params)
+    return RandomForestRegressor(random_state=FOREST_PARAMS['random_state'], n_jobs=n_jobs, **params)
+
+# Feature matrix shared with search worker processes
+_search_data = None
+
+def _init_search_worker(X, y):
+    global _search_data
+    _search_data = (X, y)
+
+def _fit_search_fold(index, family, params, train_idx, test_idx):
+    """Fit one candidate on one CV fold; runs in a search worker process"""
+    from sklearn.metrics import mean_absolute_error, r2_score
+    X, y = _search_data
+    started = time.perf_counter()
+    # Single-threaded fits so the process pool is the only source of parallelism
+    estimator = build_estimator(family, params, n_jobs=1).fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - started
+    predicted = estimator.predict(X[test_idx])
+    return index, mean_absolute_error(y[test_idx], predicted), r2_score(y[test_idx], predicted), fit_seconds
+
+def measure_latency(estimator, X, repeats=50):
+    """Median single-row predict time in milliseconds"""
+    rows = X[:repeats]
+    timings = []
+    for i in range(len(rows)):
+        started = time.perf_counter()
+        estimator.predict(rows[i:i + 1])
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1000)
+
+class HyperparameterSearch:
+    """Time-budgeted successive-halving search over model families
+    
+    Every candidate is scored with k-fold CV on a small sample of the
+    training split; the best third survive to the next round, which uses
+    SEARCH_ELIMINATION_FACTOR times as many rows, until one round runs on
+    the whole split or the budget runs out. Folds are fitted in parallel
+    across a process pool. The top finalists are then refitted on the whole
+    training split and compared on the held-out rows: the lowest MAE wins,
+    except that any finalist within SEARCH_ERROR_TOLERANCE of it with a
+    faster single-row predict is preferred. Every trial is logged to
+    model_metrics. The time budget covers the CV rounds and the finalist
+    fits: once it has passed, the remaining finalists are skipped (the first
+    is always fitted so there is a winner). The final refit of the winner on
+    every row is not covered and adds one more fit on top of the budget.
+    """
+    
+    def __init__(self, frame, time_budget=SEARCH_TIME_BUDGET, folds=SEARCH_CV_FOLDS, workers=None,
+                 progress=None, cancel_event=None):
+        self.frame = frame
+        self.time_budget = time_budget
+        self.folds = folds
+        self.workers = max(1, workers if workers is not None else SEARCH_WORKERS)
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.trials = []
+    
+    def _check_cancel(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise RetrainCancelled()
+    
+    def _run_round(self, executor, candidates, rows, deadline):
+        """Cross-validate candidates on rows; returns mean scores or None if out of time"""
+        from sklearn.model_selection import KFold
+        tasks = []
+        for index, (family, params) in enumerate(candidates):
+            for train_idx, test_idx in KFold(self.folds, shuffle=True, random_state=FOREST_PARAMS['random_state']).split(rows):
+                tasks.append((index, family, params, rows[train_idx], rows[test_idx]))
+        
+        results = []
+        if executor is None:
+            for task in tasks:
+                self._check_cancel()
+                if time.monotonic() > deadline:
+                    return None
+                results.append(_fit_search_fold(*task))
+        else:
+            pending = {executor.submit(_fit_search_fold, *task) for task in tasks}
+            while pending:
+                done, pending = wait(pending, timeout=min(1.0, max(0.0, deadline - time.monotonic())), return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+                if pending and (time.monotonic() > deadline or (self.cancel_event is not None and self.cancel_event.is_set())):
+                    for future in pending:
+                        future.cancel()
+                    self._check_cancel()
+                    return None
+        
+        scores = []
+        for index, (family, params) in enumerate(candidates):
+            fold_results = [result for result in results if result[0] == index]
+            scores.append({
+                'family': family,
+                'params': params,
+                'rows': len(rows),
+                'cv_mae': float(np.mean([result[1] for result in fold_results])),
+                'cv_r2': float(np.mean([result[2] for result in fold_results])),
+                'fit_seconds': float(np.mean([result[3] for result in fold_results]))
+            })
+        return scores
+    
+    def _log_trial(self, trial, stage):
+        self.trials.append(dict(trial, stage=stage))
+        if storage.connected:
+            notes = f"{stage}: {json.dumps(trial['params'])} " + ', '.join(
+                f'{key}={trial[key]:.4g}' for key in ('cv_mae', 'holdout_mae', 'latency_ms') if key in trial)
+            save_model_metrics(trial['rows'], trial.get('holdout_r2', trial.get('cv_r2')), train_seconds=trial['fit_seconds'],
+                               mode='search', model_type=trial['family'], notes=notes)
+    
+    def run(self):
+        """Run the search; returns (estimator, encoders, winning trial)"""
+        from sklearn.metrics import mean_absolute_error, r2_score
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        encoders, X, y = encode_training_frame(self.frame)
+        
+        order = np.random.RandomState(FOREST_PARAMS['random_state']).permutation(len(X))
+        n_holdout = int(len(X) * SEARCH_HOLDOUT_FRACTION)
+        holdout_idx, train_idx = order[:n_holdout], order[n_holdout:]
+        if len(train_idx) < self.folds * 2 or n_holdout == 0:
+            raise ValueError('Not enough data for a hyperparameter search')
+        
+        # Size the rounds so the last one uses the whole training split
+        candidates = search_candidates(len(X))
+        eta = SEARCH_ELIMINATION_FACTOR
+        n_rounds = 1
+        while eta ** n_rounds < len(candidates) and len(train_idx) // eta ** n_rounds >= SEARCH_MIN_ROWS:
+            n_rounds += 1
+        
+        ranked = [{'family': family, 'params': params} for family, params in candidates]
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_search_worker, initargs=(X, y))
+        else:
+            _init_search_worker(X, y)
+        try:
+            for round_number in range(n_rounds):
+                self._check_cancel()
+                rows = train_idx[:max(SEARCH_MIN_ROWS, len(train_idx) // eta ** (n_rounds - 1 - round_number))]
+                scores = self._run_round(executor, [(trial['family'], trial['params']) for trial in ranked], rows, deadline)
+                if scores is None:
+                    print(f"⏱️ Search budget used after {round_number} rounds")
+                    break
+                for trial in scores:
+                    self._log_trial(trial, f'round {round_number + 1}')
+                ranked = sorted(scores, key=lambda trial: trial['cv_mae'])
+                if round_number < n_rounds - 1:
+                    ranked = ranked[:max(1, -(-len(ranked) // eta))]
+                if self.progress:
+                    self.progress(0.7 * (round_number + 1) / n_rounds)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+        
+        # Compare finalists (always including the default forest) on held-out rows
+        finalists = ranked[:SEARCH_FINALISTS]
+        baseline_family, baseline_params = candidates[0]
+        if not any(trial['family'] == baseline_family and trial['params'] == baseline_params for trial in finalists):
+            finalists.append({'family': baseline_family, 'params': baseline_params})
+        
+        results = []
+        for trial in finalists:
+            self._check_cancel()
+            if results and time.monotonic() > deadline:
+                print(f"⏱️ Search budget used - skipping {len(finalists) - len(results)} of {len(finalists)} finalists")
+                break
+            fit_started = time.perf_counter()
+            estimator = build_estimator(trial['family'], trial['params']).fit(X[train_idx], y[train_idx])
+            fit_seconds = time.perf_counter() - fit_started
+            predicted = estimator.predict(X[holdout_idx])
+            result = dict(trial, rows=len(train_idx), fit_seconds=fit_seconds,
+                          holdout_mae=float(mean_absolute_error(y[holdout_idx], predicted)),
+                          holdout_r2=float(r2_score(y[holdout_idx], predicted)),
+                          latency_ms=measure_latency(estimator, X[holdout_idx]),
+                          baseline=trial['family'] == baseline_family and trial['params'] == baseline_params)
+            self._log_trial(result, 'holdout')
+            results.append(result)
+            if self.progress:
+                self.progress(0.7 + 0.2 * len(results) / len(finalists))
+        if self.progress:
+            self.progress(0.9)
+        
+        best_mae = min(result['holdout_mae'] for result in results)
+        eligible = [result for result in results if result['holdout_mae'] <= best_mae * (1 + SEARCH_ERROR_TOLERANCE)]
+        winner = min(eligible, key=lambda result: result['latency_ms'])
+        print(f"🏆 Search picked {winner['family']} {winner['params']} "
+              f"(holdout MAE {winner['holdout_mae']:.2f}, {winner['latency_ms']:.2f} ms/row) in {time.monotonic() - started:.1f}s")
+        
+        # Refit the winner on every row before serving it
+        self._check_cancel()
+        estimator = build_estimator(winner['family'], winner['params']).fit(X, y)
+        # In-sample R², like the other training modes report
+        winner = dict(winner, train_r2=float(estimator.score(X, y)))
+        if self.progress:
+            self.progress(1.0)
+        return estimator, encoders, winner
+
+def build_search_bundle(frame, progress=None, cancel_event=None, name=PRIMARY_MODEL, region=None):
+    """Run a hyperparameter search on frame and save the winner, returning (bundle, summary)"""
+    started = time.perf_counter()
+    search = HyperparameterSearch(frame, progress=progress, cancel_event=cancel_event)
+    with metrics.timer('training_phase', phase='search'):
+        trained_model, encoders, winner = search.run()
+    train_seconds = time.perf_counter() - started
+    trained_at = datetime.now()
+    high_water_id = frame.attrs.get('high_water_id')
+    # train_score is in-sample R² as for every other mode; the held-out score is kept alongside it
+    train_score = winner['train_r2']
+    holdout_r2 = winner['holdout_r2']
+    baseline = feature_baseline(frame)
+    
+    version = save_model_artifact(trained_model, encoders, compute_data_fingerprint(frame), len(frame), train_score, trained_at, high_water_id,
+                                  name=name, region=region, baseline=baseline, holdout_r2=holdout_r2)
+    if storage.connected:
+        save_model_metrics(len(frame), train_score, train_seconds=train_seconds, mode='search', model_type=winner['family'],
+                           notes=f"Search winner {json.dumps(winner['params'])} from {len(search.trials)} trials, holdout R² {holdout_r2:.4f}")
+    
+    default_trial = next((trial for trial in search.trials if trial.get('baseline')), None)
+    summary = {
+        'winner': {key: winner[key] for key in ('family', 'params', 'train_r2', 'holdout_mae', 'holdout_r2', 'latency_ms')},
+        'baseline': {key: default_trial[key] for key in ('family', 'params', 'holdout_mae', 'holdout_r2', 'latency_ms')} if default_trial else None,
+        'trials': len(search.trials),
+        'search_seconds': round(train_seconds, 2)
+    }
+    return ModelBundle(trained_model, encoders, version, trained_at, train_score, frame, high_water_id, region=region,
+                       baseline=baseline, holdout_r2=holdout_r2), summary
+
 def prepare_model():
     """Prepare and train the ML model"""
-    global model, le_dict, df, last_model_train_time
-    
     try:
-        if df is None or len(df) == 0:
+        frame = model_registry.data
+        if frame is None or len(frame) == 0:
             print("❌ No data available for model training")
             return False
         
-        df_ml = df.copy()
+        publish_model(build_model_bundle(frame))
+        return True
+    except Exception as e:
+        print(f"Error preparing model: {str(e)}")
+        return False
+
+def compute_data_fingerprint(frame):
+    """Hash the training frame so artifacts can be matched to their data"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def model_schema(encoders):
+    """Describe the feature layout an artifact was trained with"""
+    import sklearn
+    return {
+        'features': FEATURE_COLUMNS,
+        'categories': {col: encoders[col].classes_.tolist() for col in CATEGORICAL_COLUMNS},
+        'sklearn_version': sklearn.__version__,
+        'format': MODEL_ARTIFACT_FORMAT
+    }
+
+def list_model_artifacts():
+    """Return artifact metadata dicts, newest version first"""
+    artifacts = []
+    if not os.path.isdir(MODEL_DIR):
+        return artifacts
+    for name in os.listdir(MODEL_DIR):
+        if name.startswith('model-v') and name.endswith('.json'):
+            try:
+                with open(os.path.join(MODEL_DIR, name), encoding='utf-8') as f:
+                    artifacts.append(json.load(f))
+            except Exception as e:
+                print(f"⚠️ Skipping unreadable model metadata {name}: {str(e)}")
+    return sorted(artifacts, key=lambda meta: meta['version'], reverse=True)
+
+def acquire_file_lock(name, blocking=True):
+    """Exclusively lock MODEL_DIR/<name>.lock across every process sharing MODEL_DIR
+    
+    Returns the open lock file (closing it releases the lock), or None when
+    blocking is False and another process holds it. The lock is also freed
+    if its holder dies.
+    """
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    lock_file = open(os.path.join(MODEL_DIR, f'{name}.lock'), 'a+', encoding='utf-8')
+    try:
+        import fcntl
+    except ImportError:
+        # No flock (Windows): serve mode needs gunicorn, so only one process uses MODEL_DIR
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def save_model_artifact(trained_model, encoders, fingerprint, total_records, train_score, trained_at, high_water_id=None,
+                        name=PRIMARY_MODEL, region=None, baseline=None, holdout_r2=None):
+    """Write the model, encoders, schema and drift baseline as a new versioned artifact
+    
+    train_score is always in-sample R²; searched models also record their
+    held-out R² as holdout_r2.
+    The joblib file is written uncompressed so loading it needs no
+    decompression; the JSON sidecar is written last and marks the artifact
+    complete.
+    Version numbers are shared by all named models; the newest
+    MODEL_KEEP_VERSIONS are kept per name. Version allocation and the write
+    run under a MODEL_DIR lock, so concurrent saves from serve-mode workers
+    never pick the same number. Returns the new version number, or None if
+    saving failed.
+    """
+    import joblib
+    lock_file = None
+    try:
+        lock_file = acquire_file_lock('versions')
+        existing = list_model_artifacts()
+        version = existing[0]['version'] + 1 if existing else 1
+        base = os.path.join(MODEL_DIR, f'model-v{version:04d}')
+        
+        meta = {
+            'version': version,
+            'fingerprint': fingerprint,
+            'schema': model_schema(encoders),
+            'total_records': total_records,
+            'train_score': train_score,
+            'trained_at': trained_at.isoformat(),
+            'high_water_id': high_water_id,
+            'model_name': name,
+            'region': region,
+            'baseline': baseline,
+            'holdout_r2': holdout_r2
+        }
         
-        # Encode categorical variables
-        for col in ['gender', 'diabetic', 'smoker', 'region']:
-            le = LabelEncoder()
-            df_ml[col] = le.fit_transform(df_ml[col])
-            le_dict[col] = le
+        joblib.dump({'model': trained_model, 'le_dict': encoders, 'meta': meta}, base + '.joblib.tmp')
+        os.replace(base + '.joblib.tmp', base + '.joblib')
+        with open(base + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(base + '.json.tmp', base + '.json')
+        print(f"💾 Saved model artifact v{version} to {base}.joblib")
         
-        # Prepare features and target
-        X = df_ml[['age', 'gender', 'bmi', 'bloodpressure', 'diabetic', 'children', 'smoker', 'region']]
-        y = df_ml['claim']
+        # Prune old versions of this model
+        same_name = [old for old in existing if old.get('model_name', PRIMARY_MODEL) == name]
+        for old in same_name[MODEL_KEEP_VERSIONS - 1:]:
+            old_base = os.path.join(MODEL_DIR, f"model-v{old['version']:04d}")
+            for ext in ('.json', '.joblib'):
+                if os.path.exists(old_base + ext):
+                    os.remove(old_base + ext)
+        return version
+    except Exception as e:
+        print(f"⚠️ Could not save model artifact: {str(e)}")
+        return None
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+def artifact_compatible(meta):
+    """Whether an artifact was saved with this sklearn version, feature layout and format"""
+    import sklearn
+    schema = meta.get('schema', {})
+    return (schema.get('features') == FEATURE_COLUMNS and schema.get('sklearn_version') == sklearn.__version__
+            and schema.get('format') == MODEL_ARTIFACT_FORMAT)
+
+def model_artifact_path(meta):
+    """Path of the joblib file an artifact's metadata describes"""
+    return os.path.join(MODEL_DIR, f"model-v{meta['version']:04d}.joblib")
+
+# Artifacts unpickled during startup, by path, waiting for load_model_artifact
+prefetched_artifacts = {}
+
+def prefetch_model_artifacts():
+    """Unpickle the newest compatible artifact of every model ahead of the data load
+    
+    Runs during startup while the database connects and the data loads, so
+    load_model_artifact can publish the prefetched copy as soon as the data
+    is there. Artifacts that fail here are retried (and reported) there.
+    """
+    import joblib
+    seen = set()
+    for meta in list_model_artifacts():
+        name = meta.get('model_name', PRIMARY_MODEL)
+        if name in seen or not artifact_compatible(meta):
+            continue
+        seen.add(name)
+        try:
+            prefetched_artifacts[model_artifact_path(meta)] = joblib.load(model_artifact_path(meta), mmap_mode='r')
+        except Exception:
+            pass
+    return True
+
+def load_model_artifact(frame, match_data=True, name=PRIMARY_MODEL):
+    """Load and publish the newest artifact of model name trained on data matching frame
+    
+    Artifacts from a different sklearn version or feature layout are
+    ignored. The file is opened with mmap_mode='r', but sklearn copies each
+    tree's node arrays into its own memory when unpickling, so the forest is
+    not shared with other processes loading the same file. It is shared only
+    when this runs in a preloading master: forked workers see it
+    copy-on-write. With match_data=False the newest compatible artifact is
+    used even if frame has grown since it was trained. Returns True if a
+    model was loaded.
+    """
+    import joblib
+    fingerprint = compute_data_fingerprint(frame)
+    for meta in list_model_artifacts():
+        if meta.get('model_name', PRIMARY_MODEL) != name:
+            continue
+        if match_data and meta.get('fingerprint') != fingerprint:
+            continue
+        if not artifact_compatible(meta):
+            continue
         
-        # Train model with more trees for better accuracy with more data
-        n_estimators = min(200, max(50, len(df) // 5))
-        model = RandomForestRegressor(
-            n_estimators=n_estimators, 
-            random_state=42, 
-            n_jobs=-1,
-            max_depth=20,
-            min_samples_split=5,
-            min_samples_leaf=2
-        )
-        model.fit(X, y)
+        path = model_artifact_path(meta)
+        try:
+            artifact = prefetched_artifacts.pop(path, None) or joblib.load(path, mmap_mode='r')
+        except Exception as e:
+            print(f"⚠️ Could not load model artifact {path}: {str(e)}")
+            continue
         
-        last_model_train_time = datetime.now()
+        region = meta.get('region')
+        data = region_frame(frame, region) if region else frame
+        publish_model(ModelBundle(artifact['model'], artifact['le_dict'], meta['version'],
+                                  datetime.fromisoformat(meta['trained_at']), meta['train_score'], data,
+                                  frame.attrs.get('high_water_id'), region=region, baseline=meta.get('baseline'),
+                                  holdout_r2=meta.get('holdout_r2')), name)
+        print(f"✅ Loaded {name} model artifact v{meta['version']} ({meta['total_records']} records, R² Score: {meta['train_score']:.4f})")
+        return True
+    return False
+
+def load_named_model_artifacts(frame):
+    """Load the newest artifact of every non-primary model, then the saved routes"""
+    names = {meta.get('model_name', PRIMARY_MODEL) for meta in list_model_artifacts()} - {PRIMARY_MODEL}
+    for name in sorted(names):
+        load_model_artifact(frame, match_data=False, name=name)
+    load_model_routes()
+
+def load_or_train_model():
+    """Load a compatible saved model for the current data, training only if none exists"""
+    frame = model_registry.data
+    if frame is None or len(frame) == 0:
+        return prepare_model()
+    ready = load_model_artifact(frame) or prepare_model()
+    load_named_model_artifacts(frame)
+    return ready
+
+def load_model_routes():
+    """Install routes from MODEL_ROUTES_FILE, or the MODEL_ROUTES setting"""
+    try:
+        if os.path.exists(MODEL_ROUTES_FILE):
+            with open(MODEL_ROUTES_FILE, encoding='utf-8') as f:
+                routes = json.load(f)
+        elif MODEL_ROUTES:
+            routes = json.loads(MODEL_ROUTES)
+        else:
+            return
+        model_registry.set_routes(routes.get('split'), routes.get('regions'))
+    except Exception as e:
+        print(f"⚠️ Ignoring model routes: {str(e)}")
+
+def save_model_routes():
+    """Persist the current routes so restarts and serve-mode reloads keep them"""
+    routes = model_registry.routes
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    with open(MODEL_ROUTES_FILE + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'split': dict(routes['split']), 'regions': routes['regions']}, f, indent=2)
+    os.replace(MODEL_ROUTES_FILE + '.tmp', MODEL_ROUTES_FILE)
+
+class RetrainJob:
+    """A background retrain: load data, train, save, then hot-swap the model
+    
+    mode is 'full' (reload the data and refit), 'incremental' (fold in
+    rows added since the live model's high-water mark, falling back to a
+    full retrain when that is not possible) or 'search' (reload the data
+    and run a hyperparameter search, serving the winning model).
+    model_name is the registry slot to publish to; with a region only that
+    region's rows are used, making a dedicated per-region model.
+    """
+    
+    MODES = ('full', 'incremental', 'search')
+    
+    def __init__(self, requested_by, mode='full', model_name=PRIMARY_MODEL, region=None, lock_file=None):
+        self.id = uuid.uuid4().hex
+        # MODEL_DIR retrain lock, held until the job finishes
+        self.lock_file = lock_file
+        self.requested_by = requested_by
+        self.mode = mode
+        self.model_name = model_name
+        self.region = region
+        self.status = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'retrain-{self.id[:8]}', daemon=True)
+    
+    @property
+    def active(self):
+        return self.status in ('queued', 'loading', 'training')
+    
+    def _set_progress(self, fraction):
+        # Loading counts as the first 10%, training the rest
+        self.progress = round(0.1 + 0.9 * fraction, 3)
+        # A cancel may have been requested through another serve-mode worker
+        if os.path.exists(job_cancel_path(self.id)):
+            self.cancel_event.set()
+        self.save_status()
+    
+    def save_status(self):
+        """Share job state with the other serve-mode workers through MODEL_DIR"""
+        if serve_master_pid is None:
+            return
+        try:
+            os.makedirs(RETRAIN_JOBS_DIR, exist_ok=True)
+            path = os.path.join(RETRAIN_JOBS_DIR, f'{self.id}.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print(f"⚠️ Could not save retrain job status: {str(e)}")
+    
+    def run(self):
+        global data_aggregates
+        self.save_status()
+        try:
+            delta_records = None
+            search_summary = None
+            bundle = None
+            if self.mode == 'incremental':
+                self.status = 'training'
+                try:
+                    bundle, delta_records = build_incremental_bundle(model_registry.get(self.model_name), progress=self._set_progress,
+                                                                     cancel_event=self.cancel_event, name=self.model_name)
+                except IncrementalRetrainUnavailable as e:
+                    print(f"⚠️ Incremental retrain not possible ({str(e)}) - running a full retrain")
+                    self.mode = 'full'
+                
+                if delta_records == 0:
+                    current = model_registry.get(self.model_name)
+                    self.result = {
+                        'total_records': len(current.data),
+                        'delta_records': 0,
+                        'model_version': current.version,
+                        'train_score': current.train_score,
+                        'last_train_time': current.trained_at.isoformat(),
+                        'message': 'Model is already up to date'
+                    }
+                    self.status = 'completed'
+                    self.progress = 1.0
+                    return
+            
+            if bundle is None:
+                self.status = 'loading'
+                with metrics.timer('training_phase', phase='load'):
+                    # A full retrain rereads the source; a search may start from the snapshot plus new rows
+                    frame = read_training_data(use_cache=self.mode == 'search')
+                if frame is not None and self.region:
+                    frame = region_frame(frame, self.region)
+                if frame is None or len(frame) == 0:
+                    raise ValueError('No data available for model training')
+                self.progress = 0.1
+                
+                self.status = 'training'
+                if self.mode == 'search':
+                    bundle, search_summary = build_search_bundle(frame, progress=self._set_progress, cancel_event=self.cancel_event,
+                                                                 name=self.model_name, region=self.region)
+                else:
+                    bundle = build_model_bundle(frame, progress=self._set_progress, cancel_event=self.cancel_event,
+                                                name=self.model_name, region=self.region)
+            
+            # Dashboard aggregates follow the primary model's data
+            if self.model_name == PRIMARY_MODEL:
+                aggregates = DataAggregates()
+                aggregates.rebuild(bundle.data)
+                publish_model(bundle)
+                data_aggregates = aggregates
+            else:
+                publish_model(bundle, self.model_name)
+            
+            self.result = {
+                'model': self.model_name,
+                'region': self.region,
+                'total_records': len(bundle.data),
+                'delta_records': delta_records,
+                'model_version': bundle.version,
+                'train_score': bundle.train_score,
+                'holdout_r2': bundle.holdout_r2,
+                'last_train_time': bundle.trained_at.isoformat(),
+                'search': search_summary
+            }
+            self.status = 'completed'
+            self.progress = 1.0
+            print(f"✅ Retrain job {self.id} completed - {self.model_name} model v{bundle.version} is live")
+            self.save_status()
+            notify_model_published()
+        except RetrainCancelled:
+            self.status = 'cancelled'
+            print(f"🛑 Retrain job {self.id} cancelled")
+        except Exception as e:
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"❌ Retrain job {self.id} failed: {str(e)}")
+        finally:
+            self.finished_at = datetime.now()
+            self.save_status()
+            try:
+                os.remove(job_cancel_path(self.id))
+            except OSError:
+                pass
+            if self.lock_file is not None:
+                self.lock_file.close()
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'mode': self.mode,
+            'model': self.model_name,
+            'region': self.region,
+            'status': self.status,
+            'progress': self.progress,
+            'requested_by': self.requested_by,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'error': self.error,
+            'result': self.result
+        }
+
+def job_cancel_path(job_id):
+    """Marker file asking the worker running a job to cancel it"""
+    return os.path.join(RETRAIN_JOBS_DIR, f'{job_id}.cancel')
+
+def load_job_status(job_id):
+    """Read a job status saved by another serve-mode worker, or None"""
+    if len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+        return None
+    try:
+        with open(os.path.join(RETRAIN_JOBS_DIR, f'{job_id}.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def notify_model_published():
+    """Ask the serve-mode master to roll all workers onto the newest model"""
+    if serve_master_pid is not None:
+        print("🔄 New model published - requesting a graceful worker reload")
+        os.kill(serve_master_pid, signal.SIGHUP)
+
+def start_retrain_job(requested_by, mode='full', model_name=PRIMARY_MODEL, region=None):
+    """Start a retrain job unless one is already running in any process
+    
+    Returns (job, started). When a job is already active it is returned with
+    started=False: the RetrainJob if it runs in this process, otherwise the
+    status dict saved by the serve-mode worker running it.
+    """
+    with retrain_jobs_lock:
+        for job in retrain_jobs.values():
+            if job.active:
+                return job, False
+        
+        # One retrain across all workers sharing MODEL_DIR
+        lock_file = acquire_file_lock('retrain', blocking=False)
+        if lock_file is None:
+            with open(os.path.join(MODEL_DIR, 'retrain.lock'), encoding='utf-8') as f:
+                running_id = f.read().strip()
+            return load_job_status(running_id) or {'job_id': running_id, 'status': 'running'}, False
+        
+        job = RetrainJob(requested_by, mode, model_name, region, lock_file)
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(job.id)
+        lock_file.flush()
+        retrain_jobs[job.id] = job
+        while len(retrain_jobs) > RETRAIN_JOBS_KEEP:
+            retrain_jobs.popitem(last=False)
+        job.thread.start()
+        return job, True
+
+def save_model_metrics(total_records, accuracy, delta_records=None, train_seconds=None, mode='full', model_type='RandomForest', notes=None):
+    """Save model training metrics to database"""
+    try:
+        if notes is None and mode == 'incremental':
+            notes = f'Incremental update with {delta_records} new records ({total_records} total)'
+        elif notes is None:
+            notes = f'Trained with {total_records} records'
+        
+        with metrics.timer('db_insert', backend=storage.name, table='model_metrics'):
+            storage.save_model_metrics(total_records, accuracy, notes[:500], mode, delta_records, train_seconds, model_type)
+    except Exception as e:
+        print(f"Error saving metrics: {str(e)}")
+
+def save_prediction_to_db(age, gender, bmi, bp, diabetic, children, smoker, region, predicted_cost):
+    """Queue a prediction for the background writer
+    
+    Returns 'enqueued' once the row is on the write-behind queue, or
+    'dropped' if the queue is full.
+    """
+    if prediction_writer.enqueue((age, gender, bmi, bp, diabetic, children, smoker, region, predicted_cost)):
+        return 'enqueued'
+    
+    print("⚠️ Prediction write queue is full - prediction dropped")
+    return 'dropped'
+
+def insert_predictions_bulk(rows):
+    """Insert many prediction rows in one transaction on the storage backend
+    
+    Each row is (age, gender, bmi, bloodpressure, diabetic, children, smoker,
+    region, predicted_claim). Returns the number of rows written.
+    """
+    with metrics.timer('db_insert', backend=storage.name, table='insurance_predictions'):
+        return storage.insert_predictions(rows)
+
+class PredictionWriter:
+    """Write-behind queue that persists predictions off the request path
+    
+    Requests put rows on a bounded in-process queue and return immediately.
+    A single worker thread drains the queue into insurance_predictions with
+    insert_predictions_bulk, taking whatever has piled up (up to batch_size)
+    in one round trip. When the database is unavailable the batch is appended
+    to a local JSON-lines spill file instead. While spilled rows are waiting
+    the worker re-probes the database every replay_interval and replays the
+    file once it is reachable again.
+    """
+    
+    def __init__(self, batch_size=DB_WRITE_BATCH_SIZE, flush_interval=DB_WRITE_FLUSH_INTERVAL,
+                 max_queue=WRITE_QUEUE_SIZE, spill_path=PREDICTION_SPILL_FILE, replay_interval=SPILL_REPLAY_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.replay_interval = replay_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_replay = 0.0
+        self._counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'persisted': 0,
+            'spilled': 0,
+            'replayed': 0,
+            'flush_errors': 0
+        }
+        self._flushes = 0
+        self._flush_seconds_total = 0.0
+        self._last_flush_ms = None
+    
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+    
+    def start(self):
+        """Start the worker thread if it is not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+            self._thread.start()
+    
+    def stop(self, timeout=10):
+        """Drain the queue and stop the worker thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def enqueue(self, row):
+        """Queue a row for persistence; returns False if the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+    
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                break
+            
+            if time.monotonic() - self._last_replay >= self.replay_interval:
+                # A failed replay must not stop the flush loop; it is retried next interval
+                try:
+                    if not storage.connected and (os.path.exists(self.spill_path) or os.path.exists(self.spill_path + '.replay')):
+                        self._last_replay = time.monotonic()
+                        if init_database():
+                            print("✅ Database reachable again - replaying spilled predictions")
+                    if storage.connected:
+                        self.replay_spill()
+                except Exception as e:
+                    self._last_replay = time.monotonic()
+                    self._count('flush_errors')
+                    print(f"⚠️ Spill replay failed: {str(e)}")
+    
+    def _write(self, batch):
+        if not storage.connected:
+            self.spill(batch)
+            return
+        
+        started = time.perf_counter()
+        try:
+            insert_predictions_bulk(batch)
+        except Exception as e:
+            print(f"⚠️ Error writing {len(batch)} predictions, spilling to {self.spill_path}: {str(e)}")
+            self._count('flush_errors')
+            self.spill(batch)
+            return
+        elapsed = time.perf_counter() - started
+        
+        with self._lock:
+            self._counters['persisted'] += len(batch)
+            self._flushes += 1
+            self._flush_seconds_total += elapsed
+            self._last_flush_ms = elapsed * 1000
+    
+    def spill(self, rows):
+        """Append rows to the local spill file"""
+        try:
+            # The file lock keeps serve-mode workers' appends whole and out of a replay's rename
+            with self._spill_lock, acquire_file_lock('spill'), open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(list(row)) + '\n' for row in rows))
+            self._count('spilled', len(rows))
+        except Exception as e:
+            print(f"❌ Could not spill {len(rows)} predictions: {str(e)}")
+            self._count('dropped', len(rows))
+    
+    def _read_replay(self, replay_path, resuming=False):
+        """Rows of the replay file, moving lines that do not parse to <spill>.bad
+        
+        A crash or full disk during spill() can leave a truncated last line,
+        which would otherwise fail every replay. When resuming, the bad lines
+        were already moved by the first attempt.
+        """
+        rows, bad = [], []
+        n_columns = INSERT_PREDICTION_SQL.count('?')
+        with open(replay_path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, list) or len(row) != n_columns:
+                        raise ValueError(f'expected {n_columns} values')
+                    rows.append(tuple(row))
+                except ValueError:
+                    bad.append(line if line.endswith('\n') else line + '\n')
+        if bad and not resuming:
+            with open(self.spill_path + '.bad', 'a', encoding='utf-8') as f:
+                f.writelines(bad)
+            self._count('dropped', len(bad))
+            print(f"⚠️ Moved {len(bad)} unreadable spilled rows to {self.spill_path}.bad")
+        return rows
+    
+    def replay_spill(self):
+        """Insert spilled rows into the database, keeping any that fail
+        
+        The number of rows handed to the database is recorded next to the
+        replay file before each batch is inserted, so a crash mid-replay
+        resumes after that batch rather than inserting the replayed rows
+        twice. A crash during an insert can lose that one batch. If an insert
+        fails, the offset is set back to that batch and the rest stays in the
+        replay file for the next attempt; rows are never copied between files. Serve-mode
+        workers share the spill file, so only the one holding the
+        spill-replay lock replays it; the others skip until their next turn.
+        """
+        self._last_replay = time.monotonic()
+        replay_lock = acquire_file_lock('spill-replay', blocking=False)
+        if replay_lock is None:
+            return 0
+        try:
+            return self._replay()
+        finally:
+            replay_lock.close()
+    
+    def _replay(self):
+        replay_path = self.spill_path + '.replay'
+        offset_path = replay_path + '.offset'
         
-        # Calculate and store metrics
-        train_score = model.score(X, y)
-        print(f"✅ Model trained successfully with {len(df)} records (R² Score: {train_score:.4f})")
+        with self._spill_lock, acquire_file_lock('spill'):
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                if os.path.exists(offset_path):
+                    os.remove(offset_path)
+                os.replace(self.spill_path, replay_path)
         
-        # Store metrics in database if connected
-        if db_connected:
-            save_model_metrics(len(df), train_score)
+        rows = self._read_replay(replay_path, resuming=os.path.exists(offset_path))
+        start = 0
+        if os.path.exists(offset_path):
+            with open(offset_path, encoding='utf-8') as f:
+                start = int(f.read().strip() or 0)
+            print(f"↩️ Resuming spill replay after {start} rows")
         
-        return True
-    except Exception as e:
-        print(f"Error preparing model: {str(e)}")
-        return False
+        replayed = 0
+        try:
+            for i in range(start, len(rows), self.batch_size):
+                self._save_offset(offset_path, min(i + self.batch_size, len(rows)))
+                replayed += insert_predictions_bulk(rows[i:i + self.batch_size])
+        except Exception as e:
+            # The rest stays in the replay file; the next attempt resumes at the failed batch
+            print(f"⚠️ Spill replay stopped after {replayed} rows: {str(e)}")
+            self._count('flush_errors')
+            self._save_offset(offset_path, start + replayed)
+        else:
+            os.remove(replay_path)
+            if os.path.exists(offset_path):
+                os.remove(offset_path)
+        if replayed:
+            self._count('replayed', replayed)
+            print(f"✅ Replayed {replayed} spilled predictions into the database")
+        return replayed
+    
+    def _save_offset(self, offset_path, offset):
+        with open(offset_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+        os.replace(offset_path + '.tmp', offset_path)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['queue_depth'] = self._queue.qsize()
+            stats['queue_capacity'] = self._queue.maxsize
+            stats['flushes'] = self._flushes
+            stats['last_flush_ms'] = self._last_flush_ms
+            stats['avg_flush_ms'] = (self._flush_seconds_total / self._flushes * 1000) if self._flushes else None
+            stats['worker_alive'] = self._thread is not None and self._thread.is_alive()
+        stats['spill_file_bytes'] = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+        return stats
 
-def save_model_metrics(total_records, accuracy):
-    """Save model training metrics to database"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return
-        
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO model_metrics (total_records, model_type, accuracy, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (total_records, 'RandomForest', accuracy, f'Trained with {total_records} records'))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error saving metrics: {str(e)}")
+prediction_writer = PredictionWriter()
+atexit.register(prediction_writer.stop)
 
-def save_prediction_to_db(age, gender, bmi, bp, diabetic, children, smoker, region, predicted_cost):
-    """Save prediction to database"""
-    if not db_connected:
-        print(f"⚠️ Database not connected. Prediction will be stored locally.")
-        return False
+class PredictionCache:
+    """In-process LRU/TTL cache of predictions keyed on encoded feature rows
     
-    try:
-        conn = get_db_connection()
-        if not conn:
-            print("⚠️ Could not establish database connection for saving prediction")
+    Keys are the float32 bytes of the encoded row, which is exactly what the
+    forest compares against, so two requests that would walk the same leaves
+    share an entry. Entries are keyed on (model version, row) like the Redis
+    keys, so a traffic split between two models shares the cache instead of
+    clearing it on every switch; entries of a replaced model are never read
+    again and age out through the LRU and TTL.
+    """
+    
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+    
+    def get(self, version, key):
+        key = (version, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return value
+    
+    def put(self, version, key, value):
+        key = (version, key)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({'backend': 'memory', 'entries': len(self._entries), 'max_entries': self.max_entries})
+        return stats
+
+class RedisPredictionCache:
+    """Prediction cache shared by all workers through Redis
+    
+    The model version is part of every key, so entries for an old model are
+    never read again and age out through their TTL. Hit/miss counters are
+    per process. The constructor pings the server, so an unreachable Redis
+    raises here and the in-process cache is used instead. Calls time out
+    after a few milliseconds, and after PREDICTION_CACHE_MAX_ERRORS errors
+    in a row the cache is skipped for PREDICTION_CACHE_COOLDOWN seconds, so
+    a dead Redis costs the hot path nothing but cache misses.
+    """
+    
+    def __init__(self, url, ttl=PREDICTION_CACHE_TTL, timeout=PREDICTION_CACHE_TIMEOUT):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_connect_timeout=timeout, socket_timeout=timeout)
+        # from_url does not connect; fail now rather than on the first prediction
+        self._client.ping()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'errors': 0, 'skipped': 0}
+        self._consecutive_errors = 0
+        self._open_until = 0.0
+    
+    def _key(self, version, key):
+        return f'insurance:prediction:{version}:'.encode() + key
+    
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+    
+    def _available(self):
+        """False while the breaker is open after repeated errors"""
+        if self._open_until and time.monotonic() < self._open_until:
+            self._count('skipped')
             return False
-        
-        cursor = conn.cursor()
-        # Insert into existing table schema with actual_claim_final as NULL since we don't have actual data
-        cursor.execute('''
-            INSERT INTO insurance_predictions (age, gender, bmi, bloodpressure, diabetic, children, smoker, region, actual_claim_final, predicted_claim)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)
-        ''', (age, gender, bmi, bp, diabetic, children, smoker, region, predicted_cost))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"✅ Prediction saved to database (predicted_claim: ${predicted_cost:.2f})")
         return True
-    except Exception as e:
-        print(f"⚠️ Error saving prediction to database: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False
+    
+    def _failed(self):
+        with self._lock:
+            self._counters['errors'] += 1
+            self._consecutive_errors += 1
+            if self._consecutive_errors >= PREDICTION_CACHE_MAX_ERRORS:
+                if not self._open_until or time.monotonic() >= self._open_until:
+                    print(f"⚠️ Shared prediction cache failing - skipping it for {PREDICTION_CACHE_COOLDOWN:.0f}s")
+                # Kept at the limit, so one failed trial after the cooldown reopens it
+                self._open_until = time.monotonic() + PREDICTION_CACHE_COOLDOWN
+    
+    def _succeeded(self):
+        if self._consecutive_errors or self._open_until:
+            with self._lock:
+                self._consecutive_errors = 0
+                self._open_until = 0.0
+    
+    def get(self, version, key):
+        if not self._available():
+            return None
+        try:
+            value = self._client.get(self._key(version, key))
+        except Exception:
+            self._failed()
+            return None
+        self._succeeded()
+        self._count('hits' if value is not None else 'misses')
+        return float(value) if value is not None else None
+    
+    def put(self, version, key, value):
+        if not self._available():
+            return
+        try:
+            self._client.set(self._key(version, key), repr(value), ex=max(1, int(self.ttl)))
+        except Exception:
+            self._failed()
+            return
+        self._succeeded()
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['backend'] = 'redis'
+        stats['breaker_open'] = time.monotonic() < self._open_until
+        return stats
+
+def create_prediction_cache():
+    """Build the configured prediction cache, or None when disabled"""
+    if PREDICTION_CACHE_SIZE <= 0:
+        return None
+    if PREDICTION_CACHE_URL:
+        try:
+            return RedisPredictionCache(PREDICTION_CACHE_URL)
+        except Exception as e:
+            print(f"⚠️ Shared prediction cache unavailable ({str(e)}) - using in-process cache")
+    return PredictionCache()
+
+prediction_cache = create_prediction_cache()
+
+def cache_version(bundle):
+    """Identify the model a cached prediction came from"""
+    return bundle.version if bundle.version is not None else f'mem-{id(bundle.model)}'
+
+def read_batch_records():
+    """Read batch prediction records from a JSON body or a CSV upload"""
+    if 'file' in request.files:
+        return pd.read_csv(request.files['file'], skipinitialspace=True)
+    
+    if request.mimetype == 'text/csv':
+        return pd.read_csv(io.StringIO(request.get_data(as_text=True)), skipinitialspace=True)
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('records')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON list of records, {"records": [...]} or a CSV file upload')
+    return pd.DataFrame.from_records(data)
+
+def encode_batch(records, encoders):
+    """Validate and encode a batch of records in one vectorized pass
+    
+    Returns (X, valid_mask, errors) where X holds the encoded feature rows for
+    the valid records only and errors maps row index to a validation message.
+    """
+    n_rows = len(records)
+    frame = pd.DataFrame(index=records.index)
+    errors = {}
+    
+    def add_error(mask, message):
+        for idx in np.flatnonzero(mask):
+            errors.setdefault(int(idx), message)
+    
+    # Numeric features - same defaults and "required" rules as /api/predict
+    for col, default, required in [('age', 0, True), ('bmi', 0, True), ('bloodpressure', 0, True), ('children', 0, False)]:
+        raw = records[col] if col in records.columns else pd.Series(default, index=records.index)
+        values = pd.to_numeric(raw, errors='coerce')
+        values = values.where(raw.notna(), default)
+        add_error(values.isna().to_numpy(), f'Invalid numeric value for {col}')
+        if required:
+            add_error((values == 0).to_numpy(), 'All fields are required')
+        frame[col] = values
+    frame['children'] = frame['children'].fillna(0).astype(int)
+    
+    # Categorical features - encode the whole column against the fitted classes
+    defaults = {'gender': 'male', 'diabetic': 'no', 'smoker': 'no', 'region': 'northeast'}
+    for col in CATEGORICAL_COLUMNS:
+        raw = records[col] if col in records.columns else pd.Series(defaults[col], index=records.index)
+        values = raw.fillna(defaults[col]).astype(str).str.strip().str.lower()
+        codes = pd.Categorical(values, categories=encoders[col].classes_).codes
+        add_error(codes < 0, f'Invalid value for {col}')
+        frame[col] = codes
+    
+    valid_mask = np.ones(n_rows, dtype=bool)
+    if errors:
+        valid_mask[list(errors.keys())] = False
+    
+    X = frame.loc[valid_mask, FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    return X, valid_mask, errors
+
+def build_history_filters(args):
+    """Turn region/smoker/date_from/date_to query args into SQL clauses and params"""
+    clauses, params = [], []
+    for col in ('region', 'smoker'):
+        value = args.get(col)
+        if value:
+            clauses.append(f"{col} = ?")
+            params.append(value.strip().lower())
+    if args.get('date_from'):
+        clauses.append("prediction_date >= ?")
+        params.append(datetime.fromisoformat(args['date_from']))
+    if args.get('date_to'):
+        clauses.append("prediction_date < ?")
+        params.append(datetime.fromisoformat(args['date_to']))
+    return clauses, params
+
+def encode_history_cursor(prediction_date, row_id):
+    """Opaque keyset cursor for the row a history page ended on"""
+    raw = json.dumps([prediction_date.isoformat(), int(row_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(token):
+    try:
+        date_text, row_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(date_text), int(row_id)
+    except Exception:
+        raise ValueError('malformed cursor')
+
+def serialize_history_row(row):
+    """Build the JSON dict for one history row tuple (HISTORY_COLUMNS order)"""
+    _, age, gender, bmi, bp, diabetic, children, smoker, region, predicted, prediction_date = row
+    return {
+        'age': int(age),
+        'gender': gender.lower(),
+        'bmi': float(bmi),
+        'bloodpressure': int(bp),
+        'diabetic': diabetic.lower(),
+        'children': int(children),
+        'smoker': smoker.lower(),
+        'region': region.lower(),
+        'predicted_cost': float(predicted),
+        'timestamp': prediction_date.isoformat() if hasattr(prediction_date, 'isoformat') else str(prediction_date)
+    }
+
+@app.before_request
+def start_request_timer():
+    if request.path.startswith('/api/'):
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    """Record latency and status of every /api/* request"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_duration', time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        metrics.increment('http_requests', endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
 
 def login_required(f):
     """Decorator to require login"""
@@ -305,11 +3187,163 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+class RequestThrottled(Exception):
+    """A request refused by a rate limit or an admission gate"""
+    def __init__(self, status, message, reason, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """Token-bucket rate limits per endpoint class, per user and across all users
+    
+    Buckets refill continuously at their rate up to their burst size. Limits
+    apply per process, so with several workers the effective rate is
+    multiplied by the number of workers.
+    """
+    
+    def __init__(self, limits, enabled=True):
+        self.limits = limits
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._buckets = {}  # (limit class, username or None for global) -> [tokens, updated]
+    
+    def _take(self, key, rate, burst, now):
+        """Take a token; returns 0, or the seconds until one is available"""
+        burst = max(burst, 1)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+    
+    def check(self, limit_class, username):
+        """Admit one request or raise RequestThrottled (429 per user, 503 global)"""
+        if not self.enabled or limit_class not in self.limits:
+            return
+        user_rate, user_burst, global_rate, global_burst = self.limits[limit_class]
+        now = time.monotonic()
+        with self._lock:
+            if user_rate > 0:
+                wait = self._take((limit_class, username), user_rate, user_burst, now)
+                if wait:
+                    raise RequestThrottled(429, 'Rate limit exceeded, slow down', f'{limit_class}_user', math.ceil(wait))
+            if global_rate > 0:
+                wait = self._take((limit_class, None), global_rate, global_burst, now)
+                if wait:
+                    # Not this user's fault: give their token back
+                    if user_rate > 0:
+                        self._buckets[(limit_class, username)][0] += 1
+                    raise RequestThrottled(503, 'Server busy, retry later', f'{limit_class}_global', math.ceil(wait))
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMITS_ENABLED)
+
+class AdmissionGate:
+    """Caps concurrent requests doing one kind of work, shedding the excess
+    
+    Up to max_active requests run at once. Others wait, at most max_waiting
+    of them and for at most wait_seconds each; the rest are refused straight
+    away, so a burst turns into quick 503s instead of a growing queue.
+    """
+    
+    def __init__(self, name, max_active, max_waiting=ADMISSION_QUEUE, wait_seconds=ADMISSION_WAIT_SECONDS):
+        self.name = name
+        self._max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def max_active(self):
+        # Resolved on first use so the default can follow the CPU budget
+        if not self._max_active:
+            self._max_active = 2 * cpu_budget()
+        return self._max_active
+    
+    def acquire(self):
+        """Take a slot or raise RequestThrottled (503)"""
+        with self._cond:
+            if self.active < self.max_active:
+                self.active += 1
+                return
+            if self.waiting >= self.max_waiting:
+                raise RequestThrottled(503, 'Server busy, retry later', f'{self.name}_queue', 1)
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.max_active, self.wait_seconds)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                raise RequestThrottled(503, 'Server busy, retry later', f'{self.name}_wait', 1)
+            self.active += 1
+    
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+inference_gate = AdmissionGate('inference', MAX_INFERENCE_CONCURRENCY)
+database_gate = AdmissionGate('database', MAX_DB_CONCURRENCY)
+
+def throttled_response(error):
+    """429/503 response with Retry-After for a refused request"""
+    metrics.increment('requests_throttled', reason=error.reason)
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admission_controlled(limit_class, gate=None):
+    """Decorator applying a rate-limit class and an optional admission gate (use under login_required)"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                rate_limiter.check(limit_class, session.get('username'))
+                if gate is not None:
+                    gate.acquire()
+            except RequestThrottled as e:
+                return throttled_response(e)
+            if gate is None:
+                return f(*args, **kwargs)
+            try:
+                response = f(*args, **kwargs)
+            except BaseException:
+                gate.release()
+                raise
+            # Streamed responses keep their slot until the body has been sent
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(gate.release)
+            else:
+                gate.release()
+            return response
+        return decorated_function
+    return decorator
+
 @app.route('/')
 def index():
     """Serve main page"""
     return render_template('index.html')
 
+@app.route('/healthz')
+def liveness():
+    """Liveness: the process is up and answering"""
+    return jsonify({'status': 'alive', 'uptime_seconds': round(time.time() - startup.started_at, 1)}), 200
+
+@app.route('/readyz')
+def readiness():
+    """Readiness: data and model are loaded, so API requests can be served"""
+    body = startup.describe()
+    return jsonify(body), 200 if body['ready'] else 503
+
 @app.route('/api/login', methods=['POST'])
 def login():
     """Handle login"""
@@ -333,7 +3367,7 @@ def login():
                     'username': username,
                     'role': role,
                     'login_time': datetime.now().strftime("%H:%M"),
-                    'db_status': 'connected' if db_connected else 'disconnected'
+                    'db_status': 'connected' if storage.connected else 'disconnected'
                 }), 200
         
         return jsonify({'error': 'Invalid credentials'}), 401
@@ -347,36 +3381,58 @@ def logout():
     session.clear()
     return jsonify({'success': True}), 200
 
+def payload_response(entry):
+    """Serve a cached payload in the best accepted encoding, or 304 if the client has it"""
+    encoding = request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in entry.encodings], default='identity')
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag = entry.etag if encoding == 'identity' else f'{entry.etag}-{encoding}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.encodings[encoding], mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Per-user (login required) and always revalidated, which is a 304 while nothing changed
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/data/stats', methods=['GET'])
 @login_required
+@admission_controlled('dashboard')
 def get_stats():
     """Get dataset statistics"""
     try:
-        return jsonify({
-            'total_records': len(df),
-            'avg_claim': float(df['claim'].mean()),
-            'max_claim': float(df['claim'].max()),
-            'min_claim': float(df['claim'].min()),
-            'features': len(df.columns),
-            'db_connected': db_connected,
-            'last_model_train': last_model_train_time.isoformat() if last_model_train_time else None
-        }), 200
+        primary = model_registry.primary
+        aggregates = data_aggregates
+        
+        def build():
+            stats = aggregates.stats()
+            stats.update({
+                'db_connected': storage.connected,
+                'last_model_train': primary.trained_at.isoformat() if primary else None
+            })
+            return stats
+        
+        key = (aggregates.version, primary.version if primary else None, primary.trained_at if primary else None, storage.connected)
+        return payload_response(payload_cache.get('stats', key, build, aggregates.updates))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/data/charts', methods=['GET'])
 @login_required
+@admission_controlled('dashboard')
 def get_charts_data():
     """Get data for charts"""
     try:
-        global df
-        
-        # If df is empty or None, try to reload
-        if df is None or len(df) == 0:
+        # If no data has been loaded yet, try to reload
+        if data_aggregates.total == 0:
             print("🔄 Reloading data for charts...")
             load_data()
         
-        if df is None or len(df) == 0:
+        if data_aggregates.total == 0:
             print("⚠️ No data available for charts")
             return jsonify({
                 'error': 'No data available',
@@ -389,39 +3445,8 @@ def get_charts_data():
                 'total_records': 0
             }), 200
         
-        # Age distribution
-        age_bins = [18, 25, 35, 45, 55, 65]
-        age_counts = pd.cut(df['age'], bins=age_bins).value_counts().sort_index()
-        
-        # Smoker statistics
-        smoker_stats = df.groupby('smoker')['claim'].agg(['mean', 'count']).to_dict()
-        
-        # Region counts
-        region_counts = df['region'].value_counts().to_dict()
-        
-        # BMI vs Claim data sample
-        bmi_claim_data = df[['bmi', 'claim']].sample(min(100, len(df))).values.tolist()
-        
-        # Gender distribution
-        gender_counts = df['gender'].value_counts().to_dict()
-        
-        # Diabetic distribution
-        diabetic_counts = df['diabetic'].value_counts().to_dict()
-        
-        print(f"✅ Chart data generated for {len(df)} records")
-        
-        return jsonify({
-            'age_distribution': {
-                'labels': [f"{int(age_bins[i])}-{int(age_bins[i+1])}" for i in range(len(age_bins)-1)],
-                'data': age_counts.values.tolist()
-            },
-            'smoker_impact': smoker_stats,
-            'regional_analysis': region_counts,
-            'gender_analysis': gender_counts,
-            'diabetic_analysis': diabetic_counts,
-            'bmi_claim': bmi_claim_data,
-            'total_records': len(df)
-        }), 200
+        aggregates = data_aggregates
+        return payload_response(payload_cache.get('charts', aggregates.version, aggregates.charts, aggregates.updates))
     except Exception as e:
         print(f"⚠️ Error generating chart data: {str(e)}")
         import traceback
@@ -437,128 +3462,271 @@ def get_charts_data():
             'total_records': 0
         }), 200
 
+def parse_prediction_input(data):
+    """Normalize a /api/predict body; returns None when a required field is missing"""
+    age = float(data.get('age', 0))
+    gender = data.get('gender', 'male')
+    bmi = float(data.get('bmi', 0))
+    bloodpressure = float(data.get('bloodpressure', 0))
+    diabetic = data.get('diabetic', 'No')
+    children = int(data.get('children', 0))
+    smoker = data.get('smoker', 'No')
+    region = data.get('region', 'northeast')
+    
+    if not all([age, gender, bmi, bloodpressure, diabetic, region]):
+        return None
+    
+    # Normalize all categorical fields to lowercase for encoding
+    return {
+        'age': age,
+        'gender': gender.lower(),
+        'bmi': bmi,
+        'bloodpressure': bloodpressure,
+        'diabetic': diabetic.lower(),
+        'children': children,
+        'smoker': smoker.lower(),
+        'region': region.lower()
+    }
+
+def prediction_features(bundle, fields, endpoint='predict'):
+    """Encode normalized fields with the bundle's encoders (ValueError for unknown categories)"""
+    with metrics.timer('encode', endpoint=endpoint):
+        gender_enc = bundle.le_dict['gender'].transform([fields['gender']])[0]
+        diabetic_enc = bundle.le_dict['diabetic'].transform([fields['diabetic']])[0]
+        smoker_enc = bundle.le_dict['smoker'].transform([fields['smoker']])[0]
+        region_enc = bundle.le_dict['region'].transform([fields['region']])[0]
+    return [fields['age'], gender_enc, fields['bmi'], fields['bloodpressure'], diabetic_enc,
+            fields['children'], smoker_enc, region_enc]
+
+def cached_prediction(bundle, features):
+    """Cached cost for a feature row under the bundle's version, or None"""
+    if prediction_cache is None:
+        return None
+    return prediction_cache.get(cache_version(bundle), np.asarray(features, dtype=np.float32).tobytes())
+
+def remember_prediction(bundle, features, predicted_cost):
+    """Cache a freshly computed cost for a feature row"""
+    if prediction_cache is not None:
+        prediction_cache.put(cache_version(bundle), np.asarray(features, dtype=np.float32).tobytes(), predicted_cost)
+
+def record_prediction(fields, predicted_cost):
+    """Queue a prediction for persistence and fold it into the aggregates; returns db_saved"""
+    # Hand off to the write-behind queue; persistence happens in the background
+    db_saved = save_prediction_to_db(fields['age'], fields['gender'], fields['bmi'], fields['bloodpressure'],
+                                     fields['diabetic'], fields['children'], fields['smoker'], fields['region'],
+                                     predicted_cost)
+    data_aggregates.add(fields['age'], fields['gender'], fields['bmi'], fields['diabetic'], fields['smoker'],
+                        fields['region'], predicted_cost)
+    drift_monitor.observe(fields)
+    return db_saved
+
+def prediction_response(model_name, bundle, fields, predicted_cost, cache_hit, db_saved):
+    """Response body for a single prediction"""
+    return {
+        'success': True,
+        'predicted_cost': predicted_cost,
+        'model': model_name,
+        'model_version': bundle.version,
+        'cache_hit': cache_hit,
+        'db_saved': db_saved,
+        'input_summary': {
+            'age': fields['age'],
+            'gender': fields['gender'].title(),
+            'bmi': round(fields['bmi'], 1),
+            'bloodpressure': fields['bloodpressure'],
+            'diabetic': fields['diabetic'].title(),
+            'children': fields['children'],
+            'smoker': fields['smoker'].title(),
+            'region': fields['region'].title()
+        }
+    }
+
 @app.route('/api/predict', methods=['POST'])
 @login_required
+@admission_controlled('predict', inference_gate)
 def predict():
     """Make prediction"""
     try:
-        data = request.get_json()
-        
-        age = float(data.get('age', 0))
-        gender = data.get('gender', 'male')
-        bmi = float(data.get('bmi', 0))
-        bloodpressure = float(data.get('bloodpressure', 0))
-        diabetic = data.get('diabetic', 'No')
-        children = int(data.get('children', 0))
-        smoker = data.get('smoker', 'No')
-        region = data.get('region', 'northeast')
-        
-        if not all([age, gender, bmi, bloodpressure, diabetic, region]):
+        fields = parse_prediction_input(request.get_json())
+        if fields is None:
             return jsonify({'error': 'All fields are required'}), 400
         
-        # Normalize all categorical fields to lowercase for encoding
-        gender_lower = gender.lower()
-        region_lower = region.lower()
-        diabetic_lower = diabetic.lower()
-        smoker_lower = smoker.lower()
+        # Use one bundle snapshot so model and encoders always match
+        model_name, bundle = model_registry.route(fields['region'], session.get('username'))
+        if bundle is None:
+            return jsonify({'error': 'Model not ready'}), 503
         
         # Encode categorical features
         try:
-            gender_enc = le_dict['gender'].transform([gender_lower])[0]
-            diabetic_enc = le_dict['diabetic'].transform([diabetic_lower])[0]
-            smoker_enc = le_dict['smoker'].transform([smoker_lower])[0]
-            region_enc = le_dict['region'].transform([region_lower])[0]
+            features = prediction_features(bundle, fields)
         except ValueError as ve:
             return jsonify({'error': f'Invalid field value: {str(ve)}'}), 400
         
-        # Make prediction
-        prediction = model.predict([[age, gender_enc, bmi, bloodpressure, diabetic_enc, children, smoker_enc, region_enc]])
-        predicted_cost = float(prediction[0])
+        # Make prediction, reusing a cached result for a repeated profile
+        predicted_cost = cached_prediction(bundle, features)
+        cache_hit = predicted_cost is not None
+        if not cache_hit:
+            with metrics.timer('model_predict', endpoint='predict'):
+                predicted_cost = float(bundle.predictor([features])[0])
+            remember_prediction(bundle, features, predicted_cost)
+        
+        db_saved = record_prediction(fields, predicted_cost)
+        return jsonify(prediction_response(model_name, bundle, fields, predicted_cost, cache_hit, db_saved)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/predict/batch', methods=['POST'])
+@login_required
+@admission_controlled('batch', inference_gate)
+def predict_batch():
+    """Score many records with a single model call
+    
+    Accepts a JSON list of records (or {"records": [...]}) or a CSV upload in
+    the 'file' form field. Rows that fail validation are reported in 'errors'
+    and get a null prediction; the rest of the batch is still scored. Pass
+    ?save=true to persist the scored rows with bulk inserts. The batch is
+    scored by one model: ?model=<name>, or the traffic split for the user.
+    """
+    try:
+        model_name = request.args.get('model')
+        if model_name:
+            bundle = model_registry.get(model_name)
+            if bundle is None:
+                return jsonify({'error': f"Unknown model '{model_name}'"}), 404
+            if bundle.region is not None:
+                return jsonify({'error': f"Model '{model_name}' only serves region '{bundle.region}'"}), 400
+        else:
+            model_name, bundle = model_registry.route(None, session.get('username'))
+        if bundle is None:
+            return jsonify({'error': 'Model not ready'}), 503
+        
+        try:
+            records = read_batch_records()
+        except Exception as e:
+            return jsonify({'error': f'Could not read batch: {str(e)}'}), 400
+        
+        if len(records) == 0:
+            return jsonify({'error': 'No records supplied'}), 400
+        if len(records) > BATCH_MAX_ROWS:
+            return jsonify({'error': f'Batch too large ({len(records)} rows, max {BATCH_MAX_ROWS})'}), 413
         
-        # Save to database
-        db_saved = save_prediction_to_db(age, gender_lower, bmi, bloodpressure, diabetic_lower, children, smoker_lower, region_lower, predicted_cost)
+        records = records.reset_index(drop=True)
+        with metrics.timer('encode', endpoint='predict_batch'):
+            X, valid_mask, errors = encode_batch(records, bundle.le_dict)
+        
+        predictions = np.full(len(records), np.nan)
+        if len(X) > 0:
+            with metrics.timer('model_predict', endpoint='predict_batch'):
+                predictions[valid_mask] = bundle.predictor(X)
+        
+        print(f"✅ Batch scored {int(valid_mask.sum())}/{len(records)} records")
+        drift_monitor.observe_batch(X, bundle.le_dict)
+        
+        db_saved = {'persisted': 0, 'spilled': 0}
+        if request.args.get('save', '').lower() in ('1', 'true', 'yes') and len(X) > 0:
+            columns = []
+            for i, col in enumerate(FEATURE_COLUMNS):
+                if col in CATEGORICAL_COLUMNS:
+                    columns.append(bundle.le_dict[col].classes_[X[:, i].astype(int)].tolist())
+                elif col == 'children':
+                    columns.append(X[:, i].astype(int).tolist())
+                else:
+                    columns.append(X[:, i].tolist())
+            columns.append(predictions[valid_mask].tolist())
+            rows = list(zip(*columns))
+            for age, gender, bmi, _, diabetic, _, smoker, region, claim in rows:
+                data_aggregates.add(age, gender, bmi, diabetic, smoker, region, claim)
+            try:
+                if storage.connected:
+                    for i in range(0, len(rows), DB_WRITE_BATCH_SIZE):
+                        db_saved['persisted'] += insert_predictions_bulk(rows[i:i + DB_WRITE_BATCH_SIZE])
+            except Exception as e:
+                print(f"⚠️ Error saving batch predictions: {str(e)}")
+            
+            # Whatever could not be written goes to the spill file for replay
+            if db_saved['persisted'] < len(rows):
+                prediction_writer.spill(rows[db_saved['persisted']:])
+                db_saved['spilled'] = len(rows) - db_saved['persisted']
         
         return jsonify({
             'success': True,
-            'predicted_cost': predicted_cost,
+            'total': len(records),
+            'model': model_name,
+            'model_version': bundle.version,
+            'scored': int(valid_mask.sum()),
+            'failed': len(errors),
             'db_saved': db_saved,
-            'input_summary': {
-                'age': age,
-                'gender': gender_lower.title(),
-                'bmi': round(bmi, 1),
-                'bloodpressure': bloodpressure,
-                'diabetic': diabetic_lower.title(),
-                'children': children,
-                'smoker': smoker_lower.title(),
-                'region': region_lower.title()
-            }
+            'predictions': [None if np.isnan(p) else float(p) for p in predictions.tolist()],
+            'errors': [{'row': row, 'error': msg} for row, msg in sorted(errors.items())]
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/history', methods=['GET'])
 @login_required
+@admission_controlled('history', database_gate)
 def get_history():
-    """Get prediction history from database"""
+    """Get prediction history from database
+    
+    Newest first, paged by a keyset cursor on (prediction_date, id). Query
+    parameters: limit, cursor (next_cursor from the previous page), region,
+    smoker, date_from and date_to (ISO dates, date_to exclusive).
+    """
     try:
-        global db_connected
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+            clauses, params = build_history_filters(request.args)
+            cursor_token = request.args.get('cursor')
+            if cursor_token:
+                after_date, after_id = decode_history_cursor(cursor_token)
+                clauses.append("(prediction_date < ? OR (prediction_date = ? AND id < ?))")
+                params.extend([after_date, after_date, after_id])
+        except ValueError as ve:
+            return jsonify({'error': f'Invalid history query: {str(ve)}'}), 400
         
         # Try to connect if not already connected
-        if not db_connected:
+        if not storage.connected:
             print("🔄 Attempting to reconnect to database...")
             init_database()
         
-        conn = get_db_connection()
-        if not conn:
-            print("⚠️ Database connection failed - returning empty history")
-            return jsonify({
-                'predictions': [],
-                'source': 'db_error',
-                'message': 'Could not connect to database',
-                'db_connected': False
-            }), 200
-        
         try:
-            # Use correct column names: prediction_date instead of created_at
-            query = "SELECT TOP 100 age, gender, bmi, bloodpressure, diabetic, children, smoker, region, predicted_claim, prediction_date FROM insurance_predictions ORDER BY prediction_date DESC"
-            history_df = pd.read_sql(query, conn)
-            conn.close()
+            try:
+                # Fetch one extra row to know whether another page exists
+                rows = storage.fetch_history(clauses, params, limit + 1)
+            except ConnectionError:
+                print("⚠️ Database connection failed - returning empty history")
+                return jsonify({
+                    'predictions': [],
+                    'source': 'db_error',
+                    'message': 'Could not connect to database',
+                    'db_connected': False
+                }), 200
             
-            if history_df.empty:
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            
+            if not rows:
                 print("📊 No predictions in database yet")
                 return jsonify({
                     'predictions': [],
                     'source': 'database',
                     'total_in_db': 0,
                     'message': 'No predictions recorded yet',
+                    'has_more': False,
+                    'next_cursor': None,
                     'db_connected': True
                 }), 200
             
-            predictions = []
-            for _, row in history_df.iterrows():
-                try:
-                    pred_dict = {
-                        'age': int(row['age']),
-                        'gender': str(row['gender']).lower(),
-                        'bmi': float(row['bmi']),
-                        'bloodpressure': int(row['bloodpressure']),
-                        'diabetic': str(row['diabetic']).lower(),
-                        'children': int(row['children']),
-                        'smoker': str(row['smoker']).lower(),
-                        'region': str(row['region']).lower(),
-                        'predicted_cost': float(row['predicted_claim']),
-                        'timestamp': row['prediction_date'].isoformat() if hasattr(row['prediction_date'], 'isoformat') else str(row['prediction_date'])
-                    }
-                    predictions.append(pred_dict)
-                except Exception as e:
-                    print(f"⚠️ Error parsing prediction row: {str(e)}")
-                    continue
+            predictions = [serialize_history_row(row) for row in rows]
+            last = rows[-1]
             
             print(f"✅ Retrieved {len(predictions)} predictions from database")
             return jsonify({
                 'predictions': predictions,
                 'source': 'database',
                 'total_in_db': len(predictions),
+                'has_more': has_more,
+                'next_cursor': encode_history_cursor(last[10], last[0]) if has_more else None,
                 'db_connected': True
             }), 200
         except Exception as e:
@@ -582,52 +3750,230 @@ def get_history():
             'db_connected': False
         }), 200
 
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+def export_history_chunks(first_batch, batches, export_format):
+    """Encode history batches as CSV or NDJSON text, one chunk per batch"""
+    columns = ['id', 'age', 'gender', 'bmi', 'bloodpressure', 'diabetic', 'children', 'smoker', 'region', 'predicted_cost', 'timestamp']
+    if export_format == 'csv':
+        yield ','.join(columns) + '\n'
+    
+    rows_exported = 0
+    batch = first_batch
+    while batch is not None:
+        buffer = io.StringIO()
+        if export_format == 'csv':
+            writer = csv.writer(buffer, lineterminator='\n')
+            for row in batch:
+                record = serialize_history_row(row)
+                writer.writerow([int(row[0])] + [record[col] for col in columns[1:]])
+        else:
+            for row in batch:
+                buffer.write(json.dumps({'id': int(row[0]), **serialize_history_row(row)}, separators=(',', ':')))
+                buffer.write('\n')
+        rows_exported += len(batch)
+        yield buffer.getvalue()
+        batch = next(batches, None)
+    
+    metrics.increment('history_export_rows', rows_exported, format=export_format)
+    print(f"✅ Exported {rows_exported} predictions as {export_format}")
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks into one gzip stream on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/history/export', methods=['GET'])
+@login_required
+@admission_controlled('export', database_gate)
+def export_history():
+    """Stream the full prediction history as CSV or NDJSON
+    
+    Query parameters: format (csv or ndjson, default csv) and the same
+    region, smoker, date_from and date_to filters as /api/history. The body
+    is gzip-compressed on the fly when the client accepts it.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Invalid format '{export_format}' (use csv or ndjson)"}), 400
+    try:
+        clauses, params = build_history_filters(request.args)
+    except ValueError as ve:
+        return jsonify({'error': f'Invalid history query: {str(ve)}'}), 400
+    
+    if not storage.connected:
+        print("🔄 Attempting to reconnect to database...")
+        init_database()
+    
+    # Run the query before answering, so a database failure is still a proper error status
+    batches = storage.iter_history(clauses, params)
+    try:
+        first_batch = next(batches, None)
+    except Exception as e:
+        print(f"⚠️ History export failed: {str(e)}")
+        return jsonify({'error': f'Could not query predictions: {str(e)}', 'db_connected': False}), 503
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    chunks = export_history_chunks(first_batch, batches, export_format)
+    compress = request.accept_encodings['gzip'] > 0
+    response = Response(gzip_stream(chunks) if compress else (chunk.encode('utf-8') for chunk in chunks), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Content-Disposition'] = f'attachment; filename="predictions-{datetime.now():%Y%m%d-%H%M%S}.{extension}"'
+    response.call_on_close(batches.close)
+    return response
+
 @app.route('/api/retrain', methods=['POST'])
 @login_required
+@admission_controlled('retrain')
 def retrain_model():
-    """Retrain model with latest data from database"""
+    """Start a background retrain with latest data from database
+    
+    Pass mode=incremental (query string or JSON body) to only fold in
+    predictions added since the current model was built, or mode=search to
+    run a cross-validated hyperparameter search and serve the winner. Pass
+    model=<name> to train a named model beside the primary one (for A/B
+    variants), and region=<region> to train it on that region's rows only.
+    """
     try:
         # Check if user is admin
         if session.get('username') != 'admin':
             return jsonify({'error': 'Only admins can retrain the model'}), 403
         
-        # Reload data from database
-        if load_data():
-            if prepare_model():
-                return jsonify({
-                    'success': True,
-                    'message': 'Model retrained successfully',
-                    'total_records': len(df),
-                    'last_train_time': last_model_train_time.isoformat()
-                }), 200
+        data = request.get_json(silent=True) or {}
+        mode = request.args.get('mode', data.get('mode', 'full'))
+        if mode not in RetrainJob.MODES:
+            return jsonify({'error': f"Invalid retrain mode '{mode}'"}), 400
+        
+        model_name = request.args.get('model', data.get('model', PRIMARY_MODEL))
+        region = request.args.get('region', data.get('region')) or None
+        if not MODEL_NAME_PATTERN.match(model_name):
+            return jsonify({'error': 'Model names may only use a-z, 0-9, _ and - (max 32)'}), 400
+        if region is not None:
+            region = region.lower()
+            primary = model_registry.primary
+            if primary is not None and region not in primary.le_dict['region'].classes_:
+                return jsonify({'error': f"Unknown region '{region}'"}), 400
+        
+        job, started = start_retrain_job(session['username'], mode, model_name, region)
+        if not started:
+            return jsonify({
+                'error': 'A retrain is already running',
+                'job': job if isinstance(job, dict) else job.to_dict()
+            }), 409
         
-        return jsonify({'error': 'Failed to retrain model'}), 500
+        return jsonify({
+            'success': True,
+            'message': 'Retrain started',
+            'job': job.to_dict()
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/retrain/<job_id>', methods=['GET'])
+@login_required
+def retrain_status(job_id):
+    """Get status and progress of a retrain job"""
+    if session.get('username') != 'admin':
+        return jsonify({'error': 'Only admins can view retrain jobs'}), 403
+    
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        # Under serve mode the job may be running in another worker
+        saved = load_job_status(job_id)
+        if saved is not None:
+            return jsonify(saved), 200
+        return jsonify({'error': 'Unknown retrain job'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/retrain/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_retrain(job_id):
+    """Request cancellation of a running retrain job"""
+    if session.get('username') != 'admin':
+        return jsonify({'error': 'Only admins can cancel retrain jobs'}), 403
+    
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        # Under serve mode the job may be running in another worker, which polls for the marker
+        saved = load_job_status(job_id)
+        if saved is None:
+            return jsonify({'error': 'Unknown retrain job'}), 404
+        if saved['status'] not in ('queued', 'loading', 'training'):
+            return jsonify({'error': f"Job already {saved['status']}", 'job': saved}), 409
+        with open(job_cancel_path(job_id), 'w', encoding='utf-8') as f:
+            f.write(session['username'])
+        return jsonify({'success': True, 'job': saved}), 202
+    if not job.active:
+        return jsonify({'error': f'Job already {job.status}', 'job': job.to_dict()}), 409
+    
+    job.cancel_event.set()
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+
+@app.route('/api/models', methods=['GET'])
+@login_required
+def list_models():
+    """List registered models and the traffic routes"""
+    routes = model_registry.routes
+    return jsonify({
+        'models': model_registry.describe(),
+        'routes': {'split': dict(routes['split']), 'regions': routes['regions']}
+    }), 200
+
+@app.route('/api/models/routes', methods=['PUT'])
+@login_required
+def update_model_routes():
+    """Set the traffic split and per-region routes
+    
+    Body: {"split": {"primary": 90, "challenger": 10}, "regions": {"southeast": "se-model"}}
+    """
+    if session.get('username') != 'admin':
+        return jsonify({'error': 'Only admins can change model routes'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        model_registry.set_routes(data.get('split'), data.get('regions'))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': f'Invalid routes: {str(e)}'}), 400
+    
+    try:
+        save_model_routes()
+    except Exception as e:
+        print(f"⚠️ Could not save model routes: {str(e)}")
+    notify_model_published()
+    return list_models()
+
 @app.route('/api/db/status', methods=['GET'])
 @login_required
 def db_status():
     """Get database connection status"""
     try:
+        primary = model_registry.primary
         status_info = {
-            'connected': db_connected,
-            'df_loaded': df is not None and len(df) > 0 if df is not None else False,
-            'df_rows': len(df) if df is not None else 0,
-            'model_ready': model is not None,
-            'last_train_time': last_model_train_time.isoformat() if last_model_train_time else None
+            'connected': storage.connected,
+            'df_loaded': model_registry.data is not None and len(model_registry.data) > 0,
+            'df_rows': len(model_registry.data) if model_registry.data is not None else 0,
+            'model_ready': primary is not None,
+            'model_version': primary.version if primary else None,
+            'last_train_time': primary.trained_at.isoformat() if primary else None,
+            'models': model_registry.names(),
+            'storage': storage.name,
+            'pool': storage.stats(),
+            'write_queue': prediction_writer.stats(),
+            'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None
         }
         
-        if db_connected:
+        if storage.connected:
             try:
-                conn = get_db_connection()
-                if conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT COUNT(*) as count FROM insurance_predictions")
-                    count = cursor.fetchone()[0]
-                    cursor.close()
-                    conn.close()
-                    status_info['total_predictions'] = count
+                status_info['total_predictions'] = storage.count_predictions()
             except Exception as e:
                 status_info['db_error'] = str(e)
         
@@ -635,6 +3981,85 @@ def db_status():
     except Exception as e:
         return jsonify({'connected': False, 'error': str(e)}), 200
 
+@app.route('/api/drift', methods=['GET'])
+@login_required
+@admission_controlled('dashboard')
+def get_drift():
+    """Drift of prediction traffic against the primary model's training data
+    
+    Per feature: PSI (and a KS-style CDF gap for numeric features), the
+    share of out-of-range values or unseen categories, and a status of
+    stable, moderate or drift.
+    """
+    try:
+        report = drift_monitor.report()
+        primary = model_registry.primary
+        report.update({
+            'model_version': primary.version if primary else None,
+            'thresholds': {'moderate': DRIFT_PSI_WARN, 'drift': DRIFT_PSI_THRESHOLD, 'min_rows': DRIFT_MIN_ROWS},
+            'auto_retrain': DRIFT_AUTO_RETRAIN,
+            'last_retrain_trigger': drift_monitor.last_trigger
+        })
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def metrics_gauges():
+    """Current model, data, pool, queue and cache gauges as (name, labels, value)"""
+    gauges = [
+        ('uptime_seconds', {}, time.time() - metrics.started_at),
+        ('db_connected', {'backend': storage.name}, int(storage.connected)),
+        ('model_ready', {}, int(model_registry.primary is not None)),
+        ('startup_ready', {}, int(startup.ready)),
+        ('training_rows', {}, len(model_registry.data) if model_registry.data is not None else None),
+        ('aggregate_rows', {}, data_aggregates.total),
+        ('retrain_active', {}, sum(1 for job in list(retrain_jobs.values()) if job.active))
+    ]
+    for gate in (inference_gate, database_gate):
+        gauges.extend([
+            ('admission_active', {'gate': gate.name}, gate.active),
+            ('admission_waiting', {'gate': gate.name}, gate.waiting)
+        ])
+    for name, bundle in sorted(model_registry.snapshot().items()):
+        gauges.extend([
+            ('model_version', {'model': name}, bundle.version),
+            ('model_train_timestamp_seconds', {'model': name}, bundle.trained_at.timestamp()),
+            ('model_train_score', {'model': name}, bundle.train_score),
+            ('model_holdout_r2', {'model': name}, bundle.holdout_r2),
+            ('model_rows', {'model': name}, len(bundle.data) if bundle.data is not None else None)
+        ])
+    for name, weight in model_registry.routes['split']:
+        gauges.append(('model_route_weight', {'model': name}, weight))
+    drift = drift_monitor.report()
+    gauges.append(('drift_live_rows', {}, drift['live_rows']))
+    for name, feature in drift['features'].items():
+        gauges.append(('drift_psi', {'feature': name}, feature['psi']))
+    sources = [('storage', storage.stats()), ('write_queue', prediction_writer.stats())]
+    if prediction_cache is not None:
+        sources.append(('prediction_cache', prediction_cache.stats()))
+    for prefix, stats in sources:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges.append((f'{prefix}_{key}', {}, value))
+    return gauges
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of latency histograms and gauges
+    
+    Pass ?format=json for p50/p95/p99 per series instead. When METRICS_TOKEN
+    is set the scraper must send it as a bearer token.
+    """
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'latency': metrics.summary(),
+            'gauges': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in metrics_gauges()]
+        }), 200
+    return Response(metrics.render(metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -643,35 +4068,252 @@ def not_found(error):
 def server_error(error):
     return jsonify({'error': 'Server error'}), 500
 
+def cpu_budget():
+    """CPUs this process may use, honouring CPU affinity and cgroup quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max', encoding='utf-8') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def set_thread_budget(n_jobs):
+    """Cap the cores one process uses for forest training/predict, search and native thread pools"""
+    global SEARCH_WORKERS
+    FOREST_PARAMS['n_jobs'] = n_jobs
+    SEARCH_WORKERS = n_jobs
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        # Only n_jobs is capped then; BLAS/OpenMP pools keep their defaults
+        return
+    threadpool_limits(n_jobs)
+
+class StartupState:
+    """Staged startup and the readiness it reports
+    
+    The database connects and the data loads on one thread while another
+    imports the modelling stack and unpickles the saved models; the model
+    stage then publishes (or trains) once both are done. With start() this
+    all happens in the background, so the server can bind and answer / and
+    /healthz at once while /readyz reports 503 until data and model are in.
+    """
+    
+    STAGES = {
+        'database': '📊 Initializing Database',
+        'data': '📥 Loading Data',
+        'model_prefetch': '📦 Prefetching Saved Models',
+        'model': '🤖 Preparing Model'
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stages = {name: {'status': 'pending'} for name in self.STAGES}
+        self._thread = None
+    
+    @property
+    def ready(self):
+        return model_registry.primary is not None and model_registry.data is not None
+    
+    def _set(self, name, **fields):
+        with self._lock:
+            self.stages = dict(self.stages, **{name: fields})
+    
+    def run_stage(self, name, fn):
+        """Run one stage, recording its status and duration; returns True on success"""
+        print(f"{self.STAGES[name]}...")
+        self._set(name, status='running')
+        started = time.perf_counter()
+        error = None
+        try:
+            ok = fn() is not False
+        except Exception as e:
+            ok, error = False, str(e)
+        elapsed = time.perf_counter() - started
+        metrics.observe('startup_stage_duration', elapsed, stage=name)
+        self._set(name, status='ready' if ok else 'failed', seconds=round(elapsed, 3), error=error)
+        if not ok:
+            print(f"⚠️ {self.STAGES[name]} failed{': ' + error if error else ''}")
+        return ok
+    
+    def _load_data(self):
+        self.run_stage('database', init_database)
+        self.run_stage('data', load_data)
+    
+    def run(self):
+        """Run every stage in this thread (DB and data alongside the prefetch); returns readiness"""
+        data_thread = threading.Thread(target=self._load_data, name='startup-data', daemon=True)
+        data_thread.start()
+        self.run_stage('model_prefetch', prefetch_model_artifacts)
+        data_thread.join()
+        
+        if self.stages['data']['status'] == 'ready':
+            self.run_stage('model', load_or_train_model)
+        else:
+            self._set('model', status='skipped')
+        prefetched_artifacts.clear()
+        self.finished_at = time.time()
+        return self.ready
+    
+    def start(self):
+        """Run the stages on a background thread (once)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='startup', daemon=True)
+        self._thread.start()
+    
+    def describe(self):
+        ready = self.ready
+        return {
+            'ready': ready,
+            'stages': self.stages,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+            'startup_seconds': round(self.finished_at - self.started_at, 3) if self.finished_at else None
+        }
+
+startup = StartupState()
+
+def prepare_serving_state():
+    """Initialize the database, load data and load or train the model"""
+    ready = startup.run()
+    print("✅ All systems ready!" if ready else "⚠️ Startup incomplete - see /readyz")
+    return ready
+
+def interim_app(environ, start_response):
+    """WSGI app for the port while serve mode preloads: pages and health checks only"""
+    path = environ.get('PATH_INFO', '')
+    if path in ('/', '/healthz', '/readyz') or path.startswith('/static/'):
+        return app(environ, start_response)
+    body = b'{"error":"Server starting, retry later"}\n'
+    start_response('503 SERVICE UNAVAILABLE', [('Content-Type', 'application/json'), ('Retry-After', '5'),
+                                               ('Content-Length', str(len(body)))])
+    return [body]
+
+def serve_while_loading(host, port, load):
+    """Answer on host:port while load() runs in this thread, then release the port
+    
+    Health checks and the UI reach the master during the preload instead of
+    being refused. The interim server is shut down before gunicorn binds and
+    forks its workers, so no server thread outlives the preload.
+    """
+    from werkzeug.serving import make_server
+    try:
+        server = make_server(host, port, interim_app, threaded=True)
+    except OSError as e:
+        print(f"⚠️ Interim server unavailable ({str(e)}) - the port opens after the preload")
+        return load()
+    thread = threading.Thread(target=server.serve_forever, name='interim-server', daemon=True)
+    thread.start()
+    try:
+        return load()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def freeze_for_fork():
+    """Drop DB connections and freeze the heap so forked workers share it copy-on-write
+    
+    Connections must not be shared across processes, and gc.freeze keeps the
+    collector from touching (and so copying) the preloaded objects' pages.
+    """
+    storage.close()
+    gc.collect()
+    gc.freeze()
+
+def _serve_post_fork(server, worker):
+    global serve_master_pid
+    serve_master_pid = os.getppid()
+    set_thread_budget(FOREST_PARAMS['n_jobs'])
+
+def _serve_on_reload(arbiter):
+    # Runs in the master on SIGHUP, before the replacement workers are forked
+    print("🔄 Reloading data and newest model before replacing workers...")
+    frame = model_registry.data if load_data() else None
+    if frame is not None and len(frame) > 0:
+        if not load_model_artifact(frame, match_data=False):
+            print("⚠️ No compatible model artifact - workers keep the current model")
+        load_named_model_artifacts(frame)
+    freeze_for_fork()
+
+def serve(host, port, workers=0, threads=SERVE_THREADS):
+    """Run under gunicorn with data and model preloaded in the master
+    
+    Workers are forked after the preload, so they share the forest arrays
+    copy-on-write instead of each loading its own copy. The CPU budget is
+    split between workers, and each worker's forest n_jobs and native
+    thread pools are capped to its share. A SIGHUP to the master (sent
+    automatically when a retrain publishes a model) reloads the newest
+    model in the master and gracefully replaces the workers.
+    """
+    from gunicorn.app.base import BaseApplication
+    
+    budget = cpu_budget()
+    workers = workers or budget
+    set_thread_budget(max(1, budget // workers))
+    print(f"🧵 CPU budget {budget}: {workers} workers x {threads} threads, n_jobs={FOREST_PARAMS['n_jobs']} per worker")
+    
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': SERVE_TIMEOUT,
+        'graceful_timeout': SERVE_TIMEOUT,
+        'post_fork': _serve_post_fork,
+        'on_reload': _serve_on_reload
+    }
+    
+    class InsuranceApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+        
+        def load(self):
+            return app
+    
+    serve_while_loading(host, port, prepare_serving_state)
+    freeze_for_fork()
+    InsuranceApplication().run()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Health Insurance Prediction Portal')
+    parser.add_argument('command', nargs='?', choices=('run', 'serve'), default='run',
+                        help="'run' starts the development server, 'serve' the multi-worker production server")
+    parser.add_argument('--host', default=APP_HOST, help='Interface to bind (use 0.0.0.0 in containers)')
+    parser.add_argument('--port', type=int, default=APP_PORT)
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help='serve: worker processes (default: CPU budget)')
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS, help='serve: threads per worker')
+    args = parser.parse_args()
+    
     print("\n" + "="*60)
     print("🚀 Health Insurance Prediction Portal - Starting...")
     print("="*60)
     
-    # Initialize database
-    print("\n📊 Initializing Database...")
-    init_database()
-    
-    # Load data
-    print("📥 Loading Data...")
-    if load_data():
-        # Prepare model
-        print("🤖 Training Model...")
-        if prepare_model():
-            print("✅ All systems ready!")
-        else:
-            print("⚠️ Error training model")
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers, args.threads)
     else:
-        print("❌ Error loading data")
-    
-    print("\n" + "="*60)
-    print("🌐 Server Information:")
-    print(f"📱 Access the application at: http://localhost:5000")
-    print(f"🗄️  Database Status: {'Connected ✅' if db_connected else 'Disconnected ⚠️'}")
-    print(f"👤 Demo Credentials:")
-    print(f"   - Admin: admin / admin123 (Can retrain model)")
-    print(f"   - Doctor: doctor / doctor123")
-    print(f"   - User: user / user123")
-    print("="*60 + "\n")
-    
-    app.run(debug=False, host='localhost', port=5000)
+        # Data and model load in the background; /readyz reports when they are in
+        startup.start()
+        
+        print("\n" + "="*60)
+        print("🌐 Server Information:")
+        print(f"📱 Access the application at: http://{args.host}:{args.port}")
+        print(f"🩺 Liveness: /healthz, readiness: /readyz")
+        print(f"👤 Demo Credentials:")
+        print(f"   - Admin: admin / admin123 (Can retrain model)")
+        print(f"   - Doctor: doctor / doctor123")
+        print(f"   - User: user / user123")
+        print("="*60 + "\n")
+        
+        app.run(debug=False, host=args.host, port=args.port)
@@ -0,0 +1,452 @@
+"""Asyncio (ASGI) front end for the Health Insurance Prediction API
+
+Serves the same routes as app.py from one event loop so a single process can
+hold thousands of in-flight requests:
+
+- POST /api/predict is handled natively. Concurrent quotes are coalesced into
+  batched predictor calls on a bounded inference thread pool.
+- Every other route is the Flask view itself, run on a bounded thread pool:
+  history and database status on the DB lane (sized to the connection pool),
+  batch scoring on the inference lane, everything else on the web lane.
+
+Backpressure: when more than ASYNC_MAX_INFLIGHT requests are in flight, or a
+lane's queue is full, requests are answered 503 with Retry-After instead of
+queueing without bound. Requests that take longer than ASYNC_REQUEST_TIMEOUT
+to produce a response get a 504.
+
+Sessions are shared with the Flask app (same cookie and secret key).
+
+Usage:
+    python asgi_app.py --host 0.0.0.0 --port 5000
+    uvicorn asgi_app:app --port 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+import app as core
+
+ASYNC_MAX_INFLIGHT = int(os.getenv('ASYNC_MAX_INFLIGHT', '10000'))
+ASYNC_REQUEST_TIMEOUT = float(os.getenv('ASYNC_REQUEST_TIMEOUT', '30'))
+ASYNC_RETRY_AFTER = int(os.getenv('ASYNC_RETRY_AFTER', '1'))
+ASYNC_MAX_BODY_BYTES = int(os.getenv('ASYNC_MAX_BODY_BYTES', str(64 * 1024 * 1024)))
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', str(core.DB_POOL_SIZE)))
+ASYNC_WEB_THREADS = int(os.getenv('ASYNC_WEB_THREADS', '8'))
+ASYNC_INFERENCE_THREADS = int(os.getenv('ASYNC_INFERENCE_THREADS', '0'))  # 0 = one per CPU in the budget
+ASYNC_LANE_QUEUE = int(os.getenv('ASYNC_LANE_QUEUE', '1000'))  # queued calls per lane before 503
+ASYNC_BATCH_MAX_ROWS = int(os.getenv('ASYNC_BATCH_MAX_ROWS', '512'))
+
+# Flask routes that run on a lane other than 'web'
+DB_PATHS = ('/api/history', '/api/db/')
+INFERENCE_PATHS = ('/api/predict/batch',)
+
+class RequestRejected(Exception):
+    """Answered directly by the gateway without reaching a view"""
+    def __init__(self, status, message, reason, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ExecutorLane:
+    """A bounded thread pool that rejects work once its queue is full"""
+    def __init__(self, name, threads, max_queued=ASYNC_LANE_QUEUE):
+        self.name = name
+        self.threads = threads
+        self.max_pending = threads + max_queued
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'asgi-{name}')
+    
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool; raises RequestRejected when the lane is saturated"""
+        if self.pending >= self.max_pending:
+            raise RequestRejected(503, 'Server busy, retry later', f'{self.name}_queue', ASYNC_RETRY_AFTER)
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(fn, *args)
+        self.pending += 1
+        # Release on completion in the pool, not on cancellation of the awaiting
+        # request, so a timed-out call still counts until its thread is free
+        future.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wrap_future(future)
+    
+    def _release(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:
+            pass  # loop already closed at shutdown
+    
+    def _decrement(self):
+        self.pending -= 1
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def score_groups(groups):
+    """Score each model's rows with one predictor call (runs on the inference lane)"""
+    results = []
+    for bundle, rows in groups:
+        try:
+            with core.metrics.timer('model_predict', endpoint='predict_async'):
+                results.append(bundle.predictor(np.asarray(rows)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+class MicroBatcher:
+    """Coalesces concurrent single-row predictions into batched predictor calls
+    
+    No time window is added: a batch is whatever has queued by the time an
+    inference thread is free, so an idle server scores a quote immediately
+    and a busy one amortizes each forest traversal over many quotes.
+    """
+    def __init__(self, lane, max_rows=ASYNC_BATCH_MAX_ROWS):
+        self.lane = lane
+        self.max_rows = max_rows
+        self._queue = None
+        self._slots = None
+        self._task = None
+    
+    async def predict(self, bundle, features):
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.lane.threads)
+            self._task = loop.create_task(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((bundle, features, future))
+        return await future
+    
+    async def _collect(self):
+        while True:
+            items = [await self._queue.get()]
+            # While every inference thread is busy, more quotes queue up behind this one
+            await self._slots.acquire()
+            while len(items) < self.max_rows and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            
+            # Skip quotes whose request already timed out; one predictor call per model
+            groups = {}
+            for bundle, features, future in items:
+                if not future.done():
+                    groups.setdefault(id(bundle), (bundle, [], []))
+                    groups[id(bundle)][1].append(features)
+                    groups[id(bundle)][2].append(future)
+            if not groups:
+                self._slots.release()
+                continue
+            core.metrics.increment('async_batches')
+            core.metrics.increment('async_batched_rows', amount=sum(len(g[2]) for g in groups.values()))
+            asyncio.get_running_loop().create_task(self._score(list(groups.values())))
+    
+    async def _score(self, groups):
+        try:
+            results = await self.lane.run(score_groups, [(bundle, rows) for bundle, rows, _ in groups])
+        except Exception as e:
+            results = [e] * len(groups)
+        finally:
+            self._slots.release()
+        for (_, _, futures), result in zip(groups, results):
+            for i, future in enumerate(futures):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(float(result[i]))
+    
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+def session_username(headers):
+    """Username from the Flask session cookie, or None when not logged in"""
+    cookie = headers.get(b'cookie')
+    if not cookie:
+        return None
+    value = parse_cookie(cookie.decode('latin-1')).get(core.app.config['SESSION_COOKIE_NAME'])
+    if not value:
+        return None
+    serializer = core.app.session_interface.get_signing_serializer(core.app)
+    try:
+        data = serializer.loads(value, max_age=int(core.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('username')
+
+def json_response(status, payload, headers=()):
+    """(status, headers, body) for a JSON payload, encoded like Flask's jsonify"""
+    body = f"{core.app.json.dumps(payload, separators=(',', ':'))}\n".encode('utf-8')
+    return status, [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('latin-1'))] + list(headers), body
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI http scope"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # The body is fully buffered, so its length is known even for chunked uploads
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+def run_wsgi(environ):
+    """Call the Flask app; returns status, headers, the first body chunks and any unread rest
+    
+    Ordinary responses are read completely on the pool thread. For a
+    streamed response only the first chunks are read here and the rest of
+    the iterator is handed back, to be pulled chunk by chunk.
+    """
+    started = {}
+    chunks = []
+    
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+        return chunks.append
+    
+    result = core.app(environ, start_response)
+    iterator = iter(result)
+    for chunk in iterator:
+        chunks.append(chunk)
+        if len(chunks) >= 2:
+            return started['status'], started['headers'], chunks, (result, iterator)
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+    return started['status'], started['headers'], chunks, None
+
+class AsyncAPI:
+    """ASGI application serving the Flask routes from an event loop"""
+    def __init__(self):
+        self.inflight = 0
+        self.lanes = None
+        self.batcher = None
+    
+    def _ensure_lanes(self):
+        if self.lanes is None:
+            inference_threads = ASYNC_INFERENCE_THREADS or core.cpu_budget()
+            self.lanes = {
+                'db': ExecutorLane('db', ASYNC_DB_THREADS),
+                'web': ExecutorLane('web', ASYNC_WEB_THREADS),
+                'inference': ExecutorLane('inference', inference_threads)
+            }
+            self.batcher = MicroBatcher(self.lanes['inference'])
+        return self.lanes
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        
+        self._ensure_lanes()
+        if self.inflight >= ASYNC_MAX_INFLIGHT:
+            core.metrics.increment('async_rejected', reason='inflight')
+            await self.send_response(send, *json_response(503, {'error': 'Server busy, retry later'},
+                                                          [(b'retry-after', str(ASYNC_RETRY_AFTER).encode())]))
+            return
+        
+        self.inflight += 1
+        try:
+            try:
+                response = await asyncio.wait_for(self.dispatch(scope, receive), ASYNC_REQUEST_TIMEOUT)
+            except RequestRejected as e:
+                core.metrics.increment('async_rejected', reason=e.reason)
+                headers = [(b'retry-after', str(e.retry_after).encode())] if e.retry_after else []
+                response = json_response(e.status, {'error': str(e)}, headers)
+            except asyncio.TimeoutError:
+                core.metrics.increment('async_rejected', reason='timeout')
+                response = json_response(504, {'error': 'Request timed out'})
+            except Exception as e:
+                response = json_response(500, {'error': str(e)})
+            await self.send_response(send, *response)
+        finally:
+            self.inflight -= 1
+    
+    async def dispatch(self, scope, receive):
+        """Route a request; returns (status, headers, body) with body bytes or an async iterator"""
+        path = scope['path']
+        body = await self.read_body(scope, receive)
+        if path == '/api/predict' and scope['method'] == 'POST':
+            return await self.predict(scope, body)
+        
+        if path.startswith(DB_PATHS):
+            lane = self.lanes['db']
+        elif path.startswith(INFERENCE_PATHS):
+            lane = self.lanes['inference']
+        else:
+            lane = self.lanes['web']
+        status, headers, chunks, rest = await lane.run(run_wsgi, wsgi_environ(scope, body))
+        if rest is None:
+            return status, headers, b''.join(chunks)
+        return status, headers, self.stream_rest(lane, chunks, *rest)
+    
+    async def stream_rest(self, lane, chunks, result, iterator):
+        """Yield the prefetched chunks, then pull the rest of a streamed response on the lane"""
+        try:
+            for chunk in chunks:
+                yield chunk
+            while True:
+                chunk = await lane.run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+    
+    async def read_body(self, scope, receive):
+        """Read the request body, refusing bodies over ASYNC_MAX_BODY_BYTES"""
+        too_large = RequestRejected(413, f'Request body too large (max {ASYNC_MAX_BODY_BYTES} bytes)', 'body_size')
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > ASYNC_MAX_BODY_BYTES:
+                raise too_large
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise RequestRejected(499, 'Client disconnected', 'disconnect')
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > ASYNC_MAX_BODY_BYTES:
+                raise too_large
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+    
+    async def predict(self, scope, body):
+        """Async /api/predict: same contract as the Flask view, with batched inference"""
+        started = time.perf_counter()
+        status, payload = await self._predict(scope, body)
+        core.metrics.observe('http_request_duration', time.perf_counter() - started, endpoint='/api/predict', method='POST')
+        core.metrics.increment('http_requests', endpoint='/api/predict', method='POST', status=status)
+        return json_response(status, payload)
+    
+    async def _predict(self, scope, body):
+        username = session_username(dict(scope['headers']))
+        if username is None:
+            return 401, {'error': 'Unauthorized'}
+        try:
+            core.rate_limiter.check('predict', username)
+        except core.RequestThrottled as e:
+            raise RequestRejected(e.status, str(e), e.reason, e.retry_after)
+        try:
+            fields = core.parse_prediction_input(json.loads(body))
+            if fields is None:
+                return 400, {'error': 'All fields are required'}
+            
+            # Use one bundle snapshot so model and encoders always match
+            model_name, bundle = core.model_registry.route(fields['region'], username)
+            if bundle is None:
+                return 503, {'error': 'Model not ready'}
+            
+            try:
+                features = core.prediction_features(bundle, fields)
+            except ValueError as ve:
+                return 400, {'error': f'Invalid field value: {str(ve)}'}
+            
+            predicted_cost = core.cached_prediction(bundle, features)
+            cache_hit = predicted_cost is not None
+            if not cache_hit:
+                predicted_cost = await self.batcher.predict(bundle, features)
+                core.remember_prediction(bundle, features, predicted_cost)
+            
+            db_saved = core.record_prediction(fields, predicted_cost)
+            return 200, core.prediction_response(model_name, bundle, fields, predicted_cost, cache_hit, db_saved)
+        except RequestRejected:
+            raise
+        except Exception as e:
+            return 500, {'error': str(e)}
+    
+    async def send_response(self, send, status, headers, body):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if isinstance(body, bytes):
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        try:
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await body.aclose()
+    
+    async def lifespan(self, receive, send):
+        """Start loading data and model at startup; stop the pools and writer at shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Data and model load in the background; /readyz reports when they are in
+                core.startup.start()
+                self._ensure_lanes()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                core.prediction_writer.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.lanes is not None:
+            for lane in self.lanes.values():
+                lane.close()
+            self.lanes = None
+            self.batcher = None
+
+app = AsyncAPI()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Health Insurance Prediction Portal (asyncio server)')
+    parser.add_argument('--host', default=core.APP_HOST, help='Interface to bind (use 0.0.0.0 in containers)')
+    parser.add_argument('--port', type=int, default=core.APP_PORT)
+    args = parser.parse_args()
+    
+    import uvicorn
+    
+    print("\n" + "="*60)
+    print("🚀 Health Insurance Prediction Portal (async) - Starting...")
+    print(f"⚡ Up to {ASYNC_MAX_INFLIGHT} in-flight requests, {ASYNC_REQUEST_TIMEOUT:g}s timeout")
+    print("="*60)
+    uvicorn.run(app, host=args.host, port=args.port, lifespan='on', backlog=max(2048, ASYNC_MAX_INFLIGHT))
@@ -0,0 +1,318 @@
+"""Benchmark harness for the Health Insurance Prediction app
+
+Generates synthetic datasets with the same schema as the sample generator in
+app.py and measures data loading, training, inference and endpoint
+throughput. Each dataset size runs in its own subprocess so peak memory is
+measured per size. The app runs against the embedded SQLite storage backend
+in a temporary directory, so no SQL Server is needed.
+
+Usage:
+    python benchmark.py --sizes 1k,100k,1M --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+GENERATE_CHUNK_ROWS = 1_000_000
+STARTUP_TIMEOUT = 900
+
+def parse_size(text):
+    """Parse '1k', '100k', '1M' or '10M' into a row count"""
+    text = text.strip().lower()
+    if text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentiles(seconds):
+    """p50/p95/p99 and mean of a list of timings, in milliseconds"""
+    timings = np.asarray(seconds) * 1000
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99))
+    }
+
+def write_synthetic_csv(path, n_rows, seed):
+    """Write n_rows of sample-schema data to path in chunks"""
+    rng = np.random.RandomState(seed)
+    written = 0
+    while written < n_rows:
+        n = min(GENERATE_CHUNK_ROWS, n_rows - written)
+        pd.DataFrame({
+            'age': rng.randint(18, 65, n),
+            'gender': rng.choice(['male', 'female'], n),
+            'bmi': rng.uniform(15, 50, n),
+            'bloodpressure': rng.randint(80, 180, n),
+            'diabetic': rng.choice(['no', 'yes'], n),
+            'children': rng.randint(0, 6, n),
+            'smoker': rng.choice(['no', 'yes'], n),
+            'region': rng.choice(['northeast', 'northwest', 'southeast', 'southwest'], n),
+            'claim': rng.uniform(1000, 60000, n)
+        }).to_csv(path, mode='a' if written else 'w', header=not written, index=False)
+        written += n
+
+def sample_payloads(n, seed):
+    """Random /api/predict request bodies"""
+    rng = np.random.RandomState(seed)
+    return [{
+        'age': int(rng.randint(18, 65)),
+        'gender': str(rng.choice(['male', 'female'])),
+        'bmi': round(float(rng.uniform(15, 50)), 1),
+        'bloodpressure': int(rng.randint(80, 180)),
+        'diabetic': str(rng.choice(['No', 'Yes'])),
+        'children': int(rng.randint(0, 6)),
+        'smoker': str(rng.choice(['No', 'Yes'])),
+        'region': str(rng.choice(['northeast', 'northwest', 'southeast', 'southwest']))
+    } for _ in range(n)]
+
+def time_requests(client, method, url, payloads=None, count=1):
+    """Issue requests through the test client; returns latency stats and throughput"""
+    timings = []
+    statuses = {}
+    started = time.perf_counter()
+    for i in range(count):
+        request_started = time.perf_counter()
+        if method == 'POST':
+            response = client.post(url, json=payloads[i % len(payloads)] if payloads else None)
+        else:
+            response = client.get(url)
+        timings.append(time.perf_counter() - request_started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(timings), requests=count, requests_per_second=count / elapsed,
+                statuses={str(code): n for code, n in statuses.items()})
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def http_status(url):
+    """Status code of a GET, or None if nothing is listening yet"""
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            response.read(1)
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+def measure_startup(app_dir):
+    """Launch the dev server on the current working directory's data and time its startup
+    
+    Returns seconds to import app, to the first byte of / and to /readyz
+    answering 200 (data loaded and the saved model published).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([app_dir, os.environ.get('PYTHONPATH', '')]))
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import app'], env=env, check=True, capture_output=True)
+    results = {'import_seconds': time.perf_counter() - started}
+    
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(app_dir, 'app.py'), 'run', '--host', '127.0.0.1', '--port', str(port)],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < STARTUP_TIMEOUT:
+            if 'first_byte_seconds' not in results and http_status(base + '/') is not None:
+                results['first_byte_seconds'] = time.perf_counter() - started
+            if 'first_byte_seconds' in results and http_status(base + '/readyz') == 200:
+                results['ready_seconds'] = time.perf_counter() - started
+                break
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+def run_size(n_rows, args):
+    """Benchmark one dataset size in this process and return its results"""
+    workdir = tempfile.mkdtemp(prefix=f'insurance-bench-{n_rows}-')
+    os.environ.update({
+        'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(workdir, 'insurance.db'),
+        'MODEL_DIR': os.path.join(workdir, 'models'),
+        'PREDICTION_SPILL_FILE': os.path.join(workdir, 'prediction_spill.jsonl'),
+        'PREDICTION_CACHE_SIZE': '0',
+        # Measure raw throughput, not the per-user rate limits
+        'RATE_LIMITS_ENABLED': 'false'
+    })
+    # app reads insurance_data.csv from the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, args.app_dir)
+    import app
+    
+    results = {'rows': n_rows}
+    
+    started = time.perf_counter()
+    write_synthetic_csv('insurance_data.csv', n_rows, args.seed)
+    results['generate_seconds'] = time.perf_counter() - started
+    
+    app.init_database()
+    started = time.perf_counter()
+    app.load_data()
+    results['load_seconds'] = time.perf_counter() - started
+    results['load_peak_rss_mb'] = peak_rss_mb()
+    # The first load wrote the columnar snapshot; reloading memory-maps it
+    started = time.perf_counter()
+    app.read_training_data()
+    results['snapshot_load_seconds'] = time.perf_counter() - started
+    frame = app.model_registry.data
+    results['frame_memory_mb'] = float(frame.memory_usage(deep=True).sum() / (1024 * 1024))
+    
+    train_frame = frame if len(frame) <= args.max_train_rows else frame.head(args.max_train_rows)
+    started = time.perf_counter()
+    trained_model, encoders, train_score = app.train_model(train_frame)
+    results['train_rows'] = len(train_frame)
+    results['train_seconds'] = time.perf_counter() - started
+    results['train_score'] = float(train_score)
+    results['train_peak_rss_mb'] = peak_rss_mb()
+    app.publish_model(app.ModelBundle(trained_model, encoders, 1, datetime.now(), train_score, frame, None))
+    bundle = app.model_registry.primary
+    # Saved so the startup measurement below loads the model instead of training one
+    app.save_model_artifact(trained_model, encoders, app.compute_data_fingerprint(frame), len(frame), train_score, datetime.now())
+    
+    # Cold start of a fresh server process on the same data and saved model; before the
+    # endpoint runs below, whose saved predictions would change the data it loads
+    results['startup'] = measure_startup(args.app_dir)
+    
+    # Inference straight through the published predictor
+    X, _ = app.encode_frame(frame.head(max(args.batch_sizes)), bundle.le_dict)
+    timings = []
+    for i in range(args.single_repeats):
+        row = X[i % len(X):i % len(X) + 1]
+        started = time.perf_counter()
+        bundle.predictor(row)
+        timings.append(time.perf_counter() - started)
+    results['single_inference'] = percentiles(timings)
+    results['batch_inference'] = {}
+    for batch_size in args.batch_sizes:
+        batch = X[:batch_size]
+        started = time.perf_counter()
+        bundle.predictor(batch)
+        elapsed = time.perf_counter() - started
+        results['batch_inference'][str(len(batch))] = {'seconds': elapsed, 'rows_per_second': len(batch) / elapsed}
+    
+    # Endpoint throughput through the Flask test client
+    app.prediction_writer.start()
+    client = app.app.test_client()
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    payloads = sample_payloads(args.requests, args.seed)
+    results['endpoints'] = {
+        'predict': time_requests(client, 'POST', '/api/predict', payloads, args.requests),
+        'data_stats': time_requests(client, 'GET', '/api/data/stats', count=args.requests),
+        'data_charts': time_requests(client, 'GET', '/api/data/charts', count=args.requests),
+        'history': time_requests(client, 'GET', '/api/history?limit=100', count=args.requests)
+    }
+    app.prediction_writer.stop()
+    results['peak_rss_mb'] = peak_rss_mb()
+    results['spans'] = app.metrics.summary()
+
+    return results
+
+def environment_info():
+    """Versions and hardware the run was measured on"""
+    import sklearn
+    from importlib.metadata import version
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'flask': version('flask'),
+        'sklearn': sklearn.__version__,
+        'numpy': np.__version__,
+        'pandas': pd.__version__
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading, training, inference and endpoints')
+    parser.add_argument('--sizes', default='1k,100k', help='Comma separated dataset sizes, e.g. 1k,100k,1M,10M')
+    parser.add_argument('--output', default=None, help='JSON results path (default benchmark-<timestamp>.json)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--single-repeats', type=int, default=500, help='Single-row predictions to time')
+    parser.add_argument('--batch-sizes', default='1000,10000', help='Comma separated batch sizes to time')
+    parser.add_argument('--max-train-rows', type=parse_size, default=parse_size('1M'),
+                        help='Train on at most this many rows (forests on 10M rows take hours)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--size', type=parse_size, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--app-dir', default=os.path.dirname(os.path.abspath(__file__)), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    
+    # Child mode: benchmark one size and write its results to --result-file
+    if args.size is not None:
+        result = run_size(args.size, args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+    
+    report = {'environment': environment_info(), 'settings': {
+        'requests': args.requests,
+        'single_repeats': args.single_repeats,
+        'batch_sizes': args.batch_sizes,
+        'max_train_rows': args.max_train_rows,
+        'seed': args.seed
+    }, 'results': []}
+    
+    for size in args.sizes.split(','):
+        n_rows = parse_size(size)
+        print(f"⏱️ Benchmarking {n_rows} rows...")
+        result_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        child_args = [sys.executable, os.path.abspath(__file__), '--size', str(n_rows), '--result-file', result_file,
+                      '--requests', str(args.requests), '--single-repeats', str(args.single_repeats),
+                      '--batch-sizes', ','.join(map(str, args.batch_sizes)),
+                      '--max-train-rows', str(args.max_train_rows), '--seed', str(args.seed), '--app-dir', args.app_dir]
+        child = subprocess.run(child_args, capture_output=True, text=True)
+        if child.returncode != 0:
+            print(f"❌ Benchmark for {n_rows} rows failed:\n{child.stderr[-2000:]}")
+            report['results'].append({'rows': n_rows, 'error': child.stderr[-2000:]})
+            continue
+        with open(result_file, encoding='utf-8') as f:
+            result = json.load(f)
+        os.remove(result_file)
+        report['results'].append(result)
+        print(f"✅ {n_rows} rows: load {result['load_seconds']:.2f}s (snapshot {result['snapshot_load_seconds']:.3f}s), train {result['train_seconds']:.2f}s, "
+              f"predict p50 {result['single_inference']['p50_ms']:.2f} ms, "
+              f"/api/predict {result['endpoints']['predict']['requests_per_second']:.0f} req/s, "
+              f"first byte {result['startup'].get('first_byte_seconds', float('nan')):.2f}s, "
+              f"ready {result['startup'].get('ready_seconds', float('nan')):.2f}s, "
+              f"peak {result['peak_rss_mb']:.0f} MB")
+    
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""Bulk scoring CLI for the Health Insurance Prediction model
+
+Re-prices a whole file of records offline, without the web server. The input
+CSV or Parquet file is streamed in chunks that are scored across a process
+pool with the same validation and encoders as /api/predict/batch, and the
+results are written in input order: the input columns plus predicted_claim
+and error (empty for rows that scored). A checkpoint next to the output
+records the chunks written so far, so rerunning an interrupted command
+resumes where it stopped.
+
+The model is the newest saved artifact of --model (default: primary), a
+specific --artifact file, or, when nothing has been saved yet, one trained
+on the current data as the app would at startup.
+
+Usage:
+    python score.py renewals.csv scored.csv --workers 8
+    python score.py renewals.parquet scored.parquet --model challenger
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import app
+
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+
+def is_parquet(path):
+    return path.lower().endswith(PARQUET_SUFFIXES)
+
+def require_pyarrow():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("❌ Parquet input and output need pyarrow (pip install pyarrow)")
+    return pq
+
+def open_parquet(path):
+    return require_pyarrow().ParquetFile(path)
+
+def resolve_model(args):
+    """Return (model, encoders, artifact path or None, version) to score with"""
+    import joblib
+    if args.artifact:
+        artifact = joblib.load(args.artifact, mmap_mode='r')
+        return artifact['model'], artifact['le_dict'], os.path.abspath(args.artifact), artifact.get('meta', {}).get('version')
+    
+    for meta in app.list_model_artifacts():
+        if meta.get('model_name', app.PRIMARY_MODEL) == args.model and app.artifact_compatible(meta):
+            path = app.model_artifact_path(meta)
+            artifact = joblib.load(path, mmap_mode='r')
+            print(f"✅ Using {args.model} model artifact v{meta['version']} ({meta['total_records']} records, R² Score: {meta['train_score']:.4f})")
+            return artifact['model'], artifact['le_dict'], os.path.abspath(path), meta['version']
+    
+    if args.model != app.PRIMARY_MODEL:
+        raise SystemExit(f"❌ No saved artifact for model '{args.model}' in {app.MODEL_DIR}")
+    print("🤖 No saved model found - training one on the current data...")
+    app.init_database()
+    if not app.load_data() or not app.prepare_model():
+        raise SystemExit("❌ Could not train a model to score with")
+    bundle = app.model_registry.primary
+    path = app.model_artifact_path({'version': bundle.version}) if bundle.version is not None else None
+    return bundle.model, bundle.le_dict, os.path.abspath(path) if path else None, bundle.version
+
+# Model and encoders of a scoring worker process
+_worker = {}
+
+def _init_worker(artifact_path, model, encoders):
+    if artifact_path is not None:
+        import joblib
+        # Each worker holds its own copy of the forest: sklearn copies the tree arrays out of the file on load
+        artifact = joblib.load(artifact_path, mmap_mode='r')
+        model, encoders = artifact['model'], artifact['le_dict']
+    # The pool is the parallelism; keep each worker's model and native thread pools single-threaded
+    app.set_thread_budget(1)
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+    _worker.update(model=model, encoders=encoders)
+
+def score_chunk(index, records, header, parts_dir):
+    """Score one chunk in a worker; returns (index, rows, failed, CSV bytes or None)
+    
+    CSV output is formatted here so the parent only writes bytes; Parquet
+    output is written by the worker as its own part file.
+    """
+    records = records.reset_index(drop=True)
+    X, valid_mask, errors = app.encode_batch(records, _worker['encoders'])
+    predictions = np.full(len(records), np.nan)
+    if len(X) > 0:
+        predictions[valid_mask] = _worker['model'].predict(X)
+    messages = np.full(len(records), '', dtype=object)
+    for row, message in errors.items():
+        messages[row] = message
+    records['predicted_claim'] = predictions
+    records['error'] = messages
+    
+    if parts_dir is not None:
+        records.to_parquet(os.path.join(parts_dir, f'part-{index:06d}.parquet'), index=False)
+        return index, len(records), len(errors), None
+    return index, len(records), len(errors), records.to_csv(index=False, header=header).encode('utf-8')
+
+def read_chunks(path, chunk_rows, skip_chunks, offset=None):
+    """Yield (DataFrame chunk, input byte offset after it), starting after skip_chunks chunks
+    
+    CSV input is split into chunks on line boundaries (quoted fields must not
+    contain newlines), and a resume seeks straight to the byte offset saved
+    in the checkpoint instead of re-reading the rows before it.
+    """
+    if is_parquet(path):
+        # Batch sizes can follow row-group boundaries, so resume by counting batches
+        for i, batch in enumerate(open_parquet(path).iter_batches(batch_size=chunk_rows)):
+            if i >= skip_chunks:
+                yield batch.to_pandas(), None
+        return
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if offset:
+            f.seek(offset)
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            yield pd.read_csv(io.BytesIO(header + b''.join(lines)), skipinitialspace=True), f.tell()
+
+def count_rows(path):
+    """Row count when it is cheap to get (Parquet metadata), else None"""
+    if is_parquet(path):
+        return open_parquet(path).metadata.num_rows
+    return None
+
+def load_checkpoint(path, identity):
+    """The checkpoint to resume from, None to start over, or exit if it belongs to another run"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('identity') != identity:
+        raise SystemExit(f"❌ {path} was written for a different input, model or chunk size - rerun with --restart")
+    return state
+
+def save_checkpoint(path, state):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def run(args):
+    """Score args.input into args.output; returns the final checkpoint state"""
+    if is_parquet(args.input) or is_parquet(args.output):
+        require_pyarrow()
+    model, encoders, artifact_path, version = resolve_model(args)
+    stat = os.stat(args.input)
+    identity = {
+        'input': os.path.abspath(args.input),
+        'input_size': stat.st_size,
+        'input_mtime_ns': stat.st_mtime_ns,
+        'chunk_rows': args.chunk_rows,
+        'model_version': version,
+        'artifact': artifact_path,
+        'output_format': 'parquet' if is_parquet(args.output) else 'csv',
+        'checkpoint_format': 2
+    }
+    checkpoint_path = args.output + '.checkpoint.json'
+    state = None if args.restart else load_checkpoint(checkpoint_path, identity)
+    if state is None:
+        state = {'identity': identity, 'chunks_done': 0, 'rows_done': 0, 'rows_failed': 0, 'output_bytes': 0, 'input_offset': None}
+    else:
+        print(f"↩️ Resuming after chunk {state['chunks_done']} ({state['rows_done']:,} rows already scored)")
+    
+    # Parquet output is a directory of part files; CSV output one file truncated to the checkpoint
+    parts_dir = None
+    out = None
+    if identity['output_format'] == 'parquet':
+        parts_dir = args.output
+        if state['chunks_done'] == 0:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        os.makedirs(parts_dir, exist_ok=True)
+        for name in os.listdir(parts_dir):
+            if name.startswith('part-') and int(name[5:11]) >= state['chunks_done']:
+                os.remove(os.path.join(parts_dir, name))
+    elif state['chunks_done'] == 0:
+        out = open(args.output, 'wb')
+    else:
+        out = open(args.output, 'r+b')
+        out.truncate(state['output_bytes'])
+        out.seek(state['output_bytes'])
+    
+    total_rows = count_rows(args.input)
+    started = time.perf_counter()
+    rows_at_start = state['rows_done']
+    last_report = started
+    
+    def write(result):
+        nonlocal last_report
+        index, n_rows, n_failed, payload = result
+        state['input_offset'] = input_offsets.pop(index)
+        if out is not None:
+            out.write(payload)
+            out.flush()
+            os.fsync(out.fileno())
+            state['output_bytes'] = out.tell()
+        state['chunks_done'] = index + 1
+        state['rows_done'] += n_rows
+        state['rows_failed'] += n_failed
+        save_checkpoint(checkpoint_path, state)
+        
+        now = time.perf_counter()
+        if now - last_report >= args.progress_seconds:
+            last_report = now
+            rate = (state['rows_done'] - rows_at_start) / (now - started)
+            done = f" ({state['rows_done'] / total_rows:.1%})" if total_rows else ''
+            print(f"⏳ {state['rows_done']:,} rows scored{done} - {rate:,.0f} rows/s")
+    
+    print(f"🚀 Scoring {args.input} with {args.workers} workers, {args.chunk_rows:,} rows per chunk")
+    initargs = (artifact_path, None, None) if artifact_path else (None, model, encoders)
+    pending = {}
+    input_offsets = {}
+    next_index = state['chunks_done']
+    pool = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=initargs)
+    try:
+        chunks = read_chunks(args.input, args.chunk_rows, state['chunks_done'], state['input_offset'])
+        for index, (records, input_offset) in enumerate(chunks, start=state['chunks_done']):
+            input_offsets[index] = input_offset
+            pending[index] = pool.submit(score_chunk, index, records, index == 0, parts_dir)
+            # Bounded read-ahead; results are written strictly in input order
+            while len(pending) >= args.workers * 2:
+                write(pending.pop(next_index).result())
+                next_index += 1
+        while pending:
+            write(pending.pop(next_index).result())
+            next_index += 1
+    except BaseException:
+        print(f"❌ Scoring stopped after chunk {state['chunks_done']} - rerun the same command to resume")
+        raise
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if out is not None:
+            out.close()
+    
+    elapsed = time.perf_counter() - started
+    os.remove(checkpoint_path)
+    print(f"✅ Scored {state['rows_done']:,} rows ({state['rows_failed']:,} failed validation) in {elapsed:.1f}s "
+          f"({(state['rows_done'] - rows_at_start) / elapsed:,.0f} rows/s) -> {args.output}")
+    return state
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a CSV or Parquet file of records with the trained model')
+    parser.add_argument('input', help='Input .csv or .parquet file')
+    parser.add_argument('output', help='Output .csv file, or .parquet directory of part files')
+    parser.add_argument('--model', default=app.PRIMARY_MODEL, help='Named model whose newest artifact to use')
+    parser.add_argument('--artifact', help='Score with this artifact file instead')
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help='Rows per chunk (the unit of work and of checkpoints)')
+    parser.add_argument('--workers', type=int, default=0, help='Scoring processes (default: CPU budget)')
+    parser.add_argument('--progress-seconds', type=float, default=5.0, help='Seconds between progress lines')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+    args = parser.parse_args()
+    args.workers = args.workers or app.cpu_budget()
+    
+    try:
+        run(args)
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+if __name__ == '__main__':
+    main()
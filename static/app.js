@@ -880,6 +880,23 @@ function displayHistory(predictions) {
 /* MODEL RETRAINING */
 /* ============================================ */
 
+async function waitForRetrainJob(jobId, retrainBtn) {
+    while (true) {
+        const response = await fetch(`/api/retrain/${jobId}`);
+        const job = await response.json();
+        
+        if (!response.ok) {
+            return { status: 'failed', error: job.error };
+        }
+        if (!['queued', 'loading', 'training'].includes(job.status)) {
+            return job;
+        }
+        
+        retrainBtn.innerHTML = `<span class="spinner-small"></span> Retraining Model... ${Math.round(job.progress * 100)}%`;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 async function handleRetrain() {
     const confirmed = confirm('⚠️ This will retrain the model using all historical predictions from the database. Continue?');
     if (!confirmed) return;
@@ -900,11 +917,18 @@ async function handleRetrain() {
         
         const data = await response.json();
         
-        if (response.ok) {
-            alert(`✅ Model Retrained Successfully!\n\nTotal Records Used: ${data.total_records}\nLast Training: ${new Date(data.last_train_time).toLocaleString()}\n\nThe model is now trained on all historical data for more accurate predictions!`);
+        if (response.ok || response.status === 409) {
+            // Retraining runs in the background - poll the job until it finishes
+            const job = await waitForRetrainJob(data.job.job_id, retrainBtn);
             
-            // Reload stats to show updated information
-            loadStats();
+            if (job.status === 'completed') {
+                alert(`✅ Model Retrained Successfully!\n\nTotal Records Used: ${job.result.total_records}\nLast Training: ${new Date(job.result.last_train_time).toLocaleString()}\n\nThe model is now trained on all historical data for more accurate predictions!`);
+                
+                // Reload stats to show updated information
+                loadStats();
+            } else {
+                alert('❌ Retraining ' + job.status + ': ' + (job.error || 'Unknown error'));
+            }
         } else {
             alert('❌ Retraining failed: ' + (data.error || 'Unknown error'));
         }
@@ -0,0 +1,103 @@
+"""Parity tests for the flat forest inference backend
+
+FlatForest must give exactly what RandomForestRegressor.predict gives for
+every forest the app can publish: a single fit, one grown in warm-start
+steps as train_model does, and one extended with extra trees as
+build_incremental_bundle does. Inputs include random rows and rows whose
+values sit exactly on, just below and just above split thresholds, where
+a float32/float64 mismatch would send a row down the wrong branch.
+
+Usage:
+    python -m pytest -q test_flat_forest.py
+"""
+import copy
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import app
+
+N_FEATURES = 8
+FOREST_PARAMS = dict(app.FOREST_PARAMS, n_jobs=1)
+
+def make_data(n_rows, seed):
+    """Encoded-looking rows: small integer codes mixed with continuous features"""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.integers(18, 65, n_rows),
+        rng.integers(0, 2, n_rows),
+        rng.normal(30, 6, n_rows),
+        rng.integers(80, 140, n_rows),
+        rng.integers(0, 2, n_rows),
+        rng.integers(0, 5, n_rows),
+        rng.integers(0, 2, n_rows),
+        rng.integers(0, 4, n_rows)
+    ]).astype(np.float32)
+    y = 2000 + 250 * X[:, 0] + 400 * X[:, 2] + 20000 * X[:, 6] + rng.normal(0, 1500, n_rows)
+    return X, y
+
+def edge_rows(forest, X, max_rows=3000):
+    """Rows with one feature set exactly at a split threshold, and one float32 step either side"""
+    rng = np.random.default_rng(7)
+    rows = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        split = tree.children_left != -1
+        for feature, threshold in zip(tree.feature[split], tree.threshold[split]):
+            at = np.float32(threshold)
+            for value in (at, np.nextafter(at, np.float32(-np.inf)), np.nextafter(at, np.float32(np.inf))):
+                row = X[rng.integers(len(X))].copy()
+                row[feature] = value
+                rows.append(row)
+    rows = np.array(rows, dtype=np.float32)
+    if len(rows) > max_rows:
+        rows = rows[rng.choice(len(rows), max_rows, replace=False)]
+    return rows
+
+def assert_parity(forest, X):
+    # Same tolerance as make_predictor: only the order of the leaf mean differs, a wrong branch is off by far more
+    flat = app.FlatForest(forest)
+    np.testing.assert_allclose(flat.predict(X), forest.predict(X), rtol=1e-9, atol=1e-6)
+
+@pytest.fixture(scope='module')
+def data():
+    return make_data(2000, seed=1)
+
+def test_single_fit(data):
+    X, y = data
+    forest = RandomForestRegressor(n_estimators=30, **FOREST_PARAMS).fit(X, y)
+    X_random, _ = make_data(500, seed=2)
+    assert_parity(forest, X_random)
+    assert_parity(forest, edge_rows(forest, X))
+
+def test_warm_started(data):
+    X, y = data
+    forest = RandomForestRegressor(n_estimators=0, warm_start=True, **FOREST_PARAMS)
+    for grown in (10, 20, 35):
+        forest.set_params(n_estimators=grown)
+        forest.fit(X, y)
+    forest.set_params(warm_start=False)
+    assert len(forest.estimators_) == 35
+    assert_parity(forest, X[:500])
+    assert_parity(forest, edge_rows(forest, X))
+
+def test_incrementally_extended(data):
+    X, y = data
+    base = RandomForestRegressor(n_estimators=30, **FOREST_PARAMS).fit(X, y)
+    X_new, y_new = make_data(400, seed=3)
+    params = dict(base.get_params(), n_estimators=12, warm_start=False, random_state=99)
+    extra = RandomForestRegressor(**params).fit(X_new, y_new)
+    
+    # Same splice as build_incremental_bundle: append the new trees, drop the oldest
+    forest = copy.copy(base)
+    forest.estimators_ = (list(base.estimators_) + list(extra.estimators_))[-35:]
+    forest.n_estimators = len(forest.estimators_)
+    assert_parity(forest, np.vstack([X[:250], X_new[:250]]))
+    assert_parity(forest, edge_rows(forest, np.vstack([X, X_new])))
+
+def test_rejects_wrong_width(data):
+    X, y = data
+    forest = RandomForestRegressor(n_estimators=5, **FOREST_PARAMS).fit(X, y)
+    with pytest.raises(ValueError):
+        app.FlatForest(forest).predict(X[:, :N_FEATURES - 1])
@@ -0,0 +1,109 @@
+"""Tests for the write-behind prediction writer's spill and replay path
+
+Each test runs against a temporary SQLite storage and MODEL_DIR, so no
+database server is needed.
+
+Usage:
+    python -m pytest -q test_prediction_writer.py
+"""
+import json
+import os
+import time
+
+import pytest
+
+import app
+
+ROW = (40, 'male', 30.0, 120, 'No', 1, 'Yes', 'southeast', 27000.0)
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    storage = app.SQLiteStorage(str(tmp_path / 'predictions.db'))
+    storage.connected = storage.init()
+    monkeypatch.setattr(app, 'storage', storage)
+    monkeypatch.setattr(app, 'MODEL_DIR', str(tmp_path / 'models'))
+    return storage
+
+def count_rows(storage):
+    with storage.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM insurance_predictions').fetchone()[0]
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+
+def test_spill_while_disconnected_then_replay(sqlite_storage, tmp_path):
+    spill_path = str(tmp_path / 'spill.jsonl')
+    writer = app.PredictionWriter(batch_size=10, flush_interval=0.05, spill_path=spill_path, replay_interval=0.2)
+    # The database stays unreachable, re-probes included, until the test brings it back
+    database_up = False
+    init = sqlite_storage.init
+    sqlite_storage.init = lambda: database_up and init()
+    sqlite_storage.connected = False
+    try:
+        for _ in range(25):
+            assert writer.enqueue(ROW)
+        deadline = time.monotonic() + 10
+        while writer.stats()['spilled'] < 25 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert writer.stats()['spilled'] == 25
+        assert count_rows(sqlite_storage) == 0
+        
+        # The writer re-probes the database by itself and replays the spill file
+        database_up = True
+        while writer.stats()['replayed'] < 25 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        writer.stop()
+    
+    assert sqlite_storage.connected
+    assert count_rows(sqlite_storage) == 25
+    assert not os.path.exists(spill_path)
+    assert not os.path.exists(spill_path + '.replay')
+
+def test_resume_interrupted_replay_from_offset(sqlite_storage, tmp_path):
+    spill_path = str(tmp_path / 'spill.jsonl')
+    write_lines(spill_path + '.replay', [json.dumps(list(ROW)) + '\n'] * 35)
+    # A previous replay handed the first 20 rows to the database before stopping
+    write_lines(spill_path + '.replay.offset', ['20'])
+    
+    writer = app.PredictionWriter(batch_size=10, spill_path=spill_path)
+    assert writer.replay_spill() == 15
+    assert count_rows(sqlite_storage) == 15
+    assert not os.path.exists(spill_path + '.replay')
+    assert not os.path.exists(spill_path + '.replay.offset')
+
+def test_failed_insert_keeps_rest_in_replay_file(sqlite_storage, tmp_path, monkeypatch):
+    spill_path = str(tmp_path / 'spill.jsonl')
+    write_lines(spill_path, [json.dumps(list(ROW)) + '\n'] * 35)
+    insert = app.insert_predictions_bulk
+    calls = []
+    
+    def flaky_insert(rows):
+        calls.append(len(rows))
+        if len(calls) == 3:
+            raise ConnectionError('database went away')
+        return insert(rows)
+    
+    monkeypatch.setattr(app, 'insert_predictions_bulk', flaky_insert)
+    writer = app.PredictionWriter(batch_size=10, spill_path=spill_path)
+    assert writer.replay_spill() == 20
+    assert not os.path.exists(spill_path)
+    with open(spill_path + '.replay.offset', encoding='utf-8') as f:
+        assert f.read() == '20'
+    
+    assert writer.replay_spill() == 15
+    assert count_rows(sqlite_storage) == 35
+
+def test_truncated_last_line_is_set_aside(sqlite_storage, tmp_path):
+    spill_path = str(tmp_path / 'spill.jsonl')
+    truncated = json.dumps(list(ROW))[:12]
+    write_lines(spill_path, [json.dumps(list(ROW)) + '\n'] * 3 + [truncated])
+    
+    writer = app.PredictionWriter(batch_size=10, spill_path=spill_path)
+    assert writer.replay_spill() == 3
+    assert count_rows(sqlite_storage) == 3
+    with open(spill_path + '.bad', encoding='utf-8') as f:
+        assert f.read() == truncated + '\n'
+    assert not os.path.exists(spill_path + '.replay')
+    assert writer.replay_spill() == 0